@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
+import json
+import math
+import asyncio
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 
-from backend.core.state import PredictionRequest, PredictionResult, TopStocksResponse
+from backend.core.state import (
+    PredictionRequest, PredictionResult, TopStocksResponse, BatchPredictionRequest, MultiTimeframePredictionRequest,
+    JobRequest
+)
+from backend.core.jobs import JobQueue, FINISHED_STATUSES
 from backend.core.utils import StockDataFetcher, validate_symbol
 from backend.core.indicators import TechnicalIndicators
-from backend.core.llm_manager import get_llm_analyzer, get_gpt_status
-from backend.graph.pipeline import StockPredictionPipeline
+from backend.core.expressions import compile_expressions, ExpressionError
+from backend.core.precision import get_precision, check_precision_mode
+from backend.core.llm_manager import (
+    get_llm_analyzer, get_gpt_status, get_llm_readiness, start_llm_readiness_probe, stop_llm_readiness_probe
+)
+from backend.core.llm_cache import llm_cache
+from backend.core.llm_scheduler import llm_scheduler, LLMOverloaded
+from backend.core.indicator_cache import indicator_cache
+from backend.core.prediction_cache import prediction_cache
+from backend.core.prompting import prompt_stats
+from backend.graph.pipeline import StockPredictionPipeline, ANALYSIS_MODES
 
 # 加载环境变量
 load_dotenv()
@@ -34,7 +52,55 @@ app.add_middleware(
 data_fetcher = StockDataFetcher()
 indicators_calculator = TechnicalIndicators()
 prediction_pipeline = StockPredictionPipeline()
-llm_analyzer = get_llm_analyzer()
+job_queue = JobQueue(prediction_pipeline)
+
+# 各任务类型的参数模型
+JOB_PARAM_MODELS = {
+    "predict": PredictionRequest,
+    "multi": MultiTimeframePredictionRequest,
+    "batch": BatchPredictionRequest,
+}
+
+
+@app.on_event("startup")
+async def verify_precision_mode():
+    """float32 模式启动时与 float64 对比指标精度"""
+    if get_precision() == "float32":
+        report = check_precision_mode()
+        if report["passed"]:
+            print(f"✅ float32 精度模式校验通过 (最大误差: {report['max_error']:.2e})")
+        else:
+            print(f"⚠️ float32 精度模式误差超限: {report['failed']} (容差: {report['tolerance']})")
+
+
+@app.on_event("startup")
+async def warm_up_feature_workers():
+    """预热特征计算进程池（首个请求无需等待子进程启动）"""
+    await asyncio.to_thread(prediction_pipeline.feature_engineer_node.warm_up)
+
+
+@app.on_event("startup")
+async def start_llm_probe():
+    """后台探测 LLM 就绪状态（启动不等待模型服务，就绪前 auto 模式使用规则分析）"""
+    start_llm_readiness_probe()
+
+
+@app.on_event("shutdown")
+async def stop_llm_probe():
+    """停止 LLM 就绪探测"""
+    stop_llm_readiness_probe()
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    """启动预测任务 worker"""
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    """停止预测任务 worker（运行中的任务下次启动时继续执行）"""
+    await job_queue.stop()
 
 
 @app.get("/")
@@ -53,10 +119,17 @@ async def health_check():
     return {"status": "healthy", "timestamp": "2024-01-01T00:00:00Z"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：LLM 就绪探测成功时返回 200，否则返回 503（服务本身可用，见 /health）"""
+    readiness = get_llm_readiness()
+    return JSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
+
+
 @app.get("/api/gpt-status")
 async def gpt_status():
     """GPT模型状态检查"""
-    status = get_gpt_status()
+    status = await asyncio.to_thread(get_gpt_status)
     return {
         "gpt_available": status["available"],
         "model": status.get("model"),
@@ -66,38 +139,92 @@ async def gpt_status():
     }
 
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """各级缓存统计（指标缓存、预测结果缓存、LLM 分析结果缓存）"""
+    return {
+        "indicators": indicator_cache.stats(),
+        "predictions": prediction_cache.stats(),
+        "llm": await asyncio.to_thread(llm_cache.stats)
+    }
+
+
+@app.get("/api/llm/metrics")
+async def get_llm_metrics():
+    """LLM 调度统计（当前并发、排队深度，各优先级的准入、拒绝、超时次数和排队等待时间）"""
+    return llm_scheduler.stats()
+
+
+@app.get("/api/prompt-stats")
+async def get_prompt_stats():
+    """LLM 提示词 token 统计（每次调用的估计值和模型返回的实际值）"""
+    return prompt_stats.stats()
+
+
 @app.get("/api/stock/{symbol}")
-async def get_stock_data(symbol: str):
-    """获取股票数据"""
+async def get_stock_data(symbol: str, expr: Optional[List[str]] = Query(None)):
+    """获取股票数据（expr 为可选的自定义指标表达式，如 sma(close,10)/sma(close,50)）"""
     if not validate_symbol(symbol):
         raise HTTPException(status_code=400, detail="Invalid stock symbol")
     
+    # 预先编译自定义指标表达式，语法错误直接返回 400
+    if expr:
+        try:
+            compile_expressions(expr)
+        except ExpressionError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid indicator expression: {str(e)}")
+    
     try:
-        # 获取股票数据
-        data = data_fetcher.fetch_stock_data_sync(symbol.upper())
-        stock_info = data_fetcher.get_stock_info_sync(symbol.upper())
-        
-        # 计算技术指标
-        indicators = indicators_calculator.calculate_all_indicators(data)
-        signal_strength = indicators_calculator.get_signal_strength(indicators)
+        # 并发获取股票数据和基本信息（直接 await，不阻塞事件循环）
+        data, stock_info = await asyncio.gather(
+            data_fetcher.fetch_stock_data(symbol.upper()),
+            data_fetcher.get_stock_info(symbol.upper())
+        )
         
-        # 计算支撑阻力位
-        support_resistance = indicators_calculator.calculate_support_resistance(data)
-        
-        return {
-            "symbol": symbol.upper(),
-            "info": stock_info,
-            "data": data.tail(30).to_dict('records'),  # 返回最近30天数据
-            "indicators": {k: float(v.iloc[-1]) if hasattr(v, 'iloc') and len(v) > 0 else float(v) 
-                          for k, v in indicators.items() if not (hasattr(v, 'empty') and v.empty)},
-            "signal_strength": signal_strength,
-            "support_resistance": support_resistance
-        }
+        # 指标计算为 CPU 密集操作，放到线程中执行
+        return await asyncio.to_thread(_build_stock_response, symbol.upper(), data, stock_info, expr)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch stock data: {str(e)}")
 
 
+def _build_stock_response(symbol: str, data: pd.DataFrame, stock_info: Dict[str, Any],
+                          expr: Optional[List[str]]) -> Dict[str, Any]:
+    """计算指标并组装 /api/stock 响应"""
+    # 计算技术指标
+    indicators = indicators_calculator.calculate_all_indicators_cached(data, symbol.upper())
+    signal_strength = indicators_calculator.get_signal_strength(indicators)
+    
+    # 计算支撑阻力位
+    support_resistance = indicators_calculator.calculate_support_resistance(data)
+    support_resistance_levels = indicators_calculator.calculate_support_resistance_levels(data)
+    
+    # 自定义指标（返回最新值）
+    custom_indicators = {}
+    if expr:
+        custom_values = indicators_calculator.calculate_custom_indicators(data, expr, symbol.upper())
+        for name, series in custom_values.items():
+            latest = series.iloc[-1] if len(series) > 0 else None
+            custom_indicators[name] = float(latest) if latest is not None and not pd.isna(latest) else None
+    
+    return {
+        "symbol": symbol.upper(),
+        "info": stock_info,
+        "data": data.tail(30).to_dict('records'),  # 返回最近30天数据
+        "indicators": {k: _latest_value(v) for k, v in indicators.items() if not (hasattr(v, 'empty') and v.empty)},
+        "signal_strength": signal_strength,
+        "support_resistance": support_resistance,
+        "support_resistance_levels": support_resistance_levels,
+        "custom_indicators": custom_indicators
+    }
+
+
+def _latest_value(value: Any) -> Optional[float]:
+    """指标最新值（数据不足形成的 NaN 返回 None，保证响应可 JSON 序列化）"""
+    latest = value.iloc[-1] if hasattr(value, 'iloc') else value
+    return None if pd.isna(latest) else float(latest)
+
+
 @app.post("/api/predict", response_model=PredictionResult)
 async def predict_stock(request: PredictionRequest):
     """预测股票走势"""
@@ -107,28 +234,178 @@ async def predict_stock(request: PredictionRequest):
     if request.timeframe not in ["1h", "1d", "1w"]:
         raise HTTPException(status_code=400, detail="Invalid timeframe")
     
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    
     try:
         # 使用 LangGraph 工作流进行预测
-        result = await prediction_pipeline.predict(request.symbol, request.timeframe)
+        result = await prediction_pipeline.predict(request.symbol, request.timeframe, mode=request.mode)
         
+        if result.get("retry_after") is not None:
+            raise _overloaded(result["error"], result["retry_after"])
         if result.get("error"):
             raise HTTPException(status_code=500, detail=result["error"])
         
-        return PredictionResult(
-            symbol=request.symbol.upper(),
-            timeframe=request.timeframe,
-            direction=result["direction"],
-            probability=result["probability"],
-            price_range=result["price_range"],
-            confidence=result["confidence"],
-            reasoning=result["reasoning"],
-            risk_warning="本预测仅用于学习研究目的，不构成投资建议。投资有风险，入市需谨慎。"
-        )
+        return _prediction_result(request, result)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+def _overloaded(detail: str, retry_after: int) -> HTTPException:
+    """LLM 排队已满或排队超时：返回 503，Retry-After 为建议的重试间隔（秒）"""
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(int(retry_after))})
+
+
+def _prediction_result(request: PredictionRequest, result: Dict[str, Any]) -> PredictionResult:
+    """由工作流结果构建预测响应"""
+    return PredictionResult(
+        symbol=request.symbol.upper(),
+        timeframe=request.timeframe,
+        direction=result["direction"],
+        probability=result["probability"],
+        price_range=result["price_range"],
+        confidence=result["confidence"],
+        reasoning=result["reasoning"],
+        risk_warning="本预测仅用于学习研究目的，不构成投资建议。投资有风险，入市需谨慎。",
+        analyzer=result.get("analyzer", "llm")
+    )
+
+
+def _json_safe(value: Any) -> Any:
+    """转换为可 JSON 序列化的值（NaN / inf 转为 None，numpy 标量转为 Python 类型）"""
+    if isinstance(value, dict):
+        return {str(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+@app.post("/api/predict/stream")
+async def predict_stock_stream(request: PredictionRequest):
+    """流式预测（Server-Sent Events）：节点进度、LLM 输出片段和已生成的结果字段，最后为预测结果"""
+    if not validate_symbol(request.symbol):
+        raise HTTPException(status_code=400, detail="Invalid stock symbol")
+    
+    if request.timeframe not in ["1h", "1d", "1w"]:
+        raise HTTPException(status_code=400, detail="Invalid timeframe")
+    
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    
+    async def _events():
+        async for event in prediction_pipeline.predict_stream(request.symbol, request.timeframe, request.mode):
+            if event["event"] == "result":
+                event = {**event, "data": _prediction_result(request, event["data"]).model_dump()}
+            payload = json.dumps(_json_safe(event), ensure_ascii=False, default=str)
+            yield f"event: {event['event']}\ndata: {payload}\n\n"
+    
+    # 关闭代理缓冲，保证事件即时送达
+    return StreamingResponse(_events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/predict/multi")
+async def predict_multi(request: MultiTimeframePredictionRequest):
+    """同一股票多个时间框架一次预测（共享数据获取，各时间框架并行分析）"""
+    if not validate_symbol(request.symbol):
+        raise HTTPException(status_code=400, detail="Invalid stock symbol")
+    
+    if not request.timeframes or any(tf not in ["1h", "1d", "1w"] for tf in request.timeframes):
+        raise HTTPException(status_code=400, detail="Invalid timeframe")
+    
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    
+    result = await prediction_pipeline.predict_multi(request.symbol, request.timeframes, mode=request.mode)
+    if result.get("error"):
+        raise HTTPException(status_code=500, detail=result["error"])
+    
+    return result
+
+
+@app.post("/api/predict/batch")
+async def predict_batch(request: BatchPredictionRequest):
+    """批量预测（NDJSON 流式返回，每完成一个 (股票, 时间框架) 输出一行）"""
+    invalid = [symbol for symbol in request.symbols if not validate_symbol(symbol)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid stock symbols: {', '.join(invalid)}")
+    
+    if not request.symbols or any(tf not in ["1h", "1d", "1w"] for tf in request.timeframes):
+        raise HTTPException(status_code=400, detail="Invalid timeframe")
+    
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    
+    pairs = [(symbol, timeframe) for symbol in request.symbols for timeframe in request.timeframes]
+    
+    async def _stream():
+        async for result in prediction_pipeline.predict_many(pairs, request.max_concurrency, request.mode):
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """提交预测任务，立即返回任务 ID（通过 /api/jobs/{job_id} 查询状态和结果）"""
+    model = JOB_PARAM_MODELS.get(request.kind)
+    if model is None:
+        raise HTTPException(status_code=400, detail=f"Invalid job kind: {request.kind}")
+    
+    try:
+        params = model.model_validate(request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid job params: {str(e)}")
+    
+    symbols = params.symbols if hasattr(params, "symbols") else [params.symbol]
+    timeframes = params.timeframes if hasattr(params, "timeframes") else [params.timeframe]
+    invalid = [symbol for symbol in symbols if not validate_symbol(symbol)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid stock symbols: {', '.join(invalid)}")
+    
+    if any(tf not in ["1h", "1d", "1w"] for tf in timeframes):
+        raise HTTPException(status_code=400, detail="Invalid timeframe")
+    
+    if params.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    
+    job_id = job_queue.submit(request.kind, params.model_dump(), request.max_attempts)
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/api/jobs/metrics")
+async def get_job_metrics():
+    """任务队列指标（各状态任务数、排队深度、等待时间）"""
+    return job_queue.metrics()
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态和结果"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _json_safe(job)
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消任务（排队中的任务立即取消，运行中的任务中断执行）"""
+    status = job_queue.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status in FINISHED_STATUSES and status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job already {status}")
+    return {"job_id": job_id, "status": "cancelled" if status == "cancelled" else "cancelling"}
+
+
 @app.get("/api/top-stocks", response_model=TopStocksResponse)
 async def get_top_stocks():
     """获取Top 10股票建议"""
@@ -141,7 +418,13 @@ async def get_top_stocks():
         
         # 使用 LLM 生成建议
         print(f"Generating top stocks with market data: {market_data}")
-        result = llm_analyzer.generate_top_stocks(market_data)
+        llm_analyzer = get_llm_analyzer()
+        # Top 推荐按 batch 优先级排队，不挤占交互式预测
+        async with llm_scheduler.aslot("batch"):
+            if hasattr(llm_analyzer, "agenerate_top_stocks"):
+                result = await llm_analyzer.agenerate_top_stocks(market_data)
+            else:
+                result = await asyncio.to_thread(llm_analyzer.generate_top_stocks, market_data)
         print(f"LLM result: {result}")
         
         # 检查是否有错误
@@ -155,6 +438,10 @@ async def get_top_stocks():
             disclaimer=result["disclaimer"]
         )
         
+    except LLMOverloaded as e:
+        raise _overloaded(str(e), e.retry_after)
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e) if str(e) else "Unknown error occurred"
         print(f"Top stocks generation error: {error_msg}")
@@ -73,9 +73,19 @@ class APIManager:
         logger.error(f"All APIs failed for {symbol}")
         return pd.DataFrame()
     
+    async def get_stock_data_batch(self, symbols: List[str], period: str = "1mo") -> Dict[str, pd.DataFrame]:
+        """批量获取股票数据（yfinance 一次请求多只股票），未取到的股票不在结果中"""
+        if not symbols:
+            return {}
+        try:
+            return await self._get_yfinance_batch(symbols, period)
+        except Exception as e:
+            logger.warning(f"yfinance batch download failed for {len(symbols)} symbols: {str(e)}")
+            return {}
+
     async def get_stock_info(self, symbol: str) -> Dict[str, Any]:
         """获取股票基本信息"""
-        
+
         for api_name in self.api_priority:
             try:
                 if api_name == 'yfinance':
@@ -112,6 +122,34 @@ class APIManager:
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(None, _fetch)
     
+    async def _get_yfinance_batch(self, symbols: List[str], period: str) -> Dict[str, pd.DataFrame]:
+        """使用 yfinance.download 批量获取数据（复权价格和列与 _get_yfinance_data 一致，共用同一缓存）"""
+        def _fetch():
+            data = yf.download(symbols, period=period, group_by="ticker", threads=True,
+                               auto_adjust=True, actions=True, ignore_tz=False, progress=False)
+            results = {}
+            if data is None or data.empty:
+                return results
+            for symbol in symbols:
+                if isinstance(data.columns, pd.MultiIndex):
+                    if symbol not in data.columns.get_level_values(0):
+                        continue
+                    frame = data[symbol]
+                elif len(symbols) == 1:
+                    frame = data
+                else:
+                    continue
+                frame = frame.dropna(how="all")
+                if frame.empty:
+                    continue
+                frame = frame.reset_index()
+                frame.columns = [str(col).lower() for col in frame.columns]
+                results[symbol] = frame
+            return results
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, _fetch)
+
     async def _get_yfinance_info(self, symbol: str) -> Dict[str, Any]:
         """使用yfinance获取股票信息"""
         def _fetch():
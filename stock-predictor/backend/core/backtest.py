@@ -0,0 +1,203 @@
+"""
+向量化回测引擎
+
+在历史面板（字段 -> 日期 × 股票 的 DataFrame）上模拟信号强度策略的持仓、交易成本和滑点，
+所有计算都在整个面板上一次完成，不需要逐只股票、逐根K线循环，也不经过 LangGraph 工作流。
+"""
+from typing import Dict, Any, Callable, Optional, Union
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from .expressions import compile_expressions
+from .indicators import TechnicalIndicators
+
+
+class SignalRules(BaseModel):
+    """信号强度策略参数（默认值与 TechnicalIndicators 一致）"""
+    rsi_window: int = 14
+    rsi_oversold: float = 30
+    rsi_overbought: float = 70
+    sma_fast: int = 5
+    sma_slow: int = 20
+    macd_fast: int = 12
+    macd_slow: int = 26
+    macd_signal: int = 9
+    bb_window: int = 20
+    bb_std: float = 2.0
+    long_threshold: float = 1      # 得分 >= 阈值时做多
+    short_threshold: float = -1    # 得分 <= 阈值时做空（allow_short=True 时）
+    allow_short: bool = False
+
+    def expressions(self) -> Dict[str, str]:
+        """策略所需指标的表达式"""
+        macd = f"ema(close,{self.macd_fast})-ema(close,{self.macd_slow})"
+        return {
+            "rsi": f"rsi(close,{self.rsi_window})",
+            "macd": macd,
+            "macd_signal": f"ema({macd},{self.macd_signal})",
+            "sma_5": f"sma(close,{self.sma_fast})",
+            "sma_20": f"sma(close,{self.sma_slow})",
+            "bb_upper": f"sma(close,{self.bb_window})+{self.bb_std}*std(close,{self.bb_window})",
+            "bb_lower": f"sma(close,{self.bb_window})-{self.bb_std}*std(close,{self.bb_window})",
+        }
+
+
+# 信号定义：策略参数，或 面板 -> 持仓/得分 DataFrame 的函数
+SignalDefinition = Union[SignalRules, Callable[[Dict[str, pd.DataFrame]], pd.DataFrame]]
+
+
+def panel_from_frames(frames: Dict[str, pd.DataFrame],
+                      fields=("open", "high", "low", "close", "volume")) -> Dict[str, pd.DataFrame]:
+    """将 股票 -> OHLCV DataFrame 转换为 字段 -> 日期 × 股票 面板"""
+    panel = {}
+    for field in fields:
+        columns = {}
+        for symbol, df in frames.items():
+            if df is None or df.empty or field not in df.columns:
+                continue
+            dates = df['date'] if 'date' in df.columns else df.index
+            columns[symbol] = pd.Series(df[field].to_numpy(), index=pd.DatetimeIndex(dates))
+        if columns:
+            panel[field] = pd.DataFrame(columns).sort_index()
+    return panel
+
+
+class VectorizedBacktester:
+    """信号强度策略向量化回测"""
+
+    def __init__(self, cost_bps: float = 5.0, slippage_bps: float = 5.0, periods_per_year: int = 252):
+        self.cost_bps = cost_bps
+        self.slippage_bps = slippage_bps
+        self.periods_per_year = periods_per_year
+
+    def signal_scores(self, panel: Dict[str, pd.DataFrame], rules: SignalRules) -> pd.DataFrame:
+        """面板上的信号强度得分（日期 × 股票）"""
+        close = panel["close"]
+        names = rules.expressions()
+        program = compile_expressions(list(names.values()))
+        values = program.evaluate({"close": close})
+        indicators = {key: values[expr] for key, expr in zip(names, program.expressions)}
+        result = TechnicalIndicators.signal_strength_arrays(
+            **{key: series.to_numpy() for key, series in indicators.items()},
+            rsi_oversold=rules.rsi_oversold,
+            rsi_overbought=rules.rsi_overbought
+        )
+        score = pd.DataFrame(result["score"], index=close.index, columns=close.columns)
+        # 指标尚未形成（预热期）的K线不交易
+        warm = np.isfinite(indicators["rsi"].to_numpy()) & np.isfinite(indicators["sma_20"].to_numpy()) \
+            & np.isfinite(indicators["macd_signal"].to_numpy())
+        return score.where(warm)
+
+    def positions_from_scores(self, score: pd.DataFrame, rules: SignalRules) -> pd.DataFrame:
+        """得分 -> 目标持仓（+1 / 0 / -1）"""
+        values = score.to_numpy()
+        position = np.where(values >= rules.long_threshold, 1.0, 0.0)
+        if rules.allow_short:
+            position = np.where(values <= rules.short_threshold, -1.0, position)
+        position[np.isnan(values)] = 0.0
+        return pd.DataFrame(position, index=score.index, columns=score.columns)
+
+    def run(self, panel: Dict[str, pd.DataFrame], signal: Optional[SignalDefinition] = None) -> Dict[str, Any]:
+        """执行回测
+
+        signal 为 SignalRules 时按信号强度规则生成持仓；为函数时其返回值直接作为目标持仓。
+        第 t 根K线收盘形成的持仓承担第 t+1 根K线的收益，换手按成本+滑点扣除。
+        """
+        close = panel["close"].astype(float)
+        if close.empty:
+            return {"error": "Empty panel"}
+
+        signal = signal if signal is not None else SignalRules()
+        if isinstance(signal, SignalRules):
+            position = self.positions_from_scores(self.signal_scores(panel, signal), signal)
+        else:
+            position = signal(panel).reindex_like(close).fillna(0.0)
+
+        pos = position.to_numpy(dtype=float)
+        px = close.to_numpy()
+        held, net, turnover, valid = self.simulate(px, pos)
+        return self._report(close, pos, held, net, turnover, valid)
+
+    def simulate(self, px: np.ndarray, pos: np.ndarray):
+        """按目标持仓模拟逐K线净收益（数组接口，供参数扫描复用）"""
+        asset_returns = np.full_like(px, np.nan, dtype=float)
+        asset_returns[1:] = px[1:] / px[:-1] - 1
+
+        # 持仓滞后一根K线
+        held = np.zeros_like(pos)
+        held[1:] = pos[:-1]
+        turnover = np.abs(np.diff(pos, axis=0, prepend=0.0))
+        cost_rate = (self.cost_bps + self.slippage_bps) / 1e4
+
+        valid = np.isfinite(asset_returns)
+        gross = np.where(valid, held * np.nan_to_num(asset_returns), 0.0)
+        net = gross - turnover * cost_rate
+        return held, net, turnover, valid
+
+    def summarize(self, held: np.ndarray, net: np.ndarray, turnover: np.ndarray,
+                  valid: np.ndarray) -> Dict[str, Any]:
+        """组合层面的收益、胜率、回撤与换手"""
+        portfolio = _portfolio_returns(net, valid)
+        equity = np.cumprod(1 + portfolio)
+
+        invested = held != 0
+        wins = (net > 0) & invested
+        n_periods = len(portfolio)
+        n_symbols = net.shape[1] if net.ndim > 1 else 1
+        years = n_periods / self.periods_per_year if n_periods else 0
+
+        total_return = float(equity[-1] - 1)
+        volatility = float(portfolio.std() * np.sqrt(self.periods_per_year))
+        return {
+            "total_return": total_return,
+            "annualized_return": float((1 + total_return) ** (1 / years) - 1) if years > 0 and total_return > -1 else 0.0,
+            "annualized_volatility": volatility,
+            "sharpe": float(portfolio.mean() * self.periods_per_year / volatility) if volatility > 0 else 0.0,
+            "max_drawdown": float(_max_drawdown(equity[:, None])[0]),
+            "hit_rate": float(wins.sum() / invested.sum()) if invested.any() else 0.0,
+            "turnover": float(turnover.sum() / max(n_periods, 1) / max(n_symbols, 1)),
+            "exposure": float(invested.mean()),
+            "trades": int((turnover > 0).sum()),
+            "periods": n_periods,
+            "symbols": int(n_symbols)
+        }
+
+    def _report(self, close: pd.DataFrame, pos: np.ndarray, held: np.ndarray, net: np.ndarray,
+                turnover: np.ndarray, valid: np.ndarray) -> Dict[str, Any]:
+        """汇总收益、胜率、回撤与换手"""
+        summary = self.summarize(held, net, turnover, valid)
+        equity_curve = np.cumprod(1 + _portfolio_returns(net, valid))
+
+        invested = held != 0
+        wins = (net > 0) & invested
+        n_periods = len(net)
+        symbol_equity = np.cumprod(1 + net, axis=0)
+        invested_count = invested.sum(axis=0)
+        per_symbol = pd.DataFrame({
+            "total_return": symbol_equity[-1] - 1,
+            "hit_rate": np.divide(wins.sum(axis=0), invested_count,
+                                  out=np.zeros(net.shape[1]), where=invested_count > 0),
+            "max_drawdown": _max_drawdown(symbol_equity),
+            "turnover": turnover.sum(axis=0) / max(n_periods, 1),
+            "trades": (turnover > 0).sum(axis=0)
+        }, index=close.columns)
+
+        return {
+            "summary": summary,
+            "per_symbol": per_symbol,
+            "equity_curve": pd.Series(equity_curve, index=close.index),
+            "positions": pd.DataFrame(pos, index=close.index, columns=close.columns)
+        }
+
+
+def _portfolio_returns(net: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """组合收益：对当期有数据的股票等权"""
+    active = valid.sum(axis=1)
+    return np.divide(net.sum(axis=1), active, out=np.zeros(len(net)), where=active > 0)
+
+
+def _max_drawdown(equity: np.ndarray) -> np.ndarray:
+    """按列计算最大回撤（负数）"""
+    peaks = np.maximum.accumulate(equity, axis=0)
+    return (equity / peaks - 1).min(axis=0)
@@ -0,0 +1,373 @@
+"""
+自定义指标表达式引擎
+
+支持在 OHLCV 列上书写指标表达式，例如::
+
+    sma(close,10)/sma(close,50)
+    zscore(volume,20)
+    (close-min(low,14))/(max(high,14)-min(low,14))
+
+多个表达式会被编译为同一张依赖图，相同的子表达式（如共享的滚动窗口）只计算一次。
+同一张图既可以在单只股票（DataFrame，每列一个字段）上求值，也可以在面板数据
+（字段 -> 日期 × 股票 的 DataFrame）上一次性向量化求值。编译结果带缓存。
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Set, Tuple, Union, Sequence
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+MAX_WINDOW = 10000
+# 单个表达式的最大长度和嵌套深度（括号、函数调用、负号），防止解析和编译时递归过深
+MAX_EXPRESSION_LENGTH = 500
+MAX_DEPTH = 32
+
+
+class ExpressionError(ValueError):
+    """表达式语法或参数错误"""
+
+
+# ---------------------------------------------------------------------------
+# 词法与语法分析
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z_][A-Za-z_0-9]*)|(.))")
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    for number, name, op in _TOKEN_RE.findall(text):
+        if number:
+            tokens.append(("num", number))
+        elif name:
+            tokens.append(("name", name.lower()))
+        elif op.strip():
+            if op not in "+-*/(),":
+                raise ExpressionError(f"Unexpected character '{op}'")
+            tokens.append(("op", op))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器，产出嵌套元组形式的语法树"""
+
+    def __init__(self, text: str):
+        if len(text) > MAX_EXPRESSION_LENGTH:
+            raise ExpressionError(f"Expression longer than {MAX_EXPRESSION_LENGTH} characters")
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.depth = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        node = self._expr()
+        if self.pos != len(self.tokens):
+            raise ExpressionError(f"Unexpected token '{self.tokens[self.pos][1]}' in '{self.text}'")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        kind, tok = self._peek()
+        if kind is None:
+            raise ExpressionError(f"Unexpected end of expression '{self.text}'")
+        if value is not None and tok != value:
+            raise ExpressionError(f"Expected '{value}' in '{self.text}'")
+        self.pos += 1
+        return kind, tok
+
+    def _expr(self):
+        node = self._term()
+        while self._peek()[1] in ("+", "-"):
+            _, op = self._take()
+            node = ("add" if op == "+" else "sub", node, self._term())
+        return node
+
+    def _term(self):
+        node = self._unary()
+        while self._peek()[1] in ("*", "/"):
+            _, op = self._take()
+            node = ("mul" if op == "*" else "div", node, self._unary())
+        return node
+
+    def _unary(self):
+        # 每层括号、函数参数和负号都经过此处，在此限制嵌套深度
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise ExpressionError(f"Expression nested deeper than {MAX_DEPTH} levels")
+        try:
+            if self._peek()[1] == "-":
+                self._take()
+                return ("neg", self._unary())
+            return self._primary()
+        finally:
+            self.depth -= 1
+
+    def _primary(self):
+        kind, tok = self._take()
+        if kind == "num":
+            return ("const", float(tok))
+        if tok == "(":
+            node = self._expr()
+            self._take(")")
+            return node
+        if kind == "name":
+            if self._peek()[1] == "(":
+                self._take("(")
+                args = [self._expr()]
+                while self._peek()[1] == ",":
+                    self._take(",")
+                    args.append(self._expr())
+                self._take(")")
+                return ("call", tok, tuple(args))
+            if tok in COLUMNS:
+                return ("col", tok)
+            raise ExpressionError(f"Unknown column '{tok}', expected one of {', '.join(COLUMNS)}")
+        raise ExpressionError(f"Unexpected token '{tok}' in '{self.text}'")
+
+
+# ---------------------------------------------------------------------------
+# 函数定义
+# ---------------------------------------------------------------------------
+
+# 窗口函数：f(x, n)
+_WINDOW_FUNCS = {"sma", "ema", "std", "min", "max", "sum", "shift", "rsi"}
+# 可选周期函数：f(x[, n])，默认 n=1
+_PERIOD_FUNCS = {"diff", "pct_change"}
+# 一元函数：f(x)
+_UNARY_FUNCS = {"abs", "log", "sqrt"}
+# 组合函数：在编译时展开为基础节点，便于共享子表达式
+_MACRO_FUNCS = {"zscore"}
+
+
+def _window_arg(name: str, node) -> int:
+    if node[0] != "const" or node[1] != int(node[1]) or not 1 <= node[1] <= MAX_WINDOW:
+        raise ExpressionError(f"{name}() window must be an integer between 1 and {MAX_WINDOW}")
+    return int(node[1])
+
+
+class CompiledExpressions:
+    """编译后的表达式依赖图
+
+    nodes 按拓扑顺序排列，每个节点为 (op, 参数...)，子节点以节点编号引用；
+    结构相同的节点只会出现一次。表达式及函数的输入必须依赖至少一列（纯常数在编译时报错）。
+    """
+
+    def __init__(self, expressions: Sequence[str]):
+        self.expressions = tuple(expressions)
+        self.nodes: List[Tuple] = []
+        self._ids: Dict[Tuple, int] = {}
+        # 依赖数据列的节点编号
+        self._series: Set[int] = set()
+        self.outputs: Dict[str, int] = {}
+        for text in self.expressions:
+            idx = self._lower(_Parser(text).parse())
+            if idx not in self._series:
+                raise ExpressionError(f"Expression '{text}' must reference at least one column")
+            self.outputs[text] = idx
+        self._last_use = self._compute_last_use()
+
+    def _intern(self, node: Tuple) -> int:
+        """哈希合并：结构相同的节点复用同一编号"""
+        if node not in self._ids:
+            idx = len(self.nodes)
+            self._ids[node] = idx
+            self.nodes.append(node)
+            if node[0] == "col" or any(child in self._series for child in _children(node)):
+                self._series.add(idx)
+        return self._ids[node]
+
+    def _series_arg(self, name: str, ast) -> int:
+        """函数的输入：必须依赖数据列"""
+        idx = self._lower(ast)
+        if idx not in self._series:
+            raise ExpressionError(f"{name}() input must reference at least one column")
+        return idx
+
+    def _lower(self, ast) -> int:
+        kind = ast[0]
+        if kind in ("const", "col"):
+            return self._intern(ast)
+        if kind == "neg":
+            return self._intern(("neg", self._lower(ast[1])))
+        if kind in ("add", "sub", "mul", "div"):
+            return self._intern((kind, self._lower(ast[1]), self._lower(ast[2])))
+
+        _, name, args = ast
+        if name in _WINDOW_FUNCS or name in _MACRO_FUNCS:
+            if len(args) != 2:
+                raise ExpressionError(f"{name}() takes 2 arguments: {name}(x, window)")
+            x, window = self._series_arg(name, args[0]), _window_arg(name, args[1])
+            if name == "zscore":
+                mean = self._intern(("sma", x, window))
+                std = self._intern(("std", x, window))
+                return self._intern(("div", self._intern(("sub", x, mean)), std))
+            return self._intern((name, x, window))
+        if name in _PERIOD_FUNCS:
+            if len(args) not in (1, 2):
+                raise ExpressionError(f"{name}() takes 1 or 2 arguments: {name}(x[, periods])")
+            periods = _window_arg(name, args[1]) if len(args) == 2 else 1
+            return self._intern((name, self._series_arg(name, args[0]), periods))
+        if name in _UNARY_FUNCS:
+            if len(args) != 1:
+                raise ExpressionError(f"{name}() takes 1 argument")
+            return self._intern((name, self._series_arg(name, args[0])))
+        raise ExpressionError(f"Unknown function '{name}'")
+
+    def _compute_last_use(self) -> List[int]:
+        """每个节点最后一次被引用的位置，求值时据此及早释放中间结果"""
+        last_use = list(range(len(self.nodes)))
+        for idx, node in enumerate(self.nodes):
+            for child in _children(node):
+                last_use[child] = max(last_use[child], idx)
+        for idx in self.outputs.values():
+            last_use[idx] = len(self.nodes)
+        return last_use
+
+    def evaluate(self, data: Union[pd.DataFrame, Dict[str, pd.DataFrame]]) -> Dict[str, Any]:
+        """在单只股票或面板数据上求值，返回 表达式 -> Series/DataFrame"""
+        values: Dict[int, Any] = {}
+        for idx, node in enumerate(self.nodes):
+            values[idx] = _evaluate_node(node, values, data)
+            # 释放不再被引用的中间结果
+            for child in _children(node):
+                if self._last_use[child] == idx and child in values:
+                    del values[child]
+        results = {text: values[idx] for text, idx in self.outputs.items()}
+        # float32 输入保持 float32 输出
+        if _is_float32(data):
+            results = {
+                text: value.astype(np.float32) if hasattr(value, "astype") else value
+                for text, value in results.items()
+            }
+        return results
+
+
+def _children(node: Tuple) -> Tuple[int, ...]:
+    """节点引用的子节点编号（窗口/周期参数不是子节点）"""
+    op = node[0]
+    if op in ("const", "col"):
+        return ()
+    if op in ("add", "sub", "mul", "div"):
+        return (node[1], node[2])
+    return (node[1],)
+
+
+def _column(data, name: str):
+    if isinstance(data, dict):
+        if name not in data:
+            raise ExpressionError(f"Column '{name}' not available")
+        return _as_float(data[name])
+    if isinstance(data.columns, pd.MultiIndex):
+        return _as_float(data[name])
+    if name not in data.columns:
+        raise ExpressionError(f"Column '{name}' not available")
+    return _as_float(data[name])
+
+
+def _as_float(values):
+    """转为浮点；float32 输入保持 float32"""
+    dtypes = values.dtypes if isinstance(values, pd.DataFrame) else [values.dtype]
+    if all(dtype == np.float32 for dtype in dtypes):
+        return values
+    return values.astype(float)
+
+
+def _is_float32(data) -> bool:
+    """输入数据是否为 float32 精度（以 close 列为准）"""
+    try:
+        close = data["close"]
+    except (KeyError, TypeError):
+        return False
+    dtypes = close.dtypes if isinstance(close, pd.DataFrame) else [close.dtype]
+    return all(dtype == np.float32 for dtype in dtypes)
+
+
+def _rsi(x, window: int):
+    """Wilder RSI（与 ta.momentum.rsi 一致）"""
+    delta = x.diff()
+    up = delta.where(delta > 0, 0.0).ewm(alpha=1 / window, min_periods=window, adjust=False).mean()
+    down = (-delta.where(delta < 0, 0.0)).ewm(alpha=1 / window, min_periods=window, adjust=False).mean()
+    rsi = 100 - 100 / (1 + up / down)
+    return rsi.where(down != 0, 100).where(up.notna())
+
+
+def _evaluate_node(node: Tuple, values: Dict[int, Any], data):
+    op = node[0]
+    if op == "const":
+        return node[1]
+    if op == "col":
+        return _column(data, node[1])
+    if op == "neg":
+        return -values[node[1]]
+    if op in ("add", "sub", "mul", "div"):
+        left, right = values[node[1]], values[node[2]]
+        if op == "add":
+            return left + right
+        if op == "sub":
+            return left - right
+        if op == "mul":
+            return left * right
+        # 除零得到 NaN 而不是 inf
+        if isinstance(right, (pd.Series, pd.DataFrame)):
+            right = right.replace(0, np.nan)
+        elif right == 0:
+            right = np.nan
+        return left / right
+
+    x = values[node[1]]
+    if op == "sma":
+        return x.rolling(node[2], min_periods=node[2]).mean()
+    if op == "ema":
+        return x.ewm(span=node[2], min_periods=node[2], adjust=False).mean()
+    if op == "std":
+        # 总体标准差（与布林带一致）
+        return x.rolling(node[2], min_periods=node[2]).std(ddof=0)
+    if op == "min":
+        return x.rolling(node[2], min_periods=node[2]).min()
+    if op == "max":
+        return x.rolling(node[2], min_periods=node[2]).max()
+    if op == "sum":
+        return x.rolling(node[2], min_periods=node[2]).sum()
+    if op == "shift":
+        return x.shift(node[2])
+    if op == "rsi":
+        return _rsi(x, node[2])
+    if op == "diff":
+        return x.diff(node[2])
+    if op == "pct_change":
+        return x.pct_change(periods=node[2])
+    if op == "abs":
+        return x.abs()
+    if op == "log":
+        return np.log(x.where(x > 0))
+    if op == "sqrt":
+        return np.sqrt(x.where(x >= 0))
+    raise ExpressionError(f"Unsupported operation '{op}'")
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(expressions: Tuple[str, ...]) -> CompiledExpressions:
+    return CompiledExpressions(expressions)
+
+
+def compile_expressions(expressions: Union[str, Sequence[str]]) -> CompiledExpressions:
+    """编译一个或多个表达式（结果带缓存）"""
+    if isinstance(expressions, str):
+        expressions = [expressions]
+    normalized = tuple(re.sub(r"\s+", "", e) for e in expressions)
+    try:
+        return _compile_cached(normalized)
+    except RecursionError:
+        raise ExpressionError("Expression is too deeply nested") from None
+
+
+def evaluate_expressions(expressions: Union[str, Sequence[str]],
+                         data: Union[pd.DataFrame, Dict[str, pd.DataFrame]]) -> Dict[str, Any]:
+    """编译（命中缓存）并求值"""
+    return compile_expressions(expressions).evaluate(data)
@@ -0,0 +1,108 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+def data_fingerprint(symbol: str, df: pd.DataFrame) -> str:
+    """生成数据指纹：代码 + K线数量 + 最后日期 + 最后一行哈希"""
+    if df is None or df.empty:
+        return f"{symbol.upper()}:0"
+
+    # 最后日期（date列优先，否则使用索引）
+    if 'date' in df.columns:
+        last_date = df['date'].iloc[-1]
+    else:
+        last_date = df.index[-1]
+
+    # 只对OHLCV列取哈希，避免缓存时间戳等辅助列影响指纹（按列取最后一个值，不复制整表）
+    value_columns = [col for col in ['open', 'high', 'low', 'close', 'volume'] if col in df.columns]
+    if value_columns:
+        last_values = np.array([df[col].iloc[-1] for col in value_columns], dtype=np.float64)
+        row_hash = hashlib.blake2b(last_values.tobytes(), digest_size=8).hexdigest()
+    else:
+        row_hash = f"{int(pd.util.hash_pandas_object(df.iloc[[-1]], index=False).iloc[0]):016x}"
+
+    return f"{symbol.upper()}:{len(df)}:{pd.Timestamp(last_date).isoformat()}:{row_hash}"
+
+
+def _shallow_copy(value: Any) -> Any:
+    """字典结果返回浅拷贝：调用方增删键不影响缓存条目"""
+    return dict(value) if isinstance(value, dict) else value
+
+
+class IndicatorCache:
+    """技术指标结果缓存（LRU，按数据指纹失效）
+
+    返回的字典为浅拷贝，其中的 Series 与缓存共享，调用方只读、不得原地修改。
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: str, kind: str = "indicators") -> Optional[Any]:
+        """获取缓存结果"""
+        key = (kind, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _shallow_copy(self._entries[key])
+            self.misses += 1
+        return None
+
+    def put(self, fingerprint: str, value: Any, kind: str = "indicators"):
+        """写入缓存结果"""
+        key = (kind, fingerprint)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            # 超出容量时淘汰最久未使用的条目
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, symbol: str, df: pd.DataFrame, compute: Callable[[], Any],
+                       kind: str = "indicators") -> Any:
+        """命中则直接返回，否则计算并缓存
+
+        新K线追加后 K线数量/最后日期/最后一行哈希 会改变，旧条目不再命中，
+        随后按LRU被淘汰。
+        """
+        fingerprint = data_fingerprint(symbol, df)
+        cached = self.get(fingerprint, kind)
+        if cached is not None:
+            return cached
+
+        value = compute()
+        # 空结果（数据不足）不缓存
+        if value:
+            self.put(fingerprint, value, kind)
+        return _shallow_copy(value)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# 全局指标缓存实例
+indicator_cache = IndicatorCache(max_entries=int(os.getenv("INDICATOR_CACHE_SIZE", "128")))
@@ -1,12 +1,58 @@
 import pandas as pd
 import numpy as np
 import ta
-from typing import Dict, Any
+from typing import Dict, Any, Sequence
+from .indicator_cache import indicator_cache
+from .expressions import compile_expressions
+from .precision import cast_indicators
+from .levels import SupportResistanceEngine
+
+
+# calculate_all_indicators 输出的指标名称（固定顺序，供批量/并行计算分配输出）
+INDICATOR_NAMES = (
+    'sma_5', 'sma_10', 'sma_20', 'sma_50', 'ema_12', 'ema_26',
+    'macd', 'macd_signal', 'macd_histogram', 'rsi',
+    'bb_upper', 'bb_middle', 'bb_lower', 'bb_width',
+    'stoch_k', 'stoch_d', 'williams_r', 'volume_sma', 'volume_ema',
+    'atr', 'price_change', 'price_change_5d', 'volatility',
+)
+
+# 向量化信号标记与 get_signal_strength 中文信号名称的对应关系
+SIGNAL_LABELS = {
+    "rsi_oversold": "RSI超卖",
+    "rsi_overbought": "RSI超买",
+    "macd_golden_cross": "MACD金叉",
+    "macd_death_cross": "MACD死叉",
+    "sma_cross_up": "短期均线上穿长期均线",
+    "sma_cross_down": "短期均线下穿长期均线",
+    "bb_squeeze": "布林带收窄",
+}
 
 
 class TechnicalIndicators:
     """技术指标计算器"""
     
+    @staticmethod
+    def calculate_all_indicators_cached(df: pd.DataFrame, symbol: str) -> Dict[str, Any]:
+        """计算所有技术指标（按数据指纹缓存）"""
+        return indicator_cache.get_or_compute(
+            symbol, df, lambda: TechnicalIndicators.calculate_all_indicators(df)
+        )
+    
+    @staticmethod
+    def calculate_custom_indicators(df: pd.DataFrame, expressions: Sequence[str],
+                                    symbol: str = None) -> Dict[str, Any]:
+        """计算自定义指标表达式（传入 symbol 时按数据指纹缓存）"""
+        program = compile_expressions(expressions)
+        if df.empty:
+            return {}
+        if symbol is None:
+            return program.evaluate(df)
+        return indicator_cache.get_or_compute(
+            symbol, df, lambda: program.evaluate(df),
+            kind="expr:" + "|".join(program.expressions)
+        )
+    
     @staticmethod
     def calculate_all_indicators(df: pd.DataFrame) -> Dict[str, Any]:
         """计算所有技术指标"""
@@ -53,8 +99,8 @@ class TechnicalIndicators:
         indicators['williams_r'] = ta.momentum.williams_r(df['high'], df['low'], df['close'])
         
         # 成交量指标
-        indicators['volume_sma'] = ta.volume.volume_sma(df['close'], df['volume'])
-        indicators['volume_ema'] = ta.volume.volume_ema(df['close'], df['volume'])
+        indicators['volume_sma'] = df['volume'].rolling(window=20).mean()
+        indicators['volume_ema'] = df['volume'].ewm(span=20, adjust=False).mean()
         
         # ATR (平均真实波幅)
         indicators['atr'] = ta.volatility.average_true_range(df['high'], df['low'], df['close'])
@@ -66,20 +112,28 @@ class TechnicalIndicators:
         # 波动率
         indicators['volatility'] = df['close'].rolling(window=20).std()
         
+        # float32 输入保持 float32 输出（ta/rolling 内部会升为 float64）
+        if df['close'].dtype == np.float32:
+            indicators = cast_indicators(indicators, np.float32)
+        
         return indicators
     
     @staticmethod
     def get_signal_strength(indicators: Dict[str, Any], current_idx: int = -1) -> Dict[str, Any]:
         """分析信号强度"""
-        if not indicators or current_idx == -1:
+        if not indicators:
             return {"strength": "neutral", "score": 0, "signals": []}
         
+        def has(*series) -> bool:
+            # current_idx 支持负数下标（默认 -1 即最新一根K线）
+            return all(-len(s) <= current_idx < len(s) for s in series)
+        
         signals = []
         score = 0
         
         # RSI 信号
         rsi = indicators.get('rsi', pd.Series([50]))
-        if len(rsi) > current_idx:
+        if has(rsi):
             rsi_val = rsi.iloc[current_idx]
             if rsi_val < 30:
                 signals.append("RSI超卖")
@@ -91,7 +145,7 @@ class TechnicalIndicators:
         # MACD 信号
         macd = indicators.get('macd', pd.Series([0]))
         macd_signal = indicators.get('macd_signal', pd.Series([0]))
-        if len(macd) > current_idx and len(macd_signal) > current_idx:
+        if has(macd, macd_signal):
             if macd.iloc[current_idx] > macd_signal.iloc[current_idx]:
                 signals.append("MACD金叉")
                 score += 1
@@ -102,7 +156,7 @@ class TechnicalIndicators:
         # 移动平均线信号
         sma_5 = indicators.get('sma_5', pd.Series([0]))
         sma_20 = indicators.get('sma_20', pd.Series([0]))
-        if len(sma_5) > current_idx and len(sma_20) > current_idx:
+        if has(sma_5, sma_20):
             if sma_5.iloc[current_idx] > sma_20.iloc[current_idx]:
                 signals.append("短期均线上穿长期均线")
                 score += 1
@@ -113,7 +167,7 @@ class TechnicalIndicators:
         # 布林带信号
         bb_upper = indicators.get('bb_upper', pd.Series([0]))
         bb_lower = indicators.get('bb_lower', pd.Series([0]))
-        if len(bb_upper) > current_idx and len(bb_lower) > current_idx:
+        if has(bb_upper, bb_lower):
             bb_width = bb_upper.iloc[current_idx] - bb_lower.iloc[current_idx]
             if bb_width > 0:
                 signals.append("布林带收窄")
@@ -137,6 +191,75 @@ class TechnicalIndicators:
             "signals": signals
         }
     
+    @staticmethod
+    def signal_strength_arrays(rsi: Any = None, macd: Any = None, macd_signal: Any = None,
+                               sma_5: Any = None, sma_20: Any = None,
+                               bb_upper: Any = None, bb_lower: Any = None,
+                               rsi_oversold: float = 30, rsi_overbought: float = 70) -> Dict[str, Any]:
+        """向量化信号强度（与 get_signal_strength 规则一致）
+
+        输入可以是一维（单只股票）或二维（日期 × 股票）数组，缺失的指标不参与打分。
+        """
+        arrays = [np.asarray(a, dtype=float) for a in (rsi, macd, macd_signal, sma_5, sma_20, bb_upper, bb_lower)
+                  if a is not None]
+        if not arrays:
+            return {"score": np.zeros(0), "strength": np.array([], dtype=object), "signals": {}}
+        shape = np.broadcast_shapes(*(a.shape for a in arrays))
+
+        score = np.zeros(shape)
+        flags = {}
+        
+        # RSI 信号
+        if rsi is not None:
+            rsi = np.asarray(rsi, dtype=float)
+            flags["rsi_oversold"] = np.broadcast_to(rsi < rsi_oversold, shape)
+            flags["rsi_overbought"] = np.broadcast_to(rsi > rsi_overbought, shape)
+            score += np.where(flags["rsi_oversold"], 2, np.where(flags["rsi_overbought"], -2, 0))
+        
+        # MACD 信号（NaN 与标量版本一致，按死叉处理）
+        if macd is not None and macd_signal is not None:
+            golden = np.broadcast_to(np.asarray(macd, dtype=float) > np.asarray(macd_signal, dtype=float), shape)
+            flags["macd_golden_cross"] = golden
+            flags["macd_death_cross"] = ~golden
+            score += np.where(golden, 1, -1)
+        
+        # 移动平均线信号
+        if sma_5 is not None and sma_20 is not None:
+            above = np.broadcast_to(np.asarray(sma_5, dtype=float) > np.asarray(sma_20, dtype=float), shape)
+            flags["sma_cross_up"] = above
+            flags["sma_cross_down"] = ~above
+            score += np.where(above, 1, -1)
+        
+        # 布林带信号
+        if bb_upper is not None and bb_lower is not None:
+            width = np.asarray(bb_upper, dtype=float) - np.asarray(bb_lower, dtype=float)
+            flags["bb_squeeze"] = np.broadcast_to(width > 0, shape)
+            score += np.where(flags["bb_squeeze"], 0.5, 0)
+        
+        # 确定信号强度
+        strength = np.select(
+            [score >= 3, score >= 1, score <= -3, score <= -1],
+            ["strong_bullish", "bullish", "strong_bearish", "bearish"],
+            default="neutral"
+        ).astype(object)
+        
+        return {
+            "score": score,
+            "strength": strength,
+            "signals": flags
+        }
+    
+    @staticmethod
+    def get_signal_strength_series(indicators: Dict[str, Any]) -> Dict[str, Any]:
+        """全历史信号强度序列（每根K线的得分、强度与信号标记）"""
+        if not indicators:
+            return {"score": np.zeros(0), "strength": np.array([], dtype=object), "signals": {}}
+        
+        keys = ['rsi', 'macd', 'macd_signal', 'sma_5', 'sma_20', 'bb_upper', 'bb_lower']
+        return TechnicalIndicators.signal_strength_arrays(
+            **{key: np.asarray(indicators[key], dtype=float) for key in keys if key in indicators}
+        )
+    
     @staticmethod
     def calculate_support_resistance(df: pd.DataFrame, window: int = 20) -> Dict[str, float]:
         """计算支撑位和阻力位"""
@@ -153,3 +276,17 @@ class TechnicalIndicators:
             "support": float(support),
             "resistance": float(resistance)
         }
+    
+    @staticmethod
+    def calculate_support_resistance_levels(df: pd.DataFrame, windows: Sequence[int] = (10, 20, 50),
+                                            pivot_window: int = 5) -> Dict[str, Any]:
+        """多窗口支撑阻力位与摆动价位区间（最新快照）"""
+        engine = SupportResistanceEngine(windows=windows, pivot_window=pivot_window)
+        return engine.compute(df)["snapshot"]
+    
+    @staticmethod
+    def support_resistance_series(df: pd.DataFrame, windows: Sequence[int] = (10, 20, 50),
+                                  pivot_window: int = 5) -> Dict[str, pd.Series]:
+        """多窗口支撑阻力位完整序列（用于图表）"""
+        engine = SupportResistanceEngine(windows=windows, pivot_window=pivot_window)
+        return engine.compute(df)["series"]
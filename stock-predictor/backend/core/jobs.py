@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from backend.core.llm_scheduler import llm_priority
+
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 支持的任务类型
+JOB_KINDS = ("predict", "multi", "batch")
+
+
+class JobStore:
+    """预测任务持久化队列（SQLite，进程重启后未完成的任务继续执行）
+
+    每次操作只涉及单行的索引读写，直接在调用线程中同步执行。
+    """
+    
+    def __init__(self, db_path: str = "data/jobs.db"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL 模式下写入不阻塞读取，NORMAL 同步级别避免每次提交都刷盘
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, available_at, created_at)")
+    
+    def submit(self, kind: str, params: Dict[str, Any], max_attempts: int = 3) -> str:
+        """新增任务，返回任务 ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, max_attempts, created_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), QUEUED, max_attempts, now, now)
+            )
+        return job_id
+    
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """取出最早的可执行任务并标记为运行中（没有可执行任务时返回 None）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? AND available_at <= ? "
+                "ORDER BY created_at LIMIT 1) RETURNING *",
+                (RUNNING, now, QUEUED, now)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def next_available_at(self) -> Optional[float]:
+        """排队任务中最早可执行的时间（用于等待重试退避结束）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(available_at) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()
+        return row[0]
+    
+    def update_progress(self, job_id: str, completed: int, total: int):
+        """更新任务进度"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ? WHERE id = ?",
+                (json.dumps({"completed": completed, "total": total}), job_id)
+            )
+    
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        """任务成功"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ? WHERE id = ?",
+                (SUCCEEDED, json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id)
+            )
+    
+    def fail(self, job_id: str, error: str, retry_delay: float) -> str:
+        """任务失败：未达到最大尝试次数时延迟后重新排队，返回新状态"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts, max_attempts, cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return FAILED
+            if row["attempts"] < row["max_attempts"] and not row["cancel_requested"]:
+                # 指数退避：第 n 次失败后等待 retry_delay * 2^(n-1) 秒
+                delay = retry_delay * 2 ** (row["attempts"] - 1)
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, available_at = ? WHERE id = ?",
+                    (QUEUED, error, now + delay, job_id)
+                )
+                return QUEUED
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED, error, now, job_id)
+            )
+            return FAILED
+    
+    def cancel(self, job_id: str) -> Optional[str]:
+        """取消任务：排队中的任务直接取消，运行中的任务标记取消请求，返回取消后的状态"""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row["status"] == QUEUED:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?", (CANCELLED, time.time(), job_id)
+                )
+                return CANCELLED
+            if row["status"] == RUNNING:
+                self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return row["status"]
+    
+    def mark_cancelled(self, job_id: str):
+        """运行中的任务已停止"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?", (CANCELLED, time.time(), job_id)
+            )
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def recover(self) -> int:
+        """进程重启后，将上次运行中断的任务重新排队（已请求取消的直接取消），返回重新排队数量"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE status = ? AND cancel_requested = 1",
+                (CANCELLED, now, RUNNING)
+            )
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ? WHERE status = ?", (QUEUED, now, RUNNING)
+            ).rowcount
+    
+    def purge(self, max_age: float) -> int:
+        """删除结束超过 max_age 秒的任务，返回删除数量"""
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._lock:
+            return self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?",
+                (*FINISHED_STATUSES, time.time() - max_age)
+            ).rowcount
+    
+    def stats(self) -> Dict[str, Any]:
+        """队列统计：各状态任务数、可执行的排队深度、最早排队任务的等待时间"""
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            ready, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM jobs WHERE status = ? AND available_at <= ?", (QUEUED, now)
+            ).fetchone()
+            avg_run = self._conn.execute(
+                "SELECT AVG(finished_at - started_at) FROM ("
+                "SELECT finished_at, started_at FROM jobs WHERE status = ? ORDER BY finished_at DESC LIMIT 100)",
+                (SUCCEEDED,)
+            ).fetchone()[0]
+        return {
+            "counts": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, *FINISHED_STATUSES)},
+            "queue_depth": counts.get(QUEUED, 0),
+            "ready": ready,
+            "oldest_wait_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "avg_run_seconds": round(avg_run, 3) if avg_run is not None else None
+        }
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for key in ("params", "progress", "result"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+
+class JobQueue:
+    """预测任务队列：固定数量的异步 worker 从 JobStore 中取任务执行 StockPredictionPipeline
+
+    任务结果包含 "error" 或执行抛出异常时按指数退避重试，取消运行中的任务会中断其工作流。
+    """
+    
+    def __init__(self, pipeline, store: Optional[JobStore] = None, workers: Optional[int] = None,
+                 max_attempts: Optional[int] = None, retry_delay: Optional[float] = None):
+        self.pipeline = pipeline
+        self.store = store or JobStore(os.getenv("JOB_DB_PATH", "data/jobs.db"))
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "4"))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv("JOB_RETRY_DELAY", "2"))
+        self.retention = float(os.getenv("JOB_RETENTION_HOURS", "24")) * 3600
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelling: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+    
+    async def start(self):
+        """启动 worker（恢复上次中断的任务，清理过期任务）"""
+        if self._tasks:
+            return
+        recovered = self.store.recover()
+        purged = self.store.purge(self.retention)
+        if recovered or purged:
+            print(f"Job queue: {recovered} interrupted jobs requeued, {purged} expired jobs purged")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        """停止 worker（运行中的任务在下次启动时重新执行）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def submit(self, kind: str, params: Dict[str, Any], max_attempts: Optional[int] = None) -> str:
+        """提交任务，立即返回任务 ID"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unsupported job kind: {kind}")
+        job_id = self.store.submit(kind, params, max_attempts or self.max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态和结果"""
+        return self.store.get(job_id)
+    
+    def cancel(self, job_id: str) -> Optional[str]:
+        """取消任务，返回取消后的状态（任务不存在时返回 None）"""
+        status = self.store.cancel(job_id)
+        task = self._running.get(job_id)
+        if status == RUNNING and task is not None:
+            self._cancelling.add(job_id)
+            task.cancel()
+        return status
+    
+    def metrics(self) -> Dict[str, Any]:
+        """队列指标"""
+        return {
+            **self.store.stats(),
+            "workers": self.workers,
+            "active": len(self._running)
+        }
+    
+    async def _worker(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                await self._wait_for_job()
+                continue
+            
+            task = asyncio.create_task(self._execute(job))
+            self._running[job["id"]] = task
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if job["id"] not in self._cancelling:
+                    # worker 本身被取消（服务停止）：任务保持运行中状态，下次启动时恢复
+                    raise
+                self.store.mark_cancelled(job["id"])
+                continue
+            except Exception as e:
+                result = {"error": f"Job execution failed: {str(e)}"}
+            finally:
+                self._running.pop(job["id"], None)
+                self._cancelling.discard(job["id"])
+            
+            if result.get("error"):
+                # LLM 排队已满时至少等待调度器建议的重试间隔
+                retry_delay = max(self.retry_delay, float(result.get("retry_after") or 0))
+                status = self.store.fail(job["id"], result["error"], retry_delay)
+                if status == QUEUED:
+                    print(f"Job {job['id']} attempt {job['attempts']} failed, retrying: {result['error']}")
+            else:
+                self.store.complete(job["id"], result)
+    
+    async def _wait_for_job(self):
+        """等待新任务提交或重试退避结束"""
+        self._wakeup.clear()
+        next_at = self.store.next_available_at()
+        timeout = max(next_at - time.time(), 0.01) if next_at is not None else None
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _execute(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """执行任务（后台任务的 LLM 调用按 batch 优先级排队）"""
+        llm_priority.set("batch")
+        params = job["params"]
+        mode = params.get("mode", "auto")
+        if job["kind"] == "predict":
+            return await self.pipeline.predict(params["symbol"], params["timeframe"], mode=mode)
+        if job["kind"] == "multi":
+            return await self.pipeline.predict_multi(params["symbol"], params.get("timeframes", ("1h", "1d", "1w")),
+                                                     mode=mode)
+        
+        # 批量任务：单个预测失败记录在结果中，不导致整个任务重试
+        pairs = [(symbol, timeframe) for symbol in params["symbols"] for timeframe in params.get("timeframes", ["1d"])]
+        results = []
+        self.store.update_progress(job["id"], 0, len(pairs))
+        async for result in self.pipeline.predict_many(pairs, params.get("max_concurrency"), mode):
+            results.append(result)
+            self.store.update_progress(job["id"], len(results), len(pairs))
+        return {"results": results}
@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Sequence, Tuple
+
+
+class RollingExtrema:
+    """多窗口滚动极值（稀疏表）
+
+    一次构建 O(n log W) 的稀疏表后，任意窗口的滚动最值都只需两次数组切片，
+    因此请求的窗口数量不影响对历史长度的线性复杂度。
+    """
+
+    def __init__(self, values: np.ndarray, max_window: int, op: str = "max"):
+        self.op = np.maximum if op == "max" else np.minimum
+        self.n = len(values)
+        self.levels = [np.asarray(values, dtype=float)]
+        span = 1
+        while span * 2 <= max_window and span * 2 <= self.n:
+            prev = self.levels[-1]
+            # levels[k][i] = op(values[i : i + 2^k])
+            self.levels.append(self.op(prev[:-span], prev[span:]))
+            span *= 2
+
+    def window(self, window: int) -> np.ndarray:
+        """以每根K线结尾、长度为 window 的滚动最值（不足窗口处为 NaN）"""
+        result = np.full(self.n, np.nan)
+        if window < 1 or window > self.n:
+            return result
+        k = window.bit_length() - 1
+        span = 1 << k
+        table = self.levels[k]
+        count = self.n - window + 1
+        # 窗口 [s, s + window) = [s, s + span) ∪ [s + window - span, s + window)
+        result[window - 1:] = self.op(table[:count], table[window - span:window - span + count])
+        return result
+
+
+class SupportResistanceEngine:
+    """支撑阻力位引擎：多窗口滚动极值 + 摆动高低点 + 价位聚类"""
+
+    def __init__(self, windows: Sequence[int] = (10, 20, 50), pivot_window: int = 5,
+                 cluster_tolerance: float = 0.01, max_zones: int = 5):
+        self.windows = tuple(sorted(set(int(w) for w in windows)))
+        self.pivot_window = pivot_window
+        self.cluster_tolerance = cluster_tolerance
+        self.max_zones = max_zones
+
+    def compute(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """计算最新快照与完整序列"""
+        if df.empty or 'high' not in df.columns or 'low' not in df.columns:
+            return {"snapshot": self._empty_snapshot(), "series": {}}
+
+        high = df['high'].to_numpy(dtype=float)
+        low = df['low'].to_numpy(dtype=float)
+        close = df['close'].to_numpy(dtype=float) if 'close' in df.columns else high
+        index = df.index
+
+        pivot_span = 2 * self.pivot_window + 1
+        max_window = max(self.windows + (pivot_span,))
+        highs = RollingExtrema(high, max_window, op="max")
+        lows = RollingExtrema(low, max_window, op="min")
+
+        # 各窗口的滚动支撑/阻力序列
+        series = {}
+        for window in self.windows:
+            series[f"support_{window}"] = pd.Series(lows.window(window), index=index)
+            series[f"resistance_{window}"] = pd.Series(highs.window(window), index=index)
+
+        # 摆动高低点
+        pivot_high, pivot_low = self._detect_pivots(high, low, highs, lows)
+        series["pivot_high"] = pd.Series(np.where(pivot_high, high, np.nan), index=index)
+        series["pivot_low"] = pd.Series(np.where(pivot_low, low, np.nan), index=index)
+
+        current_price = float(close[-1])
+        zones = self._cluster_levels(
+            np.concatenate([high[pivot_high], low[pivot_low]]),
+            np.concatenate([np.flatnonzero(pivot_high), np.flatnonzero(pivot_low)]),
+            len(df),
+            current_price
+        )
+
+        return {
+            "snapshot": self._build_snapshot(series, zones, current_price),
+            "series": series
+        }
+
+    def _detect_pivots(self, high: np.ndarray, low: np.ndarray,
+                       highs: RollingExtrema, lows: RollingExtrema) -> Tuple[np.ndarray, np.ndarray]:
+        """摆动点：在前后各 pivot_window 根K线中为最高/最低"""
+        k = self.pivot_window
+        n = len(high)
+        pivot_high = np.zeros(n, dtype=bool)
+        pivot_low = np.zeros(n, dtype=bool)
+        if n < 2 * k + 1:
+            return pivot_high, pivot_low
+
+        # 以 i + k 结尾的 2k+1 窗口即以 i 为中心的窗口
+        centered_max = highs.window(2 * k + 1)[2 * k:]
+        centered_min = lows.window(2 * k + 1)[2 * k:]
+        pivot_high[k:n - k] = high[k:n - k] >= centered_max
+        pivot_low[k:n - k] = low[k:n - k] <= centered_min
+        return pivot_high, pivot_low
+
+    def _cluster_levels(self, prices: np.ndarray, positions: np.ndarray,
+                        n_bars: int, current_price: float) -> List[Dict[str, Any]]:
+        """将相近的摆动价位聚为区间，并按触及次数与新近程度排序"""
+        valid = ~np.isnan(prices)
+        prices, positions = prices[valid], positions[valid]
+        if len(prices) == 0:
+            return []
+
+        order = np.argsort(prices)
+        prices, positions = prices[order], positions[order]
+
+        # 相邻价位的相对间距超过容差即开启新区间
+        gaps = np.diff(prices) / prices[:-1]
+        group = np.concatenate([[0], np.cumsum(gaps > self.cluster_tolerance)])
+        n_groups = int(group[-1]) + 1
+
+        touches = np.bincount(group, minlength=n_groups)
+        center = np.bincount(group, weights=prices, minlength=n_groups) / touches
+        zone_low = np.full(n_groups, np.inf)
+        zone_high = np.full(n_groups, -np.inf)
+        last_seen = np.full(n_groups, -1)
+        np.minimum.at(zone_low, group, prices)
+        np.maximum.at(zone_high, group, prices)
+        np.maximum.at(last_seen, group, positions)
+
+        recency = (last_seen + 1) / max(n_bars, 1)
+        score = touches + recency
+
+        zones = []
+        for g in np.argsort(-score)[:self.max_zones]:
+            zones.append({
+                "type": "support" if center[g] <= current_price else "resistance",
+                "low": float(zone_low[g]),
+                "high": float(zone_high[g]),
+                "level": float(center[g]),
+                "touches": int(touches[g]),
+                "last_index": int(last_seen[g]),
+                "score": round(float(score[g]), 4)
+            })
+        return zones
+
+    def _build_snapshot(self, series: Dict[str, pd.Series], zones: List[Dict[str, Any]],
+                        current_price: float) -> Dict[str, Any]:
+        """最新快照"""
+        windows = {}
+        for window in self.windows:
+            support = series[f"support_{window}"].iloc[-1]
+            resistance = series[f"resistance_{window}"].iloc[-1]
+            windows[str(window)] = {
+                "support": float(support) if not pd.isna(support) else 0,
+                "resistance": float(resistance) if not pd.isna(resistance) else 0
+            }
+
+        supports = [z["level"] for z in zones if z["type"] == "support"]
+        resistances = [z["level"] for z in zones if z["type"] == "resistance"]
+
+        return {
+            "current_price": current_price,
+            "windows": windows,
+            "nearest_support": max(supports) if supports else None,
+            "nearest_resistance": min(resistances) if resistances else None,
+            "zones": zones
+        }
+
+    def _empty_snapshot(self) -> Dict[str, Any]:
+        return {
+            "current_price": 0,
+            "windows": {str(w): {"support": 0, "resistance": 0} for w in self.windows},
+            "nearest_support": None,
+            "nearest_resistance": None,
+            "zones": []
+        }
+
+
+# 默认引擎实例
+support_resistance_engine = SupportResistanceEngine()
@@ -1,14 +1,26 @@
 import os
+import copy
 import json
 import random
-from typing import Dict, Any, Optional
+import asyncio
+import weakref
+from contextlib import aclosing, closing
+from typing import Dict, Any, Callable, List, Optional
 from datetime import datetime
 import pandas as pd
 import openai
 from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 from dotenv import load_dotenv
 import ollama
+from backend.core.llm_cache import llm_cache
+from backend.core.prompting import (
+    PROMPT_TEMPLATE_VERSION, ANALYSIS_SYSTEM_PROMPT, build_analysis_prompt, select_features, estimate_tokens, prompt_stats
+)
+from backend.core.llm_batch import (
+    BatchSizer, BATCH_SYSTEM_PROMPT, OUTPUT_TOKENS_PER_ITEM, analyze_batch, aanalyze_batch
+)
+from backend.core.llm_stream import AnalysisStream
 
 # 加载环境变量
 load_dotenv()
@@ -36,8 +48,10 @@ class MockLLM:
             ]
         }
     
-    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
-        """分析股票并返回预测结果"""
+    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                      on_token: Optional[Callable[[str], None]] = None,
+                      on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """分析股票并返回预测结果（on_token 逐段接收分析文本，on_field 接收结果字段）"""
         # 基于技术指标生成模拟分析
         indicators = data.get('indicators', {})
         signal_strength = data.get('signal_strength', {})
@@ -60,8 +74,11 @@ class MockLLM:
         
         # 选择对应的分析文本
         analysis_text = random.choice(self.responses.get(direction, self.responses['neutral']))
+        if on_token is not None:
+            for start in range(0, len(analysis_text), 8):
+                on_token(analysis_text[start:start + 8])
         
-        return {
+        result = {
             "direction": direction,
             "probability": round(probability, 1),
             "price_change_percent": round(price_change, 1),
@@ -73,6 +90,28 @@ class MockLLM:
                 "基本面因素未考虑在内"
             ]
         }
+        if on_field is not None:
+            for field, value in result.items():
+                on_field(field, value)
+        return result
+    
+    def probe(self) -> bool:
+        """就绪探测：模拟分析器始终可用"""
+        return True
+    
+    async def aanalyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                             on_token: Optional[Callable[[str], None]] = None,
+                             on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """分析股票（异步版本，模拟结果直接生成）"""
+        return self.analyze_stock(symbol, data, timeframe, on_token=on_token, on_field=on_field)
+    
+    def analyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票（items 为 {"symbol", "timeframe", "data"}，结果与 items 一一对应）"""
+        return [self.analyze_stock(item["symbol"], item["data"], item["timeframe"]) for item in items]
+    
+    async def aanalyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票（异步版本）"""
+        return self.analyze_stocks(items)
     
     def generate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
         """生成Top 10股票建议"""
@@ -123,120 +162,295 @@ class MockLLM:
             "generated_at": datetime.now().isoformat(),
             "disclaimer": "本建议仅用于学习研究目的，不构成投资建议。投资有风险，入市需谨慎。"
         }
+    
+    async def agenerate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
+        """生成Top 10股票建议（异步版本）"""
+        return self.generate_top_stocks(market_data)
 
 
-class OllamaLLM:
+# 输出无法解析且无法修复时的分析结果
+PARSE_FAILURE_RESULT = {
+    "direction": "neutral",
+    "probability": 50.0,
+    "price_change_percent": 0.0,
+    "reasoning": "技术分析结果解析失败，建议谨慎操作。",
+    "confidence": "low",
+    "risk_factors": ["数据解析异常"]
+}
+
+
+class CachedAnalysisMixin:
+    """单只股票分析的结果缓存与输出解析（Ollama 和 OpenAI 分析器共用，子类提供 cache_model）"""
+    
+    def _cache_key(self, symbol: str, data: Dict[str, Any], timeframe: str) -> str:
+        """LLM 结果缓存键"""
+        return llm_cache.make_key(self.cache_model, PROMPT_TEMPLATE_VERSION, symbol, timeframe,
+                                  select_features(data), data.get('signal_strength', {}))
+    
+    @staticmethod
+    def _replay_cached(cached: Optional[Dict[str, Any]], on_token: Optional[Callable[[str], None]] = None,
+                       on_field: Optional[Callable[[str, Any], None]] = None) -> Optional[Dict[str, Any]]:
+        """命中缓存且需要流式输出时一次性回调缓存的结果"""
+        if cached is not None and on_token is not None:
+            on_token(json.dumps(cached, ensure_ascii=False))
+        if cached is not None and on_field is not None:
+            for field, value in cached.items():
+                on_field(field, value)
+        return cached
+    
+    def _cached_analysis(self, cache_key: str, on_token: Optional[Callable[[str], None]] = None,
+                         on_field: Optional[Callable[[str, Any], None]] = None) -> Optional[Dict[str, Any]]:
+        """查询缓存"""
+        return self._replay_cached(llm_cache.get(cache_key), on_token, on_field)
+    
+    async def _acached_analysis(self, cache_key: str, on_token: Optional[Callable[[str], None]] = None,
+                                on_field: Optional[Callable[[str, Any], None]] = None) -> Optional[Dict[str, Any]]:
+        """查询缓存（异步版本，SQLite 读写不在事件循环中执行）"""
+        return self._replay_cached(await llm_cache.aget(cache_key), on_token, on_field)
+    
+    @staticmethod
+    def _stream_result(stream: AnalysisStream, symbol: str) -> Optional[Dict[str, Any]]:
+        """流式输出的解析结果（截断或格式有误的输出先尝试修复，无法修复时为 None）"""
+        result, repaired = stream.result()
+        if repaired and result is not None:
+            print(f"Repaired malformed LLM output for {symbol}")
+        return result
+    
+    def _parse_analysis(self, stream: AnalysisStream, cache_key: str, symbol: str, timeframe: str) -> Dict[str, Any]:
+        """解析流式输出，解析成功的结果写入缓存（无法修复时返回默认结果）"""
+        result = self._stream_result(stream, symbol)
+        if result is None:
+            return copy.deepcopy(PARSE_FAILURE_RESULT)
+        llm_cache.put(cache_key, self.cache_model, symbol, timeframe, result)
+        return result
+    
+    async def _aparse_analysis(self, stream: AnalysisStream, cache_key: str, symbol: str, timeframe: str) -> Dict[str, Any]:
+        """解析流式输出（异步版本）"""
+        result = self._stream_result(stream, symbol)
+        if result is None:
+            return copy.deepcopy(PARSE_FAILURE_RESULT)
+        await llm_cache.aput(cache_key, self.cache_model, symbol, timeframe, result)
+        return result
+
+
+class OllamaLLM(CachedAnalysisMixin):
     """Ollama 本地 LLM 分析器"""
     
-    def __init__(self, model_name: str = "qwen2.5:7b"):
+    def __init__(self, model_name: str = "qwen2.5:7b", timeout: Optional[float] = None):
         self.model_name = model_name
+        # 异步调用的单次超时（秒）
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "60"))
         self.llm = None
-        self._initialize_llm()
+        # 批量分析的上下文长度（未配置时按 Ollama 默认的 4096 估算，且不覆盖服务端设置）
+        self.context_tokens = int(os.getenv("LLM_CONTEXT_TOKENS") or 0)
+        self.batch_sizer = BatchSizer(max_size=int(os.getenv("LLM_BATCH_SIZE", "8")),
+                                      context_tokens=self.context_tokens or 4096)
+        # 异步客户端按事件循环各自创建（连接池不能跨事件循环使用）
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ollama.AsyncClient]" = \
+            weakref.WeakKeyDictionary()
+        # 创建实例时不访问模型服务：可用性由后台就绪探测或首次调用时检查
+        self.probe_timeout = float(os.getenv("LLM_PROBE_TIMEOUT", "5"))
+        self.last_error: Optional[str] = None
     
     def _initialize_llm(self):
-        """初始化Ollama LLM实例"""
+        """检查Ollama模型是否可用（只查询已安装的模型列表，不进行生成）"""
         try:
-            # 检查模型是否可用
-            models = ollama.list()
+            models = ollama.Client(timeout=self.probe_timeout).list()
             available_models = [model.model for model in models.models]
             
             if self.model_name not in available_models:
-                print(f"❌ 模型 {self.model_name} 未找到，可用模型: {available_models}")
+                error = f"模型 {self.model_name} 未找到"
+                if error != self.last_error:
+                    print(f"❌ 模型 {self.model_name} 未找到，可用模型: {available_models}")
+                self.last_error = error
                 self.llm = None
                 return
             
-            # 测试连接
-            test_response = ollama.chat(
-                model=self.model_name,
-                messages=[{'role': 'user', 'content': 'Hello'}]
-            )
-            
+            # 后台就绪探测会定期重复检查，只在状态变化时输出
+            if not self.llm:
+                print(f"✅ Ollama模型初始化成功: {self.model_name}")
             self.llm = True  # 标记为可用
-            print(f"✅ Ollama模型初始化成功: {self.model_name}")
+            self.last_error = None
             
         except Exception as e:
-            print(f"❌ Ollama模型初始化失败: {str(e)}")
+            if str(e) != self.last_error:
+                print(f"❌ Ollama模型初始化失败: {str(e)}")
+            self.last_error = str(e)
             self.llm = None
     
+    def probe(self) -> bool:
+        """就绪探测：模型服务可访问且模型已安装"""
+        self._initialize_llm()
+        return self.llm is not None
+    
     def _check_and_reinitialize(self):
         """检查并重新初始化LLM"""
         if not self.llm:
             print("🔄 重新初始化Ollama模型...")
             self._initialize_llm()
     
-    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
-        """使用 Ollama 分析股票"""
+    @property
+    def cache_model(self) -> str:
+        """LLM 结果缓存中的模型标识"""
+        return f"ollama:{self.model_name}"
+    
+    def _get_async_client(self) -> ollama.AsyncClient:
+        """当前事件循环的异步客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = ollama.AsyncClient()
+            self._async_clients[loop] = client
+        return client
+    
+    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                      on_token: Optional[Callable[[str], None]] = None,
+                      on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """使用 Ollama 分析股票（on_token 逐段接收模型输出，on_field 接收生成完毕的结果字段）"""
+        # 指标变化不大时直接复用缓存的分析结果
+        cache_key = self._cache_key(symbol, data, timeframe)
+        cached = self._cached_analysis(cache_key, on_token, on_field)
+        if cached is not None:
+            return cached
+        
         # 检查并重新初始化LLM
         self._check_and_reinitialize()
         
         if not self.llm:
-            return {
-                "error": "Ollama model not available",
-                "direction": None,
-                "probability": None,
-                "price_change_percent": None,
-                "reasoning": None,
-                "confidence": None
-            }
+            return self._analysis_error()
         
         try:
-            # 构建分析提示
-            indicators_summary = self._format_indicators(data.get('indicators', {}))
-            signal_info = data.get('signal_strength', {})
+            messages = self._analysis_messages(symbol, data, timeframe)
+            stream = AnalysisStream(on_token, on_field)
+            response = None
+            # 流式读取并增量解析，必需字段生成完毕后关闭连接，模型服务随即停止生成
+            with closing(ollama.chat(model=self.model_name, messages=messages, stream=True)) as chunks:
+                for response in chunks:
+                    if stream.feed(response['message']['content']):
+                        break
+            # 完整输出的最后一段带有 token 统计
+            self._record_prompt("analysis", messages, response)
             
-            prompt = f"""
-作为专业的股票分析师，请基于以下技术指标数据对股票 {symbol} 进行 {timeframe} 时间框架的分析：
-
-技术指标摘要：
-{indicators_summary}
-
-信号强度：{signal_info.get('strength', 'neutral')}
-信号得分：{signal_info.get('score', 0)}
-
-请以JSON格式返回分析结果，包含以下字段：
-- direction: "up", "down", 或 "neutral"
-- probability: 0-100之间的数字，表示预测准确性的概率
-- price_change_percent: 预期价格变化百分比
-- reasoning: 详细的分析理由（中文）
-- confidence: "high", "medium", 或 "low"
-- risk_factors: 风险因素列表
-
-注意：请保持客观和谨慎，考虑市场风险。
-"""
-            
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {'role': 'system', 'content': '你是一个专业的股票技术分析师，擅长基于技术指标进行股票走势预测。'},
-                    {'role': 'user', 'content': prompt}
-                ]
-            )
-            
-            # 解析响应
-            try:
-                result = json.loads(response['message']['content'])
-                return result
-            except json.JSONDecodeError:
-                # 如果解析失败，返回默认结果
-                return {
-                    "direction": "neutral",
-                    "probability": 50.0,
-                    "price_change_percent": 0.0,
-                    "reasoning": "技术分析结果解析失败，建议谨慎操作。",
-                    "confidence": "low",
-                    "risk_factors": ["数据解析异常"]
-                }
+            return self._parse_analysis(stream, cache_key, symbol, timeframe)
                 
         except Exception as e:
             print(f"Ollama API error: {e}")
-            return {
-                "error": "Ollama model not available",
-                "direction": None,
-                "probability": None,
-                "price_change_percent": None,
-                "reasoning": None,
-                "confidence": None
-            }
+            return self._analysis_error()
+    
+    async def aanalyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                             on_token: Optional[Callable[[str], None]] = None,
+                             on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """使用 Ollama 分析股票（异步版本，超时或任务取消时中止请求）"""
+        cache_key = self._cache_key(symbol, data, timeframe)
+        cached = await self._acached_analysis(cache_key, on_token, on_field)
+        if cached is not None:
+            return cached
+        
+        if not self.llm:
+            # 重新初始化需要同步访问模型服务，在线程中执行
+            await asyncio.to_thread(self._check_and_reinitialize)
+        
+        if not self.llm:
+            return self._analysis_error()
+        
+        try:
+            messages = self._analysis_messages(symbol, data, timeframe)
+            stream = AnalysisStream(on_token, on_field)
+            await asyncio.wait_for(self._astream_analysis(messages, stream), self.timeout)
+            return await self._aparse_analysis(stream, cache_key, symbol, timeframe)
+        
+        except asyncio.TimeoutError:
+            print(f"Ollama API timeout after {self.timeout}s")
+            return self._analysis_error()
+        except Exception as e:
+            print(f"Ollama API error: {e}")
+            return self._analysis_error()
+    
+    async def _achat(self, messages: List[Dict[str, str]], kind: str) -> str:
+        """异步对话请求，返回完整输出文本"""
+        response = await self._get_async_client().chat(model=self.model_name, messages=messages)
+        self._record_prompt(kind, messages, response)
+        return response['message']['content']
+    
+    async def _astream_analysis(self, messages: List[Dict[str, str]], stream: AnalysisStream):
+        """异步流式分析请求：输出逐段交给 stream 解析，必需字段生成完毕后中止请求"""
+        response = None
+        chunks = await self._get_async_client().chat(model=self.model_name, messages=messages, stream=True)
+        async with aclosing(chunks):
+            async for response in chunks:
+                if stream.feed(response['message']['content']):
+                    break
+        self._record_prompt("analysis", messages, response)
+    
+    def _record_prompt(self, kind: str, messages: List[Dict[str, str]], response: Any = None, symbols: int = 1):
+        """记录提示词 token 数（估计值，以及 Ollama 返回的 prompt_eval_count）"""
+        try:
+            actual = response['prompt_eval_count'] if response is not None else None
+        except (KeyError, TypeError):
+            actual = None
+        estimated = sum(estimate_tokens(message['content']) for message in messages)
+        prompt_stats.record(kind, self.cache_model, estimated, actual, symbols)
+    
+    def analyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票：一次请求分析一批（items 为 {"symbol", "timeframe", "data"}，结果与 items 一一对应）"""
+        self._check_and_reinitialize()
+        if not self.llm:
+            return [self._analysis_error() for _ in items]
+        return analyze_batch(self, items)
+    
+    async def aanalyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票（异步版本）"""
+        if not self.llm:
+            await asyncio.to_thread(self._check_and_reinitialize)
+        if not self.llm:
+            return [self._analysis_error() for _ in items]
+        return await aanalyze_batch(self, items)
+    
+    def _batch_messages(self, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {'role': 'system', 'content': BATCH_SYSTEM_PROMPT},
+            {'role': 'user', 'content': prompt}
+        ]
+    
+    def _batch_options(self) -> Optional[Dict[str, Any]]:
+        """配置了上下文长度时随批量请求传给 Ollama"""
+        return {"num_ctx": self.context_tokens} if self.context_tokens else None
+    
+    def _complete_batch(self, prompt: str, size: int) -> str:
+        """批量分析请求"""
+        messages = self._batch_messages(prompt)
+        response = ollama.chat(model=self.model_name, messages=messages, options=self._batch_options())
+        self._record_prompt("batch", messages, response, size)
+        return response['message']['content']
+    
+    async def _acomplete_batch(self, prompt: str, size: int) -> str:
+        """批量分析请求（异步版本）"""
+        messages = self._batch_messages(prompt)
+        response = await asyncio.wait_for(
+            self._get_async_client().chat(model=self.model_name, messages=messages, options=self._batch_options()),
+            self.timeout
+        )
+        self._record_prompt("batch", messages, response, size)
+        return response['message']['content']
+    
+    def _analysis_messages(self, symbol: str, data: Dict[str, Any], timeframe: str) -> List[Dict[str, str]]:
+        """构建分析提示（指标按信息量选取并紧凑编码，见 core/prompting.py）"""
+        return [
+            {'role': 'system', 'content': ANALYSIS_SYSTEM_PROMPT},
+            {'role': 'user', 'content': build_analysis_prompt(symbol, timeframe, data)}
+        ]
+    
+    @staticmethod
+    def _analysis_error() -> Dict[str, Any]:
+        """模型不可用时的分析结果"""
+        return {
+            "error": "Ollama model not available",
+            "direction": None,
+            "probability": None,
+            "price_change_percent": None,
+            "reasoning": None,
+            "confidence": None
+        }
     
     def generate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
         """生成Top 10股票建议"""
@@ -244,15 +458,41 @@ class OllamaLLM:
         self._check_and_reinitialize()
         
         if not self.llm:
-            return {
-                "error": "Ollama model not available",
-                "recommendations": [],
-                "generated_at": None,
-                "disclaimer": None
-            }
+            return self._top_stocks_error()
         
         try:
-            prompt = f"""
+            messages = self._top_stocks_messages()
+            response = ollama.chat(model=self.model_name, messages=messages)
+            self._record_prompt("top_stocks", messages, response)
+            return self._parse_top_stocks(response['message']['content'])
+                
+        except Exception as e:
+            print(f"Ollama API error: {e}")
+            return self._top_stocks_error()
+    
+    async def agenerate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
+        """生成Top 10股票建议（异步版本）"""
+        if not self.llm:
+            await asyncio.to_thread(self._check_and_reinitialize)
+        
+        if not self.llm:
+            return self._top_stocks_error()
+        
+        try:
+            content = await asyncio.wait_for(self._achat(self._top_stocks_messages(), kind="top_stocks"), self.timeout)
+            return self._parse_top_stocks(content)
+        
+        except asyncio.TimeoutError:
+            print(f"Ollama API timeout after {self.timeout}s")
+            return self._top_stocks_error()
+        except Exception as e:
+            print(f"Ollama API error: {e}")
+            return self._top_stocks_error()
+    
+    @staticmethod
+    def _top_stocks_messages() -> List[Dict[str, str]]:
+        """构建推荐提示"""
+        prompt = f"""
 作为专业的投资顾问，请基于当前市场情况推荐10只具有投资潜力的股票。
 
 请以JSON格式返回推荐结果，包含以下字段：
@@ -269,67 +509,63 @@ class OllamaLLM:
 
 注意：请选择知名的大盘股，并保持客观分析。
 """
-            
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {'role': 'system', 'content': '你是一个专业的投资顾问，擅长股票分析和投资建议。'},
-                    {'role': 'user', 'content': prompt}
-                ]
-            )
-            
-            try:
-                result = json.loads(response['message']['content'])
-                return result
-            except json.JSONDecodeError:
-                return {
-                    "error": "Ollama model not available",
-                    "recommendations": [],
-                    "generated_at": None,
-                    "disclaimer": None
-                }
-                
-        except Exception as e:
-            print(f"Ollama API error: {e}")
-            return {
-                "error": "Ollama model not available",
-                "recommendations": [],
-                "generated_at": None,
-                "disclaimer": None
-            }
-    
-    def _format_indicators(self, indicators: Dict[str, Any]) -> str:
-        """格式化技术指标数据"""
-        if not indicators:
-            return "无技术指标数据"
-        
-        summary = []
-        for key, value in indicators.items():
-            if isinstance(value, (int, float)) and not pd.isna(value):
-                summary.append(f"{key}: {value:.2f}")
-            elif hasattr(value, 'iloc') and len(value) > 0:
-                summary.append(f"{key}: {value.iloc[-1]:.2f}")
-        
-        return "\n".join(summary[:10])  # 限制显示前10个指标
+        
+        return [
+            {'role': 'system', 'content': '你是一个专业的投资顾问，擅长股票分析和投资建议。'},
+            {'role': 'user', 'content': prompt}
+        ]
+    
+    def _parse_top_stocks(self, content: str) -> Dict[str, Any]:
+        """解析推荐结果"""
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            return self._top_stocks_error()
+    
+    @staticmethod
+    def _top_stocks_error() -> Dict[str, Any]:
+        """模型不可用时的推荐结果"""
+        return {
+            "error": "Ollama model not available",
+            "recommendations": [],
+            "generated_at": None,
+            "disclaimer": None
+        }
+
 
 
-class OpenAILLM:
+class OpenAILLM(CachedAnalysisMixin):
     """OpenAI LLM 分析器"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, timeout: Optional[float] = None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.model_name = "gpt-3.5-turbo"
+        # 单次调用超时（秒）
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "60"))
+        # 批量分析：gpt-3.5-turbo 上下文 16385，单次输出上限 4096
+        self.batch_sizer = BatchSizer(max_size=int(os.getenv("LLM_BATCH_SIZE", "8")),
+                                      context_tokens=int(os.getenv("LLM_CONTEXT_TOKENS") or 0) or 16385,
+                                      max_output_tokens=4096)
         self.llm = None
         self._initialize_llm()
     
+    @property
+    def cache_model(self) -> str:
+        """LLM 结果缓存中的模型标识"""
+        return f"openai:{self.model_name}"
+    
     def _initialize_llm(self):
         """初始化LLM实例"""
         if self.api_key and not self.llm:
             try:
                 openai.api_key = self.api_key
                 self.llm = ChatOpenAI(
-                    model="gpt-3.5-turbo",
+                    model=self.model_name,
                     temperature=0.3,
-                    max_tokens=1000
+                    max_tokens=1000,
+                    request_timeout=self.timeout,
+                    # 流式输出的最后一段附带 token 用量
+                    stream_usage=True
                 )
                 print(f"✅ GPT模型初始化成功: {self.llm.model_name}")
             except Exception as e:
@@ -345,80 +581,156 @@ class OpenAILLM:
             print("🔄 重新初始化GPT模型...")
             self._initialize_llm()
     
-    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
-        """使用 OpenAI 分析股票"""
+    def probe(self) -> bool:
+        """就绪探测：客户端已创建（不发起请求）"""
+        self._check_and_reinitialize()
+        return self.llm is not None
+    
+    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                      on_token: Optional[Callable[[str], None]] = None,
+                      on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """使用 OpenAI 分析股票（on_token 逐段接收模型输出，on_field 接收生成完毕的结果字段）"""
+        # 指标变化不大时直接复用缓存的分析结果
+        cache_key = self._cache_key(symbol, data, timeframe)
+        cached = self._cached_analysis(cache_key, on_token, on_field)
+        if cached is not None:
+            return cached
+        
         # 检查并重新初始化LLM
         self._check_and_reinitialize()
         
         if not self.llm:
             # 如果没有 API key，返回错误
-            return {
-                "error": "GPT model not work, figure out how to fix it",
-                "direction": None,
-                "probability": None,
-                "price_change_percent": None,
-                "reasoning": None,
-                "confidence": None
-            }
+            return self._analysis_error()
         
         try:
-            # 构建分析提示
-            indicators_summary = self._format_indicators(data.get('indicators', {}))
-            signal_info = data.get('signal_strength', {})
+            messages = self._analysis_messages(symbol, data, timeframe)
+            stream = AnalysisStream(on_token, on_field)
+            response = None
+            # 流式读取并增量解析，必需字段生成完毕后关闭连接，不再为后续输出计费
+            with closing(self.llm.stream(messages)) as chunks:
+                for chunk in chunks:
+                    # 完整输出的最后一段带有 token 用量
+                    if getattr(chunk, "usage_metadata", None):
+                        response = chunk
+                    if stream.feed(chunk.content):
+                        break
+            self._record_prompt("analysis", messages, response)
             
-            prompt = f"""
-            作为专业的股票分析师，请基于以下技术指标数据对股票 {symbol} 进行 {timeframe} 时间框架的分析：
-
-            技术指标摘要：
-            {indicators_summary}
-
-            信号强度：{signal_info.get('strength', 'neutral')}
-            信号得分：{signal_info.get('score', 0)}
-
-            请以JSON格式返回分析结果，包含以下字段：
-            - direction: "up", "down", 或 "neutral"
-            - probability: 0-100之间的数字，表示预测准确性的概率
-            - price_change_percent: 预期价格变化百分比
-            - reasoning: 详细的分析理由（中文）
-            - confidence: "high", "medium", 或 "low"
-            - risk_factors: 风险因素列表
-
-            注意：请保持客观和谨慎，考虑市场风险。
-            """
-            
-            messages = [
-                SystemMessage(content="你是一个专业的股票技术分析师，擅长基于技术指标进行股票走势预测。"),
-                HumanMessage(content=prompt)
-            ]
-            
-            response = self.llm(messages)
-            
-            # 解析响应
-            try:
-                result = json.loads(response.content)
-                return result
-            except json.JSONDecodeError:
-                # 如果解析失败，返回默认结果
-                return {
-                    "direction": "neutral",
-                    "probability": 50.0,
-                    "price_change_percent": 0.0,
-                    "reasoning": "技术分析结果解析失败，建议谨慎操作。",
-                    "confidence": "low",
-                    "risk_factors": ["数据解析异常"]
-                }
+            return self._parse_analysis(stream, cache_key, symbol, timeframe)
                 
         except Exception as e:
             print(f"OpenAI API error: {e}")
             # 出错时返回错误信息
-            return {
-                "error": "GPT model not work, figure out how to fix it",
-                "direction": None,
-                "probability": None,
-                "price_change_percent": None,
-                "reasoning": None,
-                "confidence": None
-            }
+            return self._analysis_error()
+    
+    async def aanalyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                             on_token: Optional[Callable[[str], None]] = None,
+                             on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """使用 OpenAI 分析股票（异步版本，超时或任务取消时中止请求）"""
+        cache_key = self._cache_key(symbol, data, timeframe)
+        cached = await self._acached_analysis(cache_key, on_token, on_field)
+        if cached is not None:
+            return cached
+        
+        self._check_and_reinitialize()
+        
+        if not self.llm:
+            return self._analysis_error()
+        
+        try:
+            messages = self._analysis_messages(symbol, data, timeframe)
+            stream = AnalysisStream(on_token, on_field)
+            await asyncio.wait_for(self._astream_analysis(messages, stream), self.timeout)
+            return await self._aparse_analysis(stream, cache_key, symbol, timeframe)
+        
+        except asyncio.TimeoutError:
+            print(f"OpenAI API timeout after {self.timeout}s")
+            return self._analysis_error()
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            return self._analysis_error()
+    
+    async def _achat(self, messages: List[BaseMessage], kind: str) -> str:
+        """异步对话请求，返回完整输出文本"""
+        response = await self.llm.ainvoke(messages)
+        self._record_prompt(kind, messages, response)
+        return response.content
+    
+    async def _astream_analysis(self, messages: List[BaseMessage], stream: AnalysisStream):
+        """异步流式分析请求：输出逐段交给 stream 解析，必需字段生成完毕后中止请求"""
+        response = None
+        async with aclosing(self.llm.astream(messages)) as chunks:
+            async for chunk in chunks:
+                if getattr(chunk, "usage_metadata", None):
+                    response = chunk
+                if stream.feed(chunk.content):
+                    break
+        self._record_prompt("analysis", messages, response)
+    
+    def _record_prompt(self, kind: str, messages: List[BaseMessage], response: Any = None, symbols: int = 1):
+        """记录提示词 token 数（估计值，以及 OpenAI 返回的 input_tokens）"""
+        usage = getattr(response, "usage_metadata", None) or {}
+        estimated = sum(estimate_tokens(message.content) for message in messages)
+        prompt_stats.record(kind, self.cache_model, estimated, usage.get("input_tokens"), symbols)
+    
+    def analyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票：一次请求分析一批（items 为 {"symbol", "timeframe", "data"}，结果与 items 一一对应）"""
+        self._check_and_reinitialize()
+        if not self.llm:
+            return [self._analysis_error() for _ in items]
+        return analyze_batch(self, items)
+    
+    async def aanalyze_stocks(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量分析多只股票（异步版本）"""
+        self._check_and_reinitialize()
+        if not self.llm:
+            return [self._analysis_error() for _ in items]
+        return await aanalyze_batch(self, items)
+    
+    @staticmethod
+    def _batch_messages(prompt: str) -> List[BaseMessage]:
+        return [SystemMessage(content=BATCH_SYSTEM_PROMPT), HumanMessage(content=prompt)]
+    
+    def _batch_max_tokens(self, size: int) -> int:
+        """批量请求的输出上限：按股票数放宽单次请求的 max_tokens"""
+        return min(self.batch_sizer.max_output_tokens, size * OUTPUT_TOKENS_PER_ITEM + 200)
+    
+    def _complete_batch(self, prompt: str, size: int) -> str:
+        """批量分析请求"""
+        messages = self._batch_messages(prompt)
+        response = self.llm.invoke(messages, max_tokens=self._batch_max_tokens(size))
+        self._record_prompt("batch", messages, response, size)
+        return response.content
+    
+    async def _acomplete_batch(self, prompt: str, size: int) -> str:
+        """批量分析请求（异步版本）"""
+        messages = self._batch_messages(prompt)
+        response = await asyncio.wait_for(
+            self.llm.ainvoke(messages, max_tokens=self._batch_max_tokens(size)),
+            self.timeout
+        )
+        self._record_prompt("batch", messages, response, size)
+        return response.content
+    
+    def _analysis_messages(self, symbol: str, data: Dict[str, Any], timeframe: str) -> List[BaseMessage]:
+        """构建分析提示（指标按信息量选取并紧凑编码，见 core/prompting.py）"""
+        return [
+            SystemMessage(content=ANALYSIS_SYSTEM_PROMPT),
+            HumanMessage(content=build_analysis_prompt(symbol, timeframe, data))
+        ]
+    
+    @staticmethod
+    def _analysis_error() -> Dict[str, Any]:
+        """模型不可用时的分析结果"""
+        return {
+            "error": "GPT model not work, figure out how to fix it",
+            "direction": None,
+            "probability": None,
+            "price_change_percent": None,
+            "reasoning": None,
+            "confidence": None
+        }
     
     def generate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
         """生成Top 10股票建议"""
@@ -426,15 +738,41 @@ class OpenAILLM:
         self._check_and_reinitialize()
         
         if not self.llm:
-            return {
-                "error": "GPT model not work, figure out how to fix it",
-                "recommendations": [],
-                "generated_at": None,
-                "disclaimer": None
-            }
+            return self._top_stocks_error()
         
         try:
-            prompt = f"""
+            messages = self._top_stocks_messages()
+            response = self.llm(messages)
+            self._record_prompt("top_stocks", messages, response)
+            return self._parse_top_stocks(response.content)
+                
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            # 出错时返回错误信息
+            return self._top_stocks_error()
+    
+    async def agenerate_top_stocks(self, market_data: Dict[str, Any]) -> Dict[str, Any]:
+        """生成Top 10股票建议（异步版本）"""
+        self._check_and_reinitialize()
+        
+        if not self.llm:
+            return self._top_stocks_error()
+        
+        try:
+            content = await asyncio.wait_for(self._achat(self._top_stocks_messages(), kind="top_stocks"), self.timeout)
+            return self._parse_top_stocks(content)
+        
+        except asyncio.TimeoutError:
+            print(f"OpenAI API timeout after {self.timeout}s")
+            return self._top_stocks_error()
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            return self._top_stocks_error()
+    
+    @staticmethod
+    def _top_stocks_messages() -> List[BaseMessage]:
+        """构建推荐提示"""
+        prompt = f"""
             作为专业的投资顾问，请基于当前市场情况推荐10只具有投资潜力的股票。
 
             请以JSON格式返回推荐结果，包含以下字段：
@@ -451,53 +789,33 @@ class OpenAILLM:
 
             注意：请选择知名的大盘股，并保持客观分析。
             """
-            
-            messages = [
-                SystemMessage(content="你是一个专业的投资顾问，擅长股票分析和投资建议。"),
-                HumanMessage(content=prompt)
-            ]
-            
-            response = self.llm(messages)
-            
-            try:
-                result = json.loads(response.content)
-                return result
-            except json.JSONDecodeError:
-                return {
-                    "error": "GPT model not work, figure out how to fix it",
-                    "recommendations": [],
-                    "generated_at": None,
-                    "disclaimer": None
-                }
-                
-        except Exception as e:
-            print(f"OpenAI API error: {e}")
-            # 出错时返回错误信息
-            return {
-                "error": "GPT model not work, figure out how to fix it",
-                "recommendations": [],
-                "generated_at": None,
-                "disclaimer": None
-            }
-    
-    def _format_indicators(self, indicators: Dict[str, Any]) -> str:
-        """格式化技术指标数据"""
-        if not indicators:
-            return "无技术指标数据"
-        
-        summary = []
-        for key, value in indicators.items():
-            if isinstance(value, (int, float)) and not pd.isna(value):
-                summary.append(f"{key}: {value:.2f}")
-            elif hasattr(value, 'iloc') and len(value) > 0:
-                summary.append(f"{key}: {value.iloc[-1]:.2f}")
-        
-        return "\n".join(summary[:10])  # 限制显示前10个指标
+        
+        return [
+            SystemMessage(content="你是一个专业的投资顾问，擅长股票分析和投资建议。"),
+            HumanMessage(content=prompt)
+        ]
+    
+    def _parse_top_stocks(self, content: str) -> Dict[str, Any]:
+        """解析推荐结果"""
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            return self._top_stocks_error()
+    
+    @staticmethod
+    def _top_stocks_error() -> Dict[str, Any]:
+        """模型不可用时的推荐结果"""
+        return {
+            "error": "GPT model not work, figure out how to fix it",
+            "recommendations": [],
+            "generated_at": None,
+            "disclaimer": None
+        }
 
 
 # 全局 LLM 实例 - 根据环境变量选择模型
 def get_llm_analyzer():
-    """根据环境变量选择LLM分析器"""
+    """根据环境变量创建LLM分析器（共享实例由 llm_manager 管理）"""
     llm_type = os.getenv("LLM_TYPE", "openai").lower()
     
     if llm_type == "ollama":
@@ -508,5 +826,10 @@ def get_llm_analyzer():
     else:
         return OpenAILLM()
 
-# 全局 LLM 实例
-llm_analyzer = get_llm_analyzer()
+
+def __getattr__(name: str):
+    """向后兼容：llm_analyzer 为 LLM 管理器中的共享实例，首次访问时才创建"""
+    if name == "llm_analyzer":
+        from .llm_manager import get_llm_analyzer as get_shared_llm_analyzer
+        return get_shared_llm_analyzer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,347 @@
+import os
+import json
+import asyncio
+import contextvars
+import weakref
+from contextlib import AsyncExitStack
+from typing import Dict, Any, AsyncContextManager, List, Optional, Callable, Tuple
+
+from backend.core.llm_cache import llm_cache
+from backend.core.prompting import (
+    ANALYSIS_SYSTEM_PROMPT, PROMPT_BATCH_TOKEN_BUDGET, estimate_tokens, select_features, encode_features, encode_signal
+)
+
+
+# 当前任务中的 LLM 分析是否合并为批量调用（批量预测时由 StockPredictionPipeline.predict_many 设置）
+batch_llm_calls: contextvars.ContextVar[bool] = contextvars.ContextVar("batch_llm_calls", default=False)
+
+DIRECTIONS = ("up", "down", "neutral")
+CONFIDENCES = ("high", "medium", "low")
+
+BATCH_SYSTEM_PROMPT = ANALYSIS_SYSTEM_PROMPT
+
+BATCH_PROMPT_TEMPLATE = """请分别分析以下股票在对应时间框架的走势，每行格式：编号 股票代码 时间框架 | 技术指标（%为百分比） | 信号强度(信号得分) 信号
+{lines}
+
+以JSON数组返回，每只股票一个对象：{{"id":编号,"direction":"up|down|neutral","probability":0-100,"price_change_percent":预期涨跌幅,"reasoning":"中文分析理由，不超过60字","confidence":"high|medium|low","risk_factors":["风险因素，不超过3条"]}}
+只返回JSON数组。保持客观谨慎，考虑市场风险。"""
+
+# 每只股票分析结果的输出 token 估计
+OUTPUT_TOKENS_PER_ITEM = 160
+
+def compact_line(item_id: int, item: Dict[str, Any]) -> str:
+    """单只股票的紧凑摘要行"""
+    data = item["data"]
+    features = encode_features(select_features(data, PROMPT_BATCH_TOKEN_BUDGET))
+    return f"{item_id} {item['symbol']} {item['timeframe']} | {features} | {encode_signal(data.get('signal_strength'))}"
+
+
+def build_batch_prompt(lines: List[str]) -> str:
+    """批量分析提示"""
+    return BATCH_PROMPT_TEMPLATE.format(lines="\n".join(lines))
+
+
+def _number(value: Any) -> Optional[float]:
+    """解析数字（兼容 "+2.5%" 形式的字符串）"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().rstrip('%')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == number else None
+
+
+def validate_analysis(value: Any) -> Optional[Dict[str, Any]]:
+    """校验并规范化单只股票的分析结果（字段缺失或取值非法时返回 None）"""
+    if not isinstance(value, dict):
+        return None
+    direction = str(value.get("direction", "")).strip().lower()
+    confidence = str(value.get("confidence", "")).strip().lower()
+    probability = _number(value.get("probability"))
+    price_change = _number(value.get("price_change_percent"))
+    reasoning = value.get("reasoning")
+    risk_factors = value.get("risk_factors") or []
+    if isinstance(risk_factors, str):
+        risk_factors = [risk_factors]
+    if (direction not in DIRECTIONS or confidence not in CONFIDENCES
+            or probability is None or not 0 <= probability <= 100 or price_change is None
+            or not isinstance(reasoning, str) or not reasoning.strip() or not isinstance(risk_factors, list)):
+        return None
+    return {
+        "direction": direction,
+        "probability": probability,
+        "price_change_percent": price_change,
+        "reasoning": reasoning.strip(),
+        "confidence": confidence,
+        "risk_factors": [str(factor) for factor in risk_factors]
+    }
+
+
+def parse_batch_response(content: str) -> Dict[int, Any]:
+    """按编号提取数组中的各个对象（输出被截断或部分格式错误时保留其余完整的对象）"""
+    decoder = json.JSONDecoder()
+    start = content.find('[')
+    text = content[start + 1:] if start >= 0 else content
+    items: Dict[int, Any] = {}
+    pos = text.find('{')
+    while pos >= 0:
+        try:
+            value, end = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            pos = text.find('{', pos + 1)
+            continue
+        if isinstance(value, dict):
+            try:
+                items[int(value.get("id"))] = value
+            except (TypeError, ValueError):
+                pass
+        pos = text.find('{', end)
+    return items
+
+
+class BatchSizer:
+    """批量大小：不超过模型上下文和输出上限，按解析结果自适应调整
+
+    一批中超过一半的股票没有得到有效结果（输出截断、超时等）时批量减半，全部成功时加一。
+    """
+
+    def __init__(self, max_size: int = 8, context_tokens: int = 4096,
+                 max_output_tokens: Optional[int] = None, output_tokens_per_item: int = OUTPUT_TOKENS_PER_ITEM):
+        self.max_size = max(1, max_size)
+        self.context_tokens = context_tokens
+        # 输出与输入共享上下文时为 None（如 Ollama）
+        self.max_output_tokens = max_output_tokens
+        self.output_tokens_per_item = output_tokens_per_item
+        self.size = self.max_size
+
+    def limit(self, overhead_tokens: int, item_tokens: int) -> int:
+        """本批最多容纳的股票数"""
+        per_item = item_tokens + (self.output_tokens_per_item if self.max_output_tokens is None else 0)
+        fits = (self.context_tokens - overhead_tokens) // max(per_item, 1)
+        if self.max_output_tokens is not None:
+            fits = min(fits, self.max_output_tokens // self.output_tokens_per_item)
+        return max(1, min(self.size, fits))
+
+    def record(self, requested: int, failed: int):
+        """根据一批的结果调整批量大小"""
+        if failed * 2 > requested:
+            self.size = max(1, min(self.size, requested) // 2)
+        elif failed == 0 and requested >= self.size:
+            self.size = min(self.max_size, self.size + 1)
+
+
+def _batch_error(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "error": f"Batch analysis returned no valid result for {item['symbol']} {item['timeframe']}",
+        "direction": None,
+        "probability": None,
+        "price_change_percent": None,
+        "reasoning": None,
+        "confidence": None
+    }
+
+
+def _from_cache(llm, items: List[Dict[str, Any]]) -> Tuple[List[Optional[Dict[str, Any]]], List[int]]:
+    """先查 LLM 结果缓存，返回 (结果列表, 未命中的下标)"""
+    for item in items:
+        item["cache_key"] = llm._cache_key(item["symbol"], item["data"], item["timeframe"])
+    return _split_cached([llm_cache.get(item["cache_key"]) for item in items])
+
+
+async def _afrom_cache(llm, items: List[Dict[str, Any]]) -> Tuple[List[Optional[Dict[str, Any]]], List[int]]:
+    """先查 LLM 结果缓存（异步版本，SQLite 读写不在事件循环中执行）"""
+    for item in items:
+        item["cache_key"] = llm._cache_key(item["symbol"], item["data"], item["timeframe"])
+    return _split_cached([await llm_cache.aget(item["cache_key"]) for item in items])
+
+
+def _split_cached(results: List[Optional[Dict[str, Any]]]) -> Tuple[List[Optional[Dict[str, Any]]], List[int]]:
+    return results, [index for index, result in enumerate(results) if result is None]
+
+
+def _plan_chunks(llm, items: List[Dict[str, Any]], pending: List[int]) -> List[List[int]]:
+    """按当前批量大小和上下文预算切分待分析的股票"""
+    overhead = estimate_tokens(BATCH_SYSTEM_PROMPT + build_batch_prompt([]))
+    item_tokens = max(estimate_tokens(compact_line(index + 1, items[index])) for index in pending)
+    size = llm.batch_sizer.limit(overhead, item_tokens)
+    return [pending[start:start + size] for start in range(0, len(pending), size)]
+
+
+def _validate_chunk(llm, chunk: List[int], content: Optional[str],
+                    results: List[Optional[Dict[str, Any]]]) -> Tuple[List[int], List[int]]:
+    """校验一批的输出并写入结果，返回 (得到有效结果的下标, 没有得到有效结果的下标)"""
+    parsed = parse_batch_response(content) if content else {}
+    valid, failed = [], []
+    for index in chunk:
+        result = validate_analysis(parsed.get(index + 1))
+        if result is None:
+            failed.append(index)
+        else:
+            results[index] = result
+            valid.append(index)
+    llm.batch_sizer.record(len(chunk), len(failed))
+    return valid, failed
+
+
+def _absorb(llm, items: List[Dict[str, Any]], chunk: List[int], content: Optional[str],
+            results: List[Optional[Dict[str, Any]]]) -> List[int]:
+    """校验一批的输出并写入结果和缓存，返回没有得到有效结果的下标"""
+    valid, failed = _validate_chunk(llm, chunk, content, results)
+    for index in valid:
+        item = items[index]
+        llm_cache.put(item["cache_key"], llm.cache_model, item["symbol"], item["timeframe"], results[index])
+    return failed
+
+
+async def _aabsorb(llm, items: List[Dict[str, Any]], chunk: List[int], content: Optional[str],
+                   results: List[Optional[Dict[str, Any]]]) -> List[int]:
+    """校验一批的输出并写入结果和缓存（异步版本）"""
+    valid, failed = _validate_chunk(llm, chunk, content, results)
+    for index in valid:
+        item = items[index]
+        await llm_cache.aput(item["cache_key"], llm.cache_model, item["symbol"], item["timeframe"], results[index])
+    return failed
+
+
+def _chunk_prompt(items: List[Dict[str, Any]], chunk: List[int]) -> str:
+    return build_batch_prompt([compact_line(index + 1, items[index]) for index in chunk])
+
+
+def analyze_batch(llm, items: List[Dict[str, Any]], retries: Optional[int] = None) -> List[Dict[str, Any]]:
+    """批量分析多只股票（items 为 {"symbol", "timeframe", "data"}，结果与 items 一一对应）
+
+    llm 需提供 _cache_key、cache_model、batch_sizer 和 _complete_batch(提示) -> 输出文本；
+    解析失败的股票单独重新组批重试，最终仍失败的返回带 error 的结果。
+    """
+    items = [dict(item) for item in items]
+    results, pending = _from_cache(llm, items)
+    retries = int(os.getenv("LLM_BATCH_RETRIES", "1")) if retries is None else retries
+    for _ in range(retries + 1):
+        if not pending:
+            break
+        failed = []
+        for chunk in _plan_chunks(llm, items, pending):
+            try:
+                content = llm._complete_batch(_chunk_prompt(items, chunk), len(chunk))
+            except Exception as e:
+                print(f"Batch analysis error: {e}")
+                content = None
+            failed.extend(_absorb(llm, items, chunk, content, results))
+        pending = failed
+    return [result if result is not None else _batch_error(item) for result, item in zip(results, items)]
+
+
+async def aanalyze_batch(llm, items: List[Dict[str, Any]], retries: Optional[int] = None) -> List[Dict[str, Any]]:
+    """批量分析多只股票（异步版本；llm 需提供 _acomplete_batch）
+
+    各批依次请求：调用方（LLMBatcher）只占用一个调用名额，并发请求会突破 LLM_MAX_CONCURRENCY。
+    """
+    items = [dict(item) for item in items]
+    results, pending = await _afrom_cache(llm, items)
+    retries = int(os.getenv("LLM_BATCH_RETRIES", "1")) if retries is None else retries
+
+    async def _run(chunk: List[int]) -> List[int]:
+        try:
+            content = await llm._acomplete_batch(_chunk_prompt(items, chunk), len(chunk))
+        except asyncio.TimeoutError:
+            print(f"Batch analysis timeout for {len(chunk)} symbols")
+            content = None
+        except Exception as e:
+            print(f"Batch analysis error: {e}")
+            content = None
+        return await _aabsorb(llm, items, chunk, content, results)
+
+    for _ in range(retries + 1):
+        if not pending:
+            break
+        failed = []
+        for chunk in _plan_chunks(llm, items, pending):
+            failed.extend(await _run(chunk))
+        pending = failed
+    return [result if result is not None else _batch_error(item) for result, item in zip(results, items)]
+
+
+class LLMBatcher:
+    """把同一事件循环内并发到达的单股分析请求合并，一次调用分析器的 aanalyze_stocks
+
+    首个请求到达后等待 window 秒再发出；并发名额已满时请求继续累积，名额空出后一次取走最多 max_size 个，
+    模型忙时批量自然变大。
+    """
+
+    def __init__(self, llm, max_size: Optional[int] = None, window: Optional[float] = None):
+        self.llm = llm
+        self.max_size = max_size or int(os.getenv("LLM_BATCH_SIZE", "8"))
+        self.window = window if window is not None else float(os.getenv("LLM_BATCH_WINDOW", "0.05"))
+        self._pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List[Tuple[Dict[str, Any], asyncio.Future]]]" = \
+            weakref.WeakKeyDictionary()
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 1 and hasattr(self.llm, "aanalyze_stocks")
+
+    async def analyze(self, symbol: str, data: Dict[str, Any], timeframe: str,
+                      limiter: Optional[Callable[[], AsyncContextManager]] = None) -> Dict[str, Any]:
+        """提交一只股票的分析，等待所在批次完成（limiter 返回占用一个调用名额的异步上下文管理器）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append(({"symbol": symbol, "timeframe": timeframe, "data": data}, future))
+        # 每满一批或每个窗口的首个请求启动一个发送任务
+        if len(pending) % self.max_size == 1 or self.max_size == 1:
+            task = loop.create_task(self._drain(loop, limiter))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await future
+
+    async def _drain(self, loop: asyncio.AbstractEventLoop, limiter: Optional[Callable[[], AsyncContextManager]]):
+        """等待窗口和调用名额后取走累积的请求并发出"""
+        await asyncio.sleep(self.window)
+        if limiter is None:
+            await self._run(self._take(loop))
+            return
+        async with AsyncExitStack() as stack:
+            try:
+                await stack.enter_async_context(limiter())
+            except Exception as e:
+                # 未获得调用名额（如排队已满或排队超时）：本批请求直接返回错误
+                self._fail(self._take(loop), e)
+                return
+            await self._run(self._take(loop))
+
+    def _take(self, loop: asyncio.AbstractEventLoop) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        """取出最多 max_size 个仍在等待的请求"""
+        pending = [(item, future) for item, future in self._pending.get(loop, []) if not future.done()]
+        batch, rest = pending[:self.max_size], pending[self.max_size:]
+        if rest:
+            self._pending[loop] = rest
+        else:
+            self._pending.pop(loop, None)
+        return batch
+
+    @staticmethod
+    def _fail(batch: List[Tuple[Dict[str, Any], asyncio.Future]], error: Exception):
+        """本批请求返回错误（异常带有 retry_after 时一并返回）"""
+        retry_after = getattr(error, "retry_after", None)
+        result = {
+            "error": f"LLM overloaded: {str(error)}" if retry_after is not None else f"Batch analysis failed: {str(error)}",
+            "retry_after": retry_after
+        }
+        for _, future in batch:
+            if not future.done():
+                future.set_result(dict(result))
+
+    async def _run(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        # 请求已被其他发送任务取走或都已取消时不再调用模型
+        if not batch:
+            return
+        try:
+            results = await self.llm.aanalyze_stocks([item for item, _ in batch])
+        except Exception as e:
+            results = [{"error": f"Batch analysis failed: {str(e)}"}] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
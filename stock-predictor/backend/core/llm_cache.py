@@ -0,0 +1,156 @@
+import os
+import json
+import asyncio
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from .prompting import PROMPT_MAX_SIGNALS
+
+
+def quantize(value: float, digits: int) -> float:
+    """按有效数字位数取整（指标小幅波动时取整结果不变）"""
+    if value == 0 or not math.isfinite(value):
+        return value
+    return float(f"{value:.{digits}g}")
+
+
+class LLMResponseCache:
+    """LLM 分析结果缓存（SQLite 持久化，进程重启后仍可命中）
+
+    键由模型、提示词模板版本、股票、时间框架以及按有效数字取整后的指标摘要和信号组成，
+    指标只有微小变化时复用上一次的分析结果；条目超过 ttl 秒失效，超过 max_entries 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, db_path: str = "data/llm_cache.db", ttl: float = 600,
+                 max_entries: int = 5000, precision: int = 3):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """首次使用时打开数据库（未使用 LLM 的进程不创建文件）"""
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def make_key(self, model: str, template_version: str, symbol: str, timeframe: str,
+                 features: List[Tuple[str, float]], signal_strength: Dict[str, Any]) -> str:
+        """缓存键：提示词中各项输入（features 为提示词选用的指标，数值按有效数字取整；信号取提示词中列出的前几条）的哈希"""
+        payload = {
+            "model": model,
+            "template": template_version,
+            "symbol": symbol.upper(),
+            "timeframe": timeframe,
+            "indicators": [(key, quantize(value, self.precision)) for key, value in features],
+            "strength": (signal_strength or {}).get('strength', 'neutral'),
+            "score": quantize(float((signal_strength or {}).get('score', 0) or 0), self.precision),
+            "signals": list((signal_strength or {}).get('signals') or [])[:PROMPT_MAX_SIGNALS],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的缓存结果"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ? AND created_at > ? RETURNING response",
+                (now, key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的缓存结果（异步版本，数据库读写在线程中执行，不阻塞事件循环）"""
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    def put(self, key: str, model: str, symbol: str, timeframe: str, response: Dict[str, Any]):
+        """写入缓存结果，并清理过期和超出容量的条目"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, symbol, timeframe, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, symbol.upper(), timeframe, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    async def aput(self, key: str, model: str, symbol: str, timeframe: str, response: Dict[str, Any]):
+        """写入缓存结果（异步版本）"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.put, key, model, symbol, timeframe, response)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._connect().execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计（命中率为本进程内的统计）"""
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] if self.enabled else 0
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "precision": self.precision,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# 全局 LLM 结果缓存实例
+llm_cache = LLMResponseCache(
+    db_path=os.getenv("LLM_CACHE_PATH", "data/llm_cache.db"),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "600")),
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "5000")),
+    precision=int(os.getenv("LLM_CACHE_PRECISION", "3"))
+)
@@ -2,16 +2,23 @@
 LLM管理器 - 全局单例模式管理GPT模型
 """
 import os
+import time
+import threading
+from datetime import datetime
 from typing import Optional
 from dotenv import load_dotenv
-from .llm import OpenAILLM, OllamaLLM, MockLLM, get_llm_analyzer
+# 工厂函数另起别名：本模块的 get_llm_analyzer 返回共享实例
+from .llm import OpenAILLM, OllamaLLM, MockLLM, get_llm_analyzer as create_llm_analyzer
 
 # 加载环境变量
 load_dotenv()
 
 
 class LLMManager:
-    """LLM管理器 - 单例模式"""
+    """LLM管理器 - 单例模式
+
+    分析器在首次使用时创建（创建时不访问模型服务），模型可用性由后台就绪探测检查，服务启动不等待模型。
+    """
     
     _instance = None
     _llm_analyzer = None
@@ -23,33 +30,96 @@ class LLMManager:
         return cls._instance
     
     def _initialize(self):
-        """初始化LLM分析器"""
-        if self._llm_analyzer is None:
-            print("🚀 初始化全局LLM管理器...")
-            self._llm_analyzer = get_llm_analyzer()
-            print("✅ 全局LLM管理器初始化完成")
+        """初始化管理器状态（分析器延迟创建）"""
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probe_stop = threading.Event()
+        # 就绪探测间隔（秒）：未就绪时重试，就绪后继续探测以发现模型失效
+        self.probe_interval = float(os.getenv("LLM_PROBE_INTERVAL", "10"))
+        self._readiness = {
+            "ready": False,
+            "attempts": 0,
+            "checked_at": None,
+            "probe_ms": None,
+            "error": None
+        }
     
     def get_llm_analyzer(self):
-        """获取LLM分析器实例"""
+        """获取LLM分析器实例（首次调用时创建）"""
+        if self._llm_analyzer is None:
+            with self._lock:
+                if self._llm_analyzer is None:
+                    print("🚀 初始化全局LLM管理器...")
+                    self._llm_analyzer = create_llm_analyzer()
+                    print("✅ 全局LLM管理器初始化完成")
         return self._llm_analyzer
     
+    def probe(self) -> bool:
+        """执行一次就绪探测（Ollama 只查询模型列表，不进行生成），更新就绪状态"""
+        analyzer = self.get_llm_analyzer()
+        started = time.perf_counter()
+        try:
+            ready = bool(analyzer.probe()) if hasattr(analyzer, "probe") else True
+            error = None if ready else getattr(analyzer, "last_error", None) or "LLM不可用"
+        except Exception as e:
+            ready, error = False, str(e)
+        with self._lock:
+            self._readiness.update(
+                ready=ready,
+                attempts=self._readiness["attempts"] + 1,
+                checked_at=datetime.now().isoformat(),
+                probe_ms=round((time.perf_counter() - started) * 1000, 1),
+                error=error
+            )
+        return ready
+    
+    def start_readiness_probe(self):
+        """在后台线程中按 probe_interval 持续探测就绪状态（不阻塞调用方）"""
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_stop.clear()
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="llm-probe", daemon=True)
+            self._probe_thread.start()
+    
+    def stop_readiness_probe(self):
+        """停止后台就绪探测"""
+        self._probe_stop.set()
+    
+    def _probe_loop(self):
+        """后台就绪探测循环（直到 stop_readiness_probe）"""
+        while not self._probe_stop.is_set():
+            self.probe()
+            self._probe_stop.wait(self.probe_interval)
+    
+    def get_readiness(self) -> dict:
+        """就绪状态（ready 为 True 表示已探测到模型可用；就绪后模型再次失效时随之变为 False）"""
+        with self._lock:
+            readiness = dict(self._readiness)
+            probing = self._probe_thread is not None and self._probe_thread.is_alive()
+        readiness["ready"] = readiness["ready"] and self.is_llm_available()
+        readiness["probing"] = probing
+        readiness["type"] = os.getenv("LLM_TYPE", "openai").lower()
+        return readiness
+    
     def is_llm_available(self) -> bool:
         """检查LLM是否可用"""
-        if self._llm_analyzer is None:
-            return False
+        llm_analyzer = self.get_llm_analyzer()
         
         # 根据LLM类型检查可用性
-        if isinstance(self._llm_analyzer, OpenAILLM):
-            return self._llm_analyzer.llm is not None
-        elif isinstance(self._llm_analyzer, OllamaLLM):
-            return self._llm_analyzer.llm is not None
-        elif isinstance(self._llm_analyzer, MockLLM):
+        if isinstance(llm_analyzer, OpenAILLM):
+            return llm_analyzer.llm is not None
+        elif isinstance(llm_analyzer, OllamaLLM):
+            return llm_analyzer.llm is not None
+        elif isinstance(llm_analyzer, MockLLM):
             return True
         
         return False
     
     def get_llm_status(self) -> dict:
-        """获取LLM状态信息"""
+        """获取LLM状态信息（尚未探测过时先同步探测一次）"""
+        if self._readiness["attempts"] == 0:
+            self.probe()
         if self._llm_analyzer is None:
             return {
                 "available": False,
@@ -86,7 +156,7 @@ class LLMManager:
             if not self._llm_analyzer.llm:
                 return {
                     "available": False,
-                    "reason": "Ollama模型初始化失败",
+                    "reason": f"Ollama模型初始化失败: {self._llm_analyzer.last_error}",
                     "type": "ollama"
                 }
             
@@ -124,6 +194,18 @@ def is_llm_available() -> bool:
     """检查LLM是否可用"""
     return llm_manager.is_llm_available()
 
+def start_llm_readiness_probe():
+    """后台探测LLM就绪状态"""
+    llm_manager.start_readiness_probe()
+
+def stop_llm_readiness_probe():
+    """停止后台就绪探测"""
+    llm_manager.stop_readiness_probe()
+
+def get_llm_readiness() -> dict:
+    """获取LLM就绪状态"""
+    return llm_manager.get_readiness()
+
 def get_llm_status() -> dict:
     """获取LLM状态信息"""
     return llm_manager.get_llm_status()
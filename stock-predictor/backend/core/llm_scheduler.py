@@ -0,0 +1,206 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, Tuple
+
+
+# 优先级（数值越小越先获得名额）：interactive 为用户等待中的单次预测，batch 为批量预测、后台任务和 Top 推荐
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# 当前上下文中 LLM 调用的优先级（批量预测和后台任务设为 batch）
+llm_priority: ContextVar[str] = ContextVar("llm_priority", default="interactive")
+
+
+class LLMOverloaded(Exception):
+    """LLM 调度器拒绝请求（排队已满或排队超时），retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """排队中的请求（同步调用用 event 唤醒，异步调用用所在事件循环的 future 唤醒）"""
+
+    __slots__ = ("priority", "enqueued_at", "granted", "event", "loop", "future")
+
+    def __init__(self, priority: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """LLM 调用准入控制：限制同时进行的调用数，其余请求按优先级排队
+
+    名额跨线程和事件循环共享（同步节点、各事件循环中的异步节点、批量调用共用同一上限）；
+    排队数达到 max_queue 时立即拒绝，排队超过对应优先级的超时时间时放弃，均抛出 LLMOverloaded。
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_queue: Optional[int] = None,
+                 queue_timeouts: Optional[Dict[str, float]] = None, history: int = 500):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_QUEUE_SIZE", "32"))
+        self.queue_timeouts = queue_timeouts or {
+            "interactive": float(os.getenv("LLM_QUEUE_TIMEOUT", "15")),
+            "batch": float(os.getenv("LLM_BATCH_QUEUE_TIMEOUT", "120"))
+        }
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        # 单次调用耗时的指数移动平均（估计重试间隔）
+        self._service_time: Optional[float] = None
+        self._waits = {priority: deque(maxlen=history) for priority in PRIORITIES}
+        self._counters = {priority: {"admitted": 0, "rejected": 0, "timed_out": 0} for priority in PRIORITIES}
+
+    @staticmethod
+    def _priority(priority: Optional[str]) -> str:
+        priority = priority or llm_priority.get()
+        return priority if priority in PRIORITIES else "interactive"
+
+    def _retry_after(self) -> int:
+        """建议的重试间隔：按平均调用耗时估计排在前面的请求处理完所需的时间"""
+        service_time = self._service_time or 5.0
+        return max(1, math.ceil(service_time * (len(self._queue) + 1) / self.max_concurrency))
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        """有空闲名额且无人排队时直接获得名额（返回 True），否则排队；队列已满时拒绝"""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._admit(waiter)
+                return True
+            if len(self._queue) >= self.max_queue:
+                self._counters[waiter.priority]["rejected"] += 1
+                raise LLMOverloaded("LLM queue is full", self._retry_after())
+            heapq.heappush(self._queue, (PRIORITIES[waiter.priority], next(self._seq), waiter))
+            return False
+
+    def _admit(self, waiter: _Waiter):
+        waiter.granted = True
+        self._counters[waiter.priority]["admitted"] += 1
+        self._waits[waiter.priority].append(time.monotonic() - waiter.enqueued_at)
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """放弃排队：已在此期间获得名额时返回 True（名额归调用方），否则移出队列"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+            heapq.heapify(self._queue)
+            return False
+
+    def _timed_out(self, waiter: _Waiter) -> LLMOverloaded:
+        with self._lock:
+            self._counters[waiter.priority]["timed_out"] += 1
+            return LLMOverloaded(
+                f"LLM queue timeout after {self.queue_timeouts[waiter.priority]}s", self._retry_after()
+            )
+
+    def _release(self, started: Optional[float] = None):
+        """归还名额：直接转交给优先级最高的排队请求"""
+        with self._lock:
+            if started is not None:
+                elapsed = time.monotonic() - started
+                self._service_time = elapsed if self._service_time is None else \
+                    0.8 * self._service_time + 0.2 * elapsed
+            if not self._queue:
+                self._active -= 1
+                return
+            _, _, waiter = heapq.heappop(self._queue)
+            self._admit(waiter)
+        if waiter.event is not None:
+            waiter.event.set()
+        else:
+            waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None) -> Iterator[None]:
+        """同步调用占用一个名额（排队时阻塞当前线程）"""
+        waiter = _Waiter(self._priority(priority))
+        if not self._enqueue(waiter):
+            if not waiter.event.wait(self.queue_timeouts[waiter.priority]) and not self._abandon(waiter):
+                raise self._timed_out(waiter)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    @asynccontextmanager
+    async def aslot(self, priority: Optional[str] = None) -> AsyncIterator[None]:
+        """异步调用占用一个名额（在事件循环中排队，不占用线程）"""
+        waiter = _Waiter(self._priority(priority), asyncio.get_running_loop())
+        if not self._enqueue(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeouts[waiter.priority])
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise self._timed_out(waiter)
+            except asyncio.CancelledError:
+                # 取消时已获得的名额立即归还
+                if self._abandon(waiter):
+                    self._release()
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    @property
+    def saturated(self) -> bool:
+        """排队已满（新请求会被立即拒绝）"""
+        with self._lock:
+            return len(self._queue) >= self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        """调度统计：当前并发和排队深度，各优先级的准入、拒绝、超时次数和排队等待时间"""
+        now = time.monotonic()
+        with self._lock:
+            queued = {priority: 0 for priority in PRIORITIES}
+            oldest = {priority: 0.0 for priority in PRIORITIES}
+            for _, _, waiter in self._queue:
+                queued[waiter.priority] += 1
+                oldest[waiter.priority] = max(oldest[waiter.priority], now - waiter.enqueued_at)
+            priorities = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                priorities[priority] = {
+                    **self._counters[priority],
+                    "queued": queued[priority],
+                    "oldest_wait_seconds": round(oldest[priority], 3),
+                    "queue_timeout_seconds": self.queue_timeouts[priority],
+                    "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                    "p95_wait_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                    "max_wait_seconds": round(waits[-1], 3) if waits else 0.0
+                }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": self._active,
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "avg_service_seconds": round(self._service_time, 3) if self._service_time is not None else None,
+                "retry_after_seconds": self._retry_after(),
+                "priorities": priorities
+            }
+
+
+# 全局 LLM 调度器实例（所有 LLM 调用共用）
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from backend.core.llm_batch import DIRECTIONS, CONFIDENCES, validate_analysis
+
+
+# 分析结果的必需字段：全部生成后即可结束生成（提示词中 confidence 位于 reasoning 之后，
+# 提前结束只省去 risk_factors 等后续内容）
+REQUIRED_FIELDS = ("direction", "probability", "confidence")
+
+# 必需字段齐全后是否中止生成
+STREAM_EARLY_STOP = os.getenv("LLM_STREAM_EARLY_STOP", "true").lower() not in ("0", "false", "no")
+
+# 解析不完整的输出时补齐的字段（缺少 confidence 时按低置信度处理）
+FALLBACK_DEFAULTS = {
+    "price_change_percent": 0.0,
+    "reasoning": "模型输出不完整，未给出分析理由。",
+    "risk_factors": [],
+    "confidence": "low"
+}
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_REPEATED_COMMA = re.compile(r",(\s*,)+")
+
+
+def _fix_commas(text: str) -> str:
+    """去掉多余的逗号（连续逗号和右括号前的逗号）"""
+    return _TRAILING_COMMA.sub(r"\1", _REPEATED_COMMA.sub(",", text))
+
+
+class IncrementalJSONParser:
+    """增量解析流式输出中的第一个 JSON 对象：每个顶层字段生成完毕即可从 fields 中取得
+
+    对象之前的说明文字或代码块标记会被跳过；closed 表示对象已结束。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.closed = False
+        self._pos = 0
+        self._start = -1
+        self._member = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, piece: str) -> Dict[str, Any]:
+        """追加一段输出，返回本段中新完成的顶层字段"""
+        self.text += piece
+        completed: Dict[str, Any] = {}
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self.closed:
+                break
+            ch = text[i]
+            if self._start < 0:
+                if ch == '{':
+                    self._start = i
+                    self._member = i + 1
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(text[self._member:i], completed)
+                    self.closed = True
+            elif ch == ',' and self._depth == 1:
+                self._complete(text[self._member:i], completed)
+                self._member = i + 1
+        self._pos = len(text)
+        return completed
+
+    def _complete(self, member: str, completed: Dict[str, Any]):
+        """解析一个完整的 "键": 值 成员（格式错误的成员跳过）"""
+        if not member.strip():
+            return
+        try:
+            value = json.loads("{" + _fix_commas(member) + "}")
+        except json.JSONDecodeError:
+            return
+        if isinstance(value, dict):
+            self.fields.update(value)
+            completed.update(value)
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """修复截断或格式有误的 JSON 对象：去掉不完整的末尾成员并补齐括号，无法修复时返回 None"""
+    start = text.find('{')
+    if start < 0:
+        return None
+    text = text[start:]
+
+    # 记录字符串之外每个可截断位置（逗号或左括号之后）的括号栈
+    stack: List[str] = []
+    cuts: List[Tuple[int, str]] = []
+    in_string = escape = False
+    end = len(text)
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                break
+        elif ch == ',':
+            cuts.append((i, "".join(reversed(stack))))
+
+    closers = "".join(reversed(stack))
+    candidates = [text[:end]] if not stack else []
+    if stack:
+        # 依次尝试：补齐未结束的字符串和括号，再逐个去掉末尾的不完整成员
+        # （末尾是数字或字面量时可能被截断，不直接补齐）
+        if in_string:
+            candidates.append(text + '"' + closers)
+        elif text.rstrip().endswith(('"', '}', ']')):
+            candidates.append(text.rstrip() + closers)
+        candidates.extend(text[:pos] + closing for pos, closing in reversed(cuts))
+    for candidate in candidates:
+        try:
+            return json.loads(_fix_commas(candidate))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def required_complete(fields: Dict[str, Any]) -> bool:
+    """必需字段均已生成且取值合法"""
+    if not all(field in fields for field in REQUIRED_FIELDS):
+        return False
+    probability = fields["probability"]
+    return (str(fields["direction"]).strip().lower() in DIRECTIONS
+            and str(fields["confidence"]).strip().lower() in CONFIDENCES
+            and isinstance(probability, (int, float)) and not isinstance(probability, bool))
+
+
+def complete_analysis(value: Any) -> Optional[Dict[str, Any]]:
+    """规范化分析结果，缺失的字段按 FALLBACK_DEFAULTS 补齐（direction、probability 缺失或非法时返回 None）"""
+    if not isinstance(value, dict):
+        return None
+    filled = dict(value)
+    for field, default in FALLBACK_DEFAULTS.items():
+        if filled.get(field) in (None, "", []):
+            filled[field] = default
+    return validate_analysis(filled)
+
+
+def parse_analysis_text(content: str, fields: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """解析分析输出，返回 (结果, 是否经过修复)
+
+    依次尝试：完整 JSON、修复截断或格式有误的末尾、流式解析中已完成的字段。
+    """
+    try:
+        result = complete_analysis(json.loads(content))
+        if result is not None:
+            return result, False
+    except json.JSONDecodeError:
+        pass
+    result = complete_analysis(repair_json(content))
+    if result is None and fields:
+        result = complete_analysis(fields)
+    return result, result is not None
+
+
+class AnalysisStream:
+    """单只股票分析的流式输出：逐段增量解析，必需字段齐全后提示调用方结束生成
+
+    on_token 逐段接收原始输出，on_field 在每个顶层字段生成完毕时接收 (字段名, 值)。
+    """
+
+    def __init__(self, on_token: Optional[Callable[[str], None]] = None,
+                 on_field: Optional[Callable[[str, Any], None]] = None, early_stop: Optional[bool] = None):
+        self.parser = IncrementalJSONParser()
+        self.on_token = on_token
+        self.on_field = on_field
+        self.early_stop = STREAM_EARLY_STOP if early_stop is None else early_stop
+        self.stopped_early = False
+
+    @property
+    def content(self) -> str:
+        return self.parser.text
+
+    def feed(self, piece: str) -> bool:
+        """处理一段输出，返回是否可以结束生成"""
+        if not piece:
+            return False
+        if self.on_token is not None:
+            self.on_token(piece)
+        completed = self.parser.feed(piece)
+        if self.on_field is not None:
+            for field, value in completed.items():
+                self.on_field(field, value)
+        if self.parser.closed:
+            return True
+        if self.early_stop and completed and required_complete(self.parser.fields):
+            self.stopped_early = True
+            return True
+        return False
+
+    def result(self) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """解析结果，返回 (结果, 是否经过修复)；提前结束时由已完成的字段组成"""
+        if self.stopped_early:
+            return complete_analysis(self.parser.fields), False
+        return parse_analysis_text(self.content, self.parser.fields)
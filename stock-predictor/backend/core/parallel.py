@@ -0,0 +1,208 @@
+"""
+多进程批量指标计算
+
+价格数组一次性写入 multiprocessing.shared_memory，按股票分块派发给常驻进程池；
+子进程直接在共享内存上读取输入并把结果写回共享输出块，进程间只传递块名称和偏移量，
+不再序列化大 DataFrame。单次预测的特征计算也在同一进程池中执行（见 FeatureEngineerNode）。
+"""
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from .precision import get_precision
+
+
+OHLCV_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def _warm_up_worker(_: int = 0) -> int:
+    """预热：导入指标依赖"""
+    from backend.core import indicators, expressions  # noqa: F401
+    return os.getpid()
+
+
+def _compute_chunk(job: Dict[str, Any]) -> List[Optional[str]]:
+    """子进程：计算一组股票并写入共享输出块，返回每只股票的错误信息（成功为 None）"""
+    from backend.core.indicators import TechnicalIndicators
+    from backend.core.expressions import compile_expressions
+
+    total = job["total"]
+    names = job["names"]
+    dtype = np.dtype(job["dtype"])
+    # 共享内存由父进程创建并负责释放，子进程只附加
+    in_shm = shared_memory.SharedMemory(name=job["input"])
+    date_shm = shared_memory.SharedMemory(name=job["dates"])
+    out_shm = shared_memory.SharedMemory(name=job["output"])
+    errors: List[Optional[str]] = []
+    values = dates = output = None
+    try:
+        values = np.ndarray((len(OHLCV_COLUMNS), total), dtype=dtype, buffer=in_shm.buf)
+        dates = np.ndarray((total,), dtype=np.int64, buffer=date_shm.buf)
+        output = np.ndarray((len(names), total), dtype=dtype, buffer=out_shm.buf)
+        program = compile_expressions(job["expressions"]) if job["kind"] == "expressions" else None
+
+        for offset, length in job["slices"]:
+            try:
+                end = offset + length
+                frame = pd.DataFrame({col: values[i, offset:end] for i, col in enumerate(OHLCV_COLUMNS)})
+                frame["date"] = pd.to_datetime(dates[offset:end])
+                if program is not None:
+                    result = program.evaluate(frame)
+                else:
+                    result = TechnicalIndicators.calculate_all_indicators(frame)
+                for i, name in enumerate(names):
+                    series = result.get(name)
+                    output[i, offset:end] = np.asarray(series, dtype=dtype) if series is not None else np.nan
+                errors.append(None)
+            except Exception as e:
+                output[:, offset:offset + length] = np.nan
+                errors.append(str(e))
+    finally:
+        # 先释放数组视图，否则无法关闭共享内存
+        values = dates = output = None
+        in_shm.close()
+        date_shm.close()
+        out_shm.close()
+    return errors
+
+
+class ParallelIndicatorExecutor:
+    """基于共享内存和常驻进程池的批量指标计算器"""
+
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: Optional[int] = None,
+                 dtype: Optional[str] = None):
+        self.max_workers = max_workers or int(os.getenv("INDICATOR_WORKERS", "0")) or os.cpu_count() or 1
+        self.chunk_size = chunk_size or int(os.getenv("INDICATOR_CHUNK_SIZE", "0")) or None
+        self.dtype = np.dtype(dtype or get_precision())
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """懒加载进程池（spawn 方式，避免 fork 带有线程的服务进程）"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def warm_up(self, fn=_warm_up_worker):
+        """预热进程池：启动全部子进程并导入依赖（fn 为子进程中执行的预热函数，其所在模块随之导入）"""
+        pool = self.get_pool()
+        list(pool.map(fn, range(self.max_workers)))
+
+    def submit(self, fn, *args) -> Future:
+        """在进程池中执行单个任务（参数应为 numpy 数组等可紧凑序列化的对象）"""
+        return self.get_pool().submit(fn, *args)
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def discard(self, pool: ProcessPoolExecutor):
+        """丢弃已损坏的进程池，下次使用时重建（pool 已被其他请求替换时不处理；不等待子进程退出）"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def compute_indicators(self, frames: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, Any]]:
+        """批量计算 TechnicalIndicators.calculate_all_indicators"""
+        from .indicators import INDICATOR_NAMES
+        return self._run(frames, "indicators", list(INDICATOR_NAMES), ())
+
+    def compute_expressions(self, frames: Dict[str, pd.DataFrame],
+                            expressions: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """批量计算自定义指标表达式"""
+        from .expressions import compile_expressions
+        program = compile_expressions(expressions)
+        return self._run(frames, "expressions", list(program.expressions), program.expressions)
+
+    def _chunks(self, n: int) -> List[Tuple[int, int]]:
+        """按股票数量切块，默认每个进程约 4 块以平衡负载"""
+        size = self.chunk_size or max(1, math.ceil(n / (self.max_workers * 4)))
+        return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+    def _run(self, frames: Dict[str, pd.DataFrame], kind: str, names: List[str],
+             expressions: Tuple[str, ...]) -> Dict[str, Dict[str, Any]]:
+        symbols = [s for s, df in frames.items() if df is not None and not df.empty]
+        if not symbols:
+            return {}
+
+        prepared = [_prepare_frame(frames[s]) for s in symbols]
+        lengths = [len(df) for df in prepared]
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(int)
+        total = int(sum(lengths))
+        itemsize = self.dtype.itemsize
+
+        in_shm = shared_memory.SharedMemory(create=True, size=len(OHLCV_COLUMNS) * total * itemsize)
+        date_shm = shared_memory.SharedMemory(create=True, size=total * 8)
+        out_shm = shared_memory.SharedMemory(create=True, size=max(len(names), 1) * total * itemsize)
+        values = dates = output = None
+        try:
+            values = np.ndarray((len(OHLCV_COLUMNS), total), dtype=self.dtype, buffer=in_shm.buf)
+            dates = np.ndarray((total,), dtype=np.int64, buffer=date_shm.buf)
+            output = np.ndarray((len(names), total), dtype=self.dtype, buffer=out_shm.buf)
+
+            # 写入共享输入块
+            for df, offset, length in zip(prepared, offsets, lengths):
+                for i, col in enumerate(OHLCV_COLUMNS):
+                    values[i, offset:offset + length] = df[col].to_numpy(dtype=self.dtype)
+                dates[offset:offset + length] = df["date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+            jobs = []
+            for start, end in self._chunks(len(symbols)):
+                jobs.append({
+                    "kind": kind,
+                    "names": names,
+                    "expressions": expressions,
+                    "dtype": self.dtype.str,
+                    "total": total,
+                    "input": in_shm.name,
+                    "dates": date_shm.name,
+                    "output": out_shm.name,
+                    "slices": [(int(offsets[i]), int(lengths[i])) for i in range(start, end)]
+                })
+
+            errors: List[Optional[str]] = []
+            for chunk_errors in self.get_pool().map(_compute_chunk, jobs):
+                errors.extend(chunk_errors)
+
+            # 汇总：从共享输出块拷贝出每只股票的结果
+            results: Dict[str, Dict[str, Any]] = {}
+            for symbol, offset, length, error in zip(symbols, offsets, lengths, errors):
+                if error is not None:
+                    results[symbol] = {"error": error}
+                    continue
+                results[symbol] = {
+                    name: output[i, offset:offset + length].copy() for i, name in enumerate(names)
+                }
+            return results
+        finally:
+            values = dates = output = None
+            for shm in (in_shm, date_shm, out_shm):
+                shm.close()
+                shm.unlink()
+
+
+def _prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """统一为 date + OHLCV 列并按日期排序"""
+    frame = df.reset_index() if "date" not in df.columns else df
+    if "date" not in frame.columns:
+        frame = frame.rename(columns={frame.columns[0]: "date"})
+    frame = frame.assign(date=pd.to_datetime(frame["date"], utc=True).dt.tz_localize(None))
+    return frame.sort_values("date").reset_index(drop=True)
+
+
+# 全局并行计算器（进程池按需创建）
+parallel_executor = ParallelIndicatorExecutor()
@@ -0,0 +1,87 @@
+import os
+from typing import Dict, Any, Optional
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+NUMERIC_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+SUPPORTED_PRECISIONS = ("float64", "float32")
+
+
+def get_precision() -> str:
+    """当前数值精度模式（PRECISION=float64|float32）"""
+    precision = os.getenv("PRECISION", "float64").lower()
+    return precision if precision in SUPPORTED_PRECISIONS else "float64"
+
+
+def get_float_dtype() -> np.dtype:
+    """当前精度模式对应的浮点类型"""
+    return np.dtype(get_precision())
+
+
+def cast_frame(df: pd.DataFrame, dtype: Optional[np.dtype] = None) -> pd.DataFrame:
+    """将OHLCV数值列转换为指定精度（类型已一致时不复制）"""
+    dtype = np.dtype(dtype or get_float_dtype())
+    columns = [col for col in NUMERIC_COLUMNS if col in df.columns and df[col].dtype != dtype]
+    if df.empty or not columns:
+        return df
+    return df.astype({col: dtype for col in columns})
+
+
+def cast_indicators(indicators: Dict[str, Any], dtype: Optional[np.dtype] = None) -> Dict[str, Any]:
+    """将指标序列转换为指定精度"""
+    dtype = np.dtype(dtype or get_float_dtype())
+    return {
+        key: value.astype(dtype) if hasattr(value, 'astype') and getattr(value, 'dtype', None) != dtype else value
+        for key, value in indicators.items()
+    }
+
+
+def compare_precision(df: pd.DataFrame, tolerance: float = 1e-4) -> Dict[str, Any]:
+    """对比 float32 与 float64 的指标计算结果
+
+    误差按 max|x32 - x64| / max|x64| 归一化，超过 tolerance 的指标会列入 failed。
+    """
+    from .indicators import TechnicalIndicators
+
+    reference = TechnicalIndicators.calculate_all_indicators(cast_frame(df, np.float64))
+    reduced = cast_indicators(
+        TechnicalIndicators.calculate_all_indicators(cast_frame(df, np.float32)), np.float32
+    )
+
+    errors = {}
+    for key, expected in reference.items():
+        expected = np.asarray(expected, dtype=np.float64)
+        actual = np.asarray(reduced.get(key), dtype=np.float64)
+        mask = np.isfinite(expected) & np.isfinite(actual)
+        if not mask.any():
+            continue
+        scale = np.abs(expected[mask]).max() or 1.0
+        errors[key] = float(np.abs(actual[mask] - expected[mask]).max() / scale)
+
+    failed = sorted(key for key, err in errors.items() if err > tolerance)
+    return {
+        "tolerance": tolerance,
+        "max_error": max(errors.values()) if errors else 0.0,
+        "errors": errors,
+        "failed": failed,
+        "passed": not failed
+    }
+
+
+def check_precision_mode(sample: Optional[pd.DataFrame] = None, tolerance: float = None) -> Dict[str, Any]:
+    """float32 模式下的精度自检（默认使用模拟数据）"""
+    tolerance = tolerance if tolerance is not None else float(os.getenv("PRECISION_TOLERANCE", "1e-4"))
+    if get_precision() == "float64":
+        return {"precision": "float64", "passed": True}
+
+    if sample is None:
+        from .mock_data import mock_data_generator
+        sample = mock_data_generator.generate_stock_data("AAPL", "3mo").reset_index()
+
+    report = compare_precision(sample, tolerance)
+    report["precision"] = get_precision()
+    return report
@@ -0,0 +1,123 @@
+import os
+import copy
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+
+# 各时间框架预测结果的有效期（秒）：预测周期越短，结果过期越快
+PREDICTION_TTL = {
+    "1h": 5 * 60,
+    "1d": 30 * 60,
+    "1w": 6 * 60 * 60,
+}
+
+
+def model_id(llm) -> str:
+    """LLM 标识：分析器类型 + 模型名称（模型变化时缓存自然失效）"""
+    inner = getattr(llm, "llm", None)
+    model = getattr(llm, "model_name", None) or getattr(inner, "model_name", None)
+    return f"{type(llm).__name__}:{model or 'default'}"
+
+
+class PredictionCache:
+    """预测结果缓存（按数据指纹和模型失效，相同请求并发时只执行一次）
+
+    LLM 不可用时降级得到的规则分析结果只缓存 fallback_ttl 秒，LLM 恢复后尽快重新分析。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[Dict[str, float]] = None,
+                 fallback_ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl or PREDICTION_TTL
+        self.fallback_ttl = fallback_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    @staticmethod
+    def make_key(symbol: str, timeframe: str, period: str, model: str, fingerprint: Optional[str] = None) -> str:
+        """缓存键：与 FetchDataNode 的 cache_key 一致的前缀 + 模型标识 + 数据指纹
+
+        不带指纹的键用于合并并发请求（此时数据尚未获取）。
+        """
+        key = f"{symbol.upper()}_{timeframe}_{period}|{model}"
+        return f"{key}|{fingerprint}" if fingerprint else key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的缓存结果"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: str, timeframe: str, result: Dict[str, Any], fallback: bool = False):
+        """写入缓存结果（fallback 为降级结果，按 fallback_ttl 过期，为 0 时不缓存）"""
+        ttl = self.fallback_ttl if fallback else self.ttl.get(timeframe, self.ttl["1d"])
+        if ttl <= 0:
+            return
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def single_flight(self, flight_key: str,
+                            run: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """相同请求并发时只执行一次 run（含数据获取），其余请求等待同一结果"""
+        task = self._inflight.get(flight_key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(self._run(flight_key, run))
+            self._inflight[flight_key] = task
+
+        # shield：某个请求被取消（如客户端断开）不影响其他等待同一结果的请求
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    async def _run(self, flight_key: str, run: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        try:
+            return await run()
+        finally:
+            if self._inflight.get(flight_key) is asyncio.current_task():
+                del self._inflight[flight_key]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            total = self.hits + self.misses + self.shared
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "inflight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "hit_rate": round((self.hits + self.shared) / total, 4) if total else 0.0
+            }
+
+
+# 全局预测结果缓存实例
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", "256")),
+    fallback_ttl=float(os.getenv("PREDICTION_FALLBACK_TTL", "60"))
+)
@@ -0,0 +1,187 @@
+import os
+import re
+import math
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+
+# 分析提示词模板版本（修改提示词或指标编码时递增，使 LLM 结果缓存失效）
+PROMPT_TEMPLATE_VERSION = "2"
+
+# 指标部分的 token 预算：单只股票分析 / 批量分析中的每只股票
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "40"))
+PROMPT_BATCH_TOKEN_BUDGET = int(os.getenv("PROMPT_BATCH_TOKEN_BUDGET", "24"))
+
+# 提示词中列出的信号条数
+PROMPT_MAX_SIGNALS = 3
+
+ANALYSIS_SYSTEM_PROMPT = "你是一个专业的股票技术分析师，擅长基于技术指标进行股票走势预测。"
+
+ANALYSIS_PROMPT_TEMPLATE = """请分析股票 {symbol} 在 {timeframe} 时间框架的走势。
+技术指标（%为百分比）：{features}
+信号：{signal}
+
+以JSON返回：{{"direction":"up|down|neutral","probability":0-100,"price_change_percent":预期涨跌幅,"reasoning":"中文分析理由","confidence":"high|medium|low","risk_factors":["风险因素"]}}
+保持客观谨慎，考虑市场风险。"""
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文字符按每字 1 个，其余按每 4 个字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _latest(values: Dict[str, Any], key: str) -> Optional[float]:
+    """指标最新值（兼容最新值快照和完整序列，缺失时为 None）"""
+    value = values.get(key)
+    if hasattr(value, 'iloc'):
+        value = value.iloc[-1] if len(value) > 0 else None
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _percent(numerator: Optional[float], denominator: Optional[float]) -> Optional[float]:
+    """numerator / denominator - 1，以百分比表示"""
+    if numerator is None or not denominator:
+        return None
+    return (numerator / denominator - 1) * 100
+
+
+def _scaled(value: Optional[float], scale: Optional[float]) -> Optional[float]:
+    """value 相对 scale 的百分比"""
+    if value is None or not scale:
+        return None
+    return value / scale * 100
+
+
+def _band_position(price: Optional[float], lower: Optional[float], upper: Optional[float]) -> Optional[float]:
+    """价格在布林带中的位置（0 为下轨，100 为上轨）"""
+    if price is None or lower is None or upper is None or upper <= lower:
+        return None
+    return (price - lower) / (upper - lower) * 100
+
+
+# 提示词中的指标：按信息量从高到低排列，(短键, 计算函数(指标, 特征, 现价), 保留小数位)。
+# 价格类指标换算为相对现价的百分比，模型不必比较绝对价位。
+PROMPT_FEATURES: Tuple[Tuple[str, Callable[[Dict[str, Any], Dict[str, Any], Optional[float]], Optional[float]], int], ...] = (
+    ("RSI", lambda ind, feat, price: _latest(ind, "rsi"), 0),
+    ("MACDh%", lambda ind, feat, price: _scaled(_latest(ind, "macd_histogram"), price), 2),
+    ("P/MA20%", lambda ind, feat, price: _percent(price, _latest(ind, "sma_20")), 1),
+    ("MA5/MA20%", lambda ind, feat, price: _percent(_latest(ind, "sma_5"), _latest(ind, "sma_20")), 1),
+    ("ATR%", lambda ind, feat, price: _scaled(_latest(ind, "atr"), price), 1),
+    ("Chg5d%", lambda ind, feat, price: _scaled(_latest(feat, "price_change_5d"), 1), 1),
+    ("BB%", lambda ind, feat, price: _band_position(price, _latest(ind, "bb_lower"), _latest(ind, "bb_upper")), 0),
+    ("Vol/Avg", lambda ind, feat, price: _latest(feat, "volume_ratio"), 2),
+    ("StochK", lambda ind, feat, price: _latest(ind, "stoch_k"), 0),
+    ("Chg1d%", lambda ind, feat, price: _scaled(_latest(feat, "price_change_1d"), 1), 1),
+    ("MA20/MA50%", lambda ind, feat, price: _percent(_latest(ind, "sma_20"), _latest(ind, "sma_50")), 1),
+    ("WR", lambda ind, feat, price: _latest(ind, "williams_r"), 0),
+    ("Chg20d%", lambda ind, feat, price: _scaled(_latest(feat, "price_change_20d"), 1), 1),
+    ("BBW%", lambda ind, feat, price: _latest(ind, "bb_width"), 1),
+    ("Price", lambda ind, feat, price: price, 2),
+)
+
+
+def _format_value(value: float) -> str:
+    return f"{value:g}" if value != 0 else "0"
+
+
+def encode_signal(signal_strength: Optional[Dict[str, Any]], max_signals: int = PROMPT_MAX_SIGNALS) -> str:
+    """信号强度编码：strength(score) 加前几条信号"""
+    signal_info = signal_strength or {}
+    text = f"{signal_info.get('strength', 'neutral')}({_format_value(float(signal_info.get('score', 0) or 0))})"
+    signals = signal_info.get('signals') or []
+    if signals:
+        text += " " + ",".join(signals[:max_signals])
+    return text
+
+
+def select_features(data: Dict[str, Any], budget: Optional[int] = None) -> List[Tuple[str, float]]:
+    """按信息量依次选取指标并取整，编码后的 token 数不超过 budget（缺失的指标跳过）"""
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    indicators = data.get('indicators') or {}
+    features = data.get('features') or {}
+    price = _latest(data, 'current_price') or _latest(features, 'current_price') or _latest(indicators, 'close')
+    selected: List[Tuple[str, float]] = []
+    used = 0
+    for key, compute, digits in PROMPT_FEATURES:
+        try:
+            value = compute(indicators, features, price)
+        except (TypeError, ZeroDivisionError):
+            value = None
+        if value is None or not math.isfinite(value):
+            continue
+        value = round(value, digits) + 0.0
+        cost = estimate_tokens(f" {key}={_format_value(value)}")
+        if used + cost > budget:
+            break
+        selected.append((key, value))
+        used += cost
+    return selected
+
+
+def encode_features(features: List[Tuple[str, float]]) -> str:
+    """指标编码为 "键=值" 的单行文本"""
+    return " ".join(f"{key}={_format_value(value)}" for key, value in features) or "无"
+
+
+def build_analysis_prompt(symbol: str, timeframe: str, data: Dict[str, Any], budget: Optional[int] = None) -> str:
+    """单只股票分析提示"""
+    return ANALYSIS_PROMPT_TEMPLATE.format(
+        symbol=symbol,
+        timeframe=timeframe,
+        features=encode_features(select_features(data, budget)),
+        signal=encode_signal(data.get('signal_strength'))
+    )
+
+
+class PromptStats:
+    """提示词 token 统计：估计值与模型返回的实际值（每次调用记录一条，保留最近 history 条）"""
+
+    def __init__(self, history: int = 100):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self.calls = 0
+        self.estimated_total = 0
+        self.actual_total = 0
+        self.actual_calls = 0
+
+    def record(self, kind: str, model: str, estimated: int, actual: Optional[int] = None, symbols: int = 1):
+        """记录一次调用的提示词 token 数"""
+        with self._lock:
+            self.calls += 1
+            self.estimated_total += estimated
+            if actual is not None:
+                self.actual_total += actual
+                self.actual_calls += 1
+            self._recent.append({
+                "kind": kind,
+                "model": model,
+                "symbols": symbols,
+                "estimated_tokens": estimated,
+                "actual_tokens": actual
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        """统计汇总与最近的调用"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "avg_estimated_tokens": round(self.estimated_total / self.calls, 1) if self.calls else 0.0,
+                "avg_actual_tokens": round(self.actual_total / self.actual_calls, 1) if self.actual_calls else None,
+                "token_budget": PROMPT_TOKEN_BUDGET,
+                "batch_token_budget": PROMPT_BATCH_TOKEN_BUDGET,
+                "recent": list(self._recent)[-20:]
+            }
+
+
+# 全局提示词统计实例
+prompt_stats = PromptStats()
@@ -0,0 +1,106 @@
+import math
+from typing import Dict, Any, List
+
+
+# 各时间框架相对日波动率的缩放系数（按 sqrt(时间) 缩放，1天约 6.5 个交易小时，1周 5 个交易日）
+HORIZON_SCALE = {
+    "1h": math.sqrt(1 / 6.5),
+    "1d": 1.0,
+    "1w": math.sqrt(5),
+}
+
+STRENGTH_LABELS = {
+    "strong_bullish": "强烈看涨",
+    "bullish": "看涨",
+    "neutral": "中性",
+    "bearish": "看跌",
+    "strong_bearish": "强烈看跌",
+}
+
+HORIZON_LABELS = {
+    "1h": "未来1小时",
+    "1d": "未来1天",
+    "1w": "未来1周",
+}
+
+
+class RuleBasedAnalyzer:
+    """规则分析器：仅依据特征和信号强度生成确定性的预测（与 LLM 分析器接口一致）"""
+    
+    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
+        """分析股票并返回预测结果"""
+        features = data.get('features') or {}
+        signal_strength = data.get('signal_strength') or {}
+        score = float(signal_strength.get('score', features.get('signal_score', 0)) or 0)
+        strength = signal_strength.get('strength', features.get('signal_strength', 'neutral'))
+        current_price = float(data.get('current_price') or features.get('current_price') or 0)
+        
+        # 信号确定性：得分绝对值 0~4 映射到 0~1
+        conviction = min(abs(score), 4) / 4
+        if score >= 1:
+            direction = "up"
+        elif score <= -1:
+            direction = "down"
+        else:
+            direction = "neutral"
+        
+        # 预期涨跌幅 = 日波动率 × 时间缩放 × 信号确定性（中性信号只保留小幅偏向）
+        move = self._daily_volatility(features, current_price) * HORIZON_SCALE.get(timeframe, 1.0) * 100
+        if direction == "neutral":
+            price_change = move * 0.5 * score / 4
+            probability = 50.0
+        else:
+            price_change = math.copysign(move * (0.5 + conviction), score)
+            probability = 50 + 30 * conviction
+        
+        if abs(score) >= 3:
+            confidence = "high"
+        elif abs(score) >= 1:
+            confidence = "medium"
+        else:
+            confidence = "low"
+        
+        signals = signal_strength.get('signals') or []
+        reasoning = (
+            f"规则分析：技术信号{STRENGTH_LABELS.get(strength, '中性')}（得分 {score:g}）。"
+            f"主要信号：{'、'.join(signals[:3]) if signals else '无明显信号'}。"
+            f"按近期波动率估算{HORIZON_LABELS.get(timeframe, '未来')}价格变动约 {price_change:+.2f}%。"
+        )
+        
+        return {
+            "direction": direction,
+            "probability": round(probability, 1),
+            "price_change_percent": round(price_change, 2),
+            "reasoning": reasoning,
+            "confidence": confidence,
+            "risk_factors": self._risk_factors(features, current_price),
+            "analyzer": "rules"
+        }
+    
+    @staticmethod
+    def _daily_volatility(features: Dict[str, Any], current_price: float) -> float:
+        """日波动率（收益率口径）：20日收益率标准差，缺失时取 ATR 相对现价，均缺失时取 2%"""
+        value = features.get('return_volatility_20d') or 0
+        if value > 0 and not math.isnan(value):
+            return value
+        atr = features.get('atr') or 0
+        if current_price > 0 and atr > 0 and not math.isnan(atr):
+            return atr / current_price
+        return 0.02
+    
+    def _risk_factors(self, features: Dict[str, Any], current_price: float) -> List[str]:
+        """风险因素"""
+        risk_factors = ["规则分析未考虑基本面和消息面"]
+        if self._daily_volatility(features, current_price) > 0.03:
+            risk_factors.append("近期波动率较高")
+        rsi = features.get('rsi', 50)
+        if rsi is not None and (rsi < 30 or rsi > 70):
+            risk_factors.append("RSI处于超买/超卖区域，可能出现反转")
+        volume_ratio = features.get('volume_ratio', 1)
+        if volume_ratio is not None and volume_ratio < 0.7:
+            risk_factors.append("成交量萎缩，信号可靠性降低")
+        return risk_factors
+
+
+# 全局规则分析器实例
+rule_analyzer = RuleBasedAnalyzer()
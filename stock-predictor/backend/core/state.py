@@ -1,5 +1,7 @@
-from typing import Dict, List, Optional, Any
-from pydantic import BaseModel, ConfigDict
+from typing import Annotated, Dict, List, Optional, Any
+from dataclasses import dataclass, field
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
 import pandas as pd
 
 
@@ -18,6 +20,29 @@ class PredictionRequest(BaseModel):
     symbol: str
     timeframe: str  # "1h", "1d", "1w"
     current_price: Optional[float] = None
+    mode: str = "auto"  # "auto", "llm", "rules"
+
+
+class BatchPredictionRequest(BaseModel):
+    """批量预测请求模型"""
+    symbols: List[str] = Field(min_length=1)
+    timeframes: List[str] = Field(default=["1d"], min_length=1)
+    max_concurrency: Optional[int] = None
+    mode: str = "auto"
+
+
+class MultiTimeframePredictionRequest(BaseModel):
+    """多时间框架预测请求模型"""
+    symbol: str
+    timeframes: List[str] = Field(default=["1h", "1d", "1w"], min_length=1)
+    mode: str = "auto"
+
+
+class JobRequest(BaseModel):
+    """预测任务提交模型（params 为对应预测接口的请求体）"""
+    kind: str = "predict"  # "predict", "multi", "batch"
+    params: Dict[str, Any]
+    max_attempts: Optional[int] = None
 
 
 class PredictionResult(BaseModel):
@@ -30,6 +55,7 @@ class PredictionResult(BaseModel):
     confidence: str  # "high", "medium", "low"
     reasoning: str
     risk_warning: str
+    analyzer: str = "llm"  # "llm" 或 "rules"
 
 
 class StockAdvice(BaseModel):
@@ -49,17 +75,46 @@ class TopStocksResponse(BaseModel):
     disclaimer: str
 
 
-class WorkflowState(BaseModel):
-    """LangGraph 工作流状态"""
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-    
+@dataclass(slots=True)
+class WorkflowState:
+    """LangGraph 工作流状态
+
+    使用带 slots 的 dataclass：节点间只传递引用，不做逐步的 pydantic 校验和复制。
+    原始K线在特征提取后即释放，下游节点只使用特征和指标最新值快照。
+    """
     symbol: str
     timeframe: str
-    raw_data: Optional[pd.DataFrame] = None
-    processed_data: Optional[pd.DataFrame] = None
-    indicators: Optional[Dict[str, Any]] = None
+    as_of: Optional[datetime] = None  # 历史回放时的时间点（None 表示最新数据）
+    analysis_mode: str = "auto"  # 分析方式："auto" / "llm" / "rules"
+    raw_data: Optional[pd.DataFrame] = None  # 特征提取后置为 None
+    indicators: Optional[Dict[str, float]] = None  # 各指标最新值
+    signal_strength: Optional[Dict[str, Any]] = None
+    support_resistance: Optional[Dict[str, Any]] = None
     features: Optional[Dict[str, Any]] = None
     llm_analysis: Optional[Dict[str, Any]] = None
-    prediction: Optional[PredictionResult] = None
+    advice: Optional[Dict[str, Any]] = None
+    prediction: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    retry_after: Optional[int] = None  # LLM 排队已满或排队超时时建议的重试间隔（秒）
+    llm_fallback: bool = False  # LLM 分析失败（含排队已满、排队超时）后降级为规则分析
     cache_key: Optional[str] = None
+
+
+def merge_predictions(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并并行分支写入的各时间框架预测结果"""
+    return {**(left or {}), **(right or {})}
+
+
+@dataclass(slots=True)
+class MultiTimeframeState:
+    """多时间框架预测工作流状态
+
+    只获取一次最长周期的数据，各时间框架在并行分支中截取各自的数据段运行单时间框架工作流。
+    """
+    symbol: str
+    timeframes: List[str]
+    as_of: Optional[datetime] = None
+    analysis_mode: str = "auto"
+    raw_data: Optional[pd.DataFrame] = None
+    predictions: Annotated[Dict[str, Dict[str, Any]], merge_predictions] = field(default_factory=dict)
+    error: Optional[str] = None
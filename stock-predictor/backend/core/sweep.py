@@ -0,0 +1,234 @@
+"""
+指标窗口与信号阈值参数扫描
+
+在历史收盘价面板上评估 SignalRules 参数网格（RSI 窗口与 30/70 阈值、SMA 快慢线、布林带、
+MACD、得分阈值），按指定指标排序输出参数组合。
+
+共享中间结果只计算一次：
+- 收盘价及其平方的累计和，任意 SMA / 标准差窗口都是 O(1) 的差分；
+- RSI、MACD 按窗口缓存，各打分分量按其参数子集缓存；
+- 网格点按窗口参数排序后分块，同一进程内相邻网格点复用同一批中间结果。
+各块在进程池中并行评估，收盘价面板通过共享内存传递。
+"""
+import os
+import math
+import itertools
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .backtest import SignalRules, VectorizedBacktester
+
+
+# 网格点排序键：窗口类参数在前，使相邻网格点共享中间结果
+_WINDOW_KEYS = ("rsi_window", "sma_slow", "sma_fast", "bb_window", "bb_std",
+                "macd_fast", "macd_slow", "macd_signal")
+
+
+class _SweepContext:
+    """单个进程内的中间结果缓存"""
+
+    def __init__(self, close: np.ndarray, max_cached: int = 64):
+        self.close = close
+        valid = np.isfinite(close)
+        filled = np.where(valid, close, 0.0)
+        zeros = np.zeros((1, close.shape[1]))
+        # 前缀和：sum(x[t-w+1..t]) = cs[t+1] - cs[t+1-w]
+        self.cs = np.vstack([zeros, np.cumsum(filled, axis=0)])
+        self.cs2 = np.vstack([zeros, np.cumsum(filled * filled, axis=0)])
+        self.count = np.vstack([zeros, np.cumsum(valid, axis=0)])
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+
+    def _memo(self, key: Tuple, compute):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        value = compute()
+        self._cache[key] = value
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return value
+
+    def _window_sums(self, window: int):
+        n = self.close.shape[0]
+        out_sum = np.full(self.close.shape, np.nan)
+        out_sq = np.full(self.close.shape, np.nan)
+        if window > n:
+            return out_sum, out_sq
+        full = (self.count[window:] - self.count[:-window]) == window
+        s = self.cs[window:] - self.cs[:-window]
+        sq = self.cs2[window:] - self.cs2[:-window]
+        out_sum[window - 1:] = np.where(full, s, np.nan)
+        out_sq[window - 1:] = np.where(full, sq, np.nan)
+        return out_sum, out_sq
+
+    def sma(self, window: int) -> np.ndarray:
+        return self._memo(("sma", window), lambda: self._window_sums(window)[0] / window)
+
+    def std(self, window: int) -> np.ndarray:
+        """总体标准差（与布林带一致）"""
+        def _compute():
+            s, sq = self._window_sums(window)
+            mean = s / window
+            return np.sqrt(np.maximum(sq / window - mean * mean, 0.0))
+        return self._memo(("std", window), _compute)
+
+    def rsi(self, window: int) -> np.ndarray:
+        def _compute():
+            from .expressions import evaluate_expressions
+            expr = f"rsi(close,{window})"
+            frame = pd.DataFrame(self.close)
+            return evaluate_expressions([expr], {"close": frame})[expr].to_numpy()
+        return self._memo(("rsi", window), _compute)
+
+    def macd(self, fast: int, slow: int, signal: int) -> Tuple[np.ndarray, np.ndarray]:
+        def _compute():
+            frame = pd.DataFrame(self.close)
+            macd = frame.ewm(span=fast, min_periods=fast, adjust=False).mean() \
+                - frame.ewm(span=slow, min_periods=slow, adjust=False).mean()
+            macd_signal = macd.ewm(span=signal, min_periods=signal, adjust=False).mean()
+            return macd.to_numpy(), macd_signal.to_numpy()
+        return self._memo(("macd", fast, slow, signal), _compute)
+
+    def score(self, rules: SignalRules) -> np.ndarray:
+        """信号强度得分 = 各分量之和（分量按参数子集缓存），预热期为 NaN"""
+        rsi_part = self._memo(
+            ("rsi_part", rules.rsi_window, rules.rsi_oversold, rules.rsi_overbought),
+            lambda: _rsi_part(self.rsi(rules.rsi_window), rules.rsi_oversold, rules.rsi_overbought)
+        )
+        macd_part = self._memo(
+            ("macd_part", rules.macd_fast, rules.macd_slow, rules.macd_signal),
+            lambda: np.where(np.greater(*self.macd(rules.macd_fast, rules.macd_slow, rules.macd_signal)), 1.0, -1.0)
+        )
+        sma_part = self._memo(
+            ("sma_part", rules.sma_fast, rules.sma_slow),
+            lambda: np.where(self.sma(rules.sma_fast) > self.sma(rules.sma_slow), 1.0, -1.0)
+        )
+        bb_part = self._memo(
+            ("bb_part", rules.bb_window, rules.bb_std),
+            lambda: np.where(2 * rules.bb_std * self.std(rules.bb_window) > 0, 0.5, 0.0)
+        )
+        warm = self._memo(
+            ("warm", rules.rsi_window, rules.sma_slow, rules.macd_fast, rules.macd_slow, rules.macd_signal),
+            lambda: np.isfinite(self.rsi(rules.rsi_window)) & np.isfinite(self.sma(rules.sma_slow))
+            & np.isfinite(self.macd(rules.macd_fast, rules.macd_slow, rules.macd_signal)[1])
+        )
+        score = rsi_part + macd_part + sma_part + bb_part
+        return np.where(warm, score, np.nan)
+
+
+def _rsi_part(rsi: np.ndarray, oversold: float, overbought: float) -> np.ndarray:
+    return np.where(rsi < oversold, 2.0, np.where(rsi > overbought, -2.0, 0.0))
+
+
+def _evaluate_points(close: np.ndarray, points: List[Dict[str, Any]],
+                     backtester: VectorizedBacktester) -> List[Dict[str, Any]]:
+    """在同一上下文中评估一组网格点"""
+    context = _SweepContext(close)
+    results = []
+    for params in points:
+        rules = SignalRules(**params)
+        score = context.score(rules)
+        position = np.where(score >= rules.long_threshold, 1.0, 0.0)
+        if rules.allow_short:
+            position = np.where(score <= rules.short_threshold, -1.0, position)
+        position[np.isnan(score)] = 0.0
+        summary = backtester.summarize(*backtester.simulate(close, position))
+        results.append({**params, **summary})
+    return results
+
+
+def _evaluate_chunk(job: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """子进程：附加共享内存中的收盘价面板并评估一块网格点"""
+    shm = shared_memory.SharedMemory(name=job["close"])
+    close = None
+    try:
+        close = np.ndarray(job["shape"], dtype=np.float64, buffer=shm.buf)
+        backtester = VectorizedBacktester(**job["backtester"])
+        return _evaluate_points(close, job["points"], backtester)
+    finally:
+        close = None
+        shm.close()
+
+
+class ParameterSweep:
+    """SignalRules 参数网格扫描"""
+
+    def __init__(self, backtester: Optional[VectorizedBacktester] = None,
+                 max_workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.backtester = backtester or VectorizedBacktester()
+        self.max_workers = max_workers or int(os.getenv("SWEEP_WORKERS", "0")) or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def expand_grid(grid: Dict[str, Sequence[Any]], base: Optional[SignalRules] = None) -> List[Dict[str, Any]]:
+        """展开参数网格，过滤无效组合（如快线窗口不小于慢线）"""
+        base_params = (base or SignalRules()).model_dump()
+        unknown = set(grid) - set(base_params)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+        keys = list(grid)
+        points = []
+        for values in itertools.product(*(grid[k] for k in keys)):
+            params = {**base_params, **dict(zip(keys, values))}
+            if params["sma_fast"] >= params["sma_slow"] or params["macd_fast"] >= params["macd_slow"]:
+                continue
+            if params["rsi_oversold"] >= params["rsi_overbought"]:
+                continue
+            points.append(SignalRules(**params).model_dump())
+
+        # 按窗口参数排序，使同一块内的网格点共享中间结果
+        points.sort(key=lambda p: tuple(p[k] for k in _WINDOW_KEYS))
+        return points
+
+    def run(self, panel: Dict[str, pd.DataFrame], grid: Dict[str, Sequence[Any]],
+            metric: str = "sharpe", top_n: Optional[int] = None,
+            base: Optional[SignalRules] = None) -> pd.DataFrame:
+        """评估参数网格，返回按 metric 降序排列的参数组合"""
+        close = panel["close"].astype(float).to_numpy()
+        points = self.expand_grid(grid, base)
+        if not points or close.size == 0:
+            return pd.DataFrame()
+
+        if self.max_workers <= 1 or len(points) == 1:
+            results = _evaluate_points(close, points, self.backtester)
+        else:
+            results = self._run_parallel(close, points)
+
+        ranked = pd.DataFrame(results).sort_values(metric, ascending=False).reset_index(drop=True)
+        return ranked.head(top_n) if top_n else ranked
+
+    def _run_parallel(self, close: np.ndarray, points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        size = self.chunk_size or max(1, math.ceil(len(points) / (self.max_workers * 4)))
+        shm = shared_memory.SharedMemory(create=True, size=close.nbytes)
+        shared = None
+        try:
+            shared = np.ndarray(close.shape, dtype=np.float64, buffer=shm.buf)
+            shared[:] = close
+            backtester_config = {
+                "cost_bps": self.backtester.cost_bps,
+                "slippage_bps": self.backtester.slippage_bps,
+                "periods_per_year": self.backtester.periods_per_year,
+            }
+            jobs = [
+                {"close": shm.name, "shape": close.shape, "backtester": backtester_config,
+                 "points": points[start:start + size]}
+                for start in range(0, len(points), size)
+            ]
+            results = []
+            with ProcessPoolExecutor(max_workers=self.max_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                for chunk in pool.map(_evaluate_chunk, jobs):
+                    results.extend(chunk)
+            return results
+        finally:
+            shared = None
+            shm.close()
+            shm.unlink()
@@ -1,14 +1,16 @@
 import os
+import asyncio
 import hashlib
 import pandas as pd
 import yfinance as yf
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 import pyarrow as pa
 import pyarrow.parquet as pq
 from pathlib import Path
 from .mock_data import mock_data_generator
 from .api_manager import api_manager
+from .precision import cast_frame
 
 
 class DataCache:
@@ -65,11 +67,11 @@ class StockDataFetcher:
         self.cache = DataCache()
     
     async def fetch_stock_data(self, symbol: str, period: str = "1mo") -> pd.DataFrame:
-        """获取股票数据"""
+        """获取股票数据（缓存文件读写在线程中执行，不阻塞事件循环）"""
         # 先尝试从缓存获取
-        cached_data = self.cache.get_cached_data(symbol, period)
+        cached_data = await asyncio.to_thread(self.cache.get_cached_data, symbol, period)
         if cached_data is not None:
-            return cached_data
+            return cast_frame(cached_data)
         
         try:
             # 使用API管理器获取数据
@@ -79,18 +81,46 @@ class StockDataFetcher:
                 raise ValueError(f"No data found for symbol: {symbol}")
             
             # 缓存数据
-            self.cache.cache_data(symbol, period, data)
+            await asyncio.to_thread(self.cache.cache_data, symbol, period, data)
             
-            return data
+            return cast_frame(data)
             
         except Exception as e:
             print(f"All APIs failed for {symbol}, using mock data: {str(e)}")
             # 使用Mock数据作为备用
             mock_data = mock_data_generator.generate_stock_data(symbol, period)
             # 缓存Mock数据
-            self.cache.cache_data(symbol, period, mock_data)
-            return mock_data
+            await asyncio.to_thread(self.cache.cache_data, symbol, period, mock_data)
+            return cast_frame(mock_data)
     
+    async def fetch_many(self, symbols: List[str], period: str = "1mo",
+                         max_concurrency: int = 8) -> Dict[str, pd.DataFrame]:
+        """批量获取股票数据：先查缓存，未命中的合并为一次批量请求，仍缺失的逐只获取（含Mock备用）"""
+        results: Dict[str, pd.DataFrame] = {}
+        missing = []
+        for symbol in dict.fromkeys(symbols):
+            cached_data = await asyncio.to_thread(self.cache.get_cached_data, symbol, period)
+            if cached_data is not None:
+                results[symbol] = cast_frame(cached_data)
+            else:
+                missing.append(symbol)
+
+        if missing:
+            batch = await api_manager.get_stock_data_batch(missing, period)
+            for symbol, data in batch.items():
+                await asyncio.to_thread(self.cache.cache_data, symbol, period, data)
+                results[symbol] = cast_frame(data)
+
+        # 批量请求未覆盖的股票逐只获取，限制并发
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _fetch_one(symbol: str):
+            async with semaphore:
+                results[symbol] = await self.fetch_stock_data(symbol, period)
+
+        await asyncio.gather(*(_fetch_one(s) for s in missing if s not in results))
+        return {symbol: results[symbol] for symbol in dict.fromkeys(symbols) if symbol in results}
+
     def fetch_stock_data_sync(self, symbol: str, period: str = "1mo") -> pd.DataFrame:
         """同步获取股票数据"""
         import asyncio
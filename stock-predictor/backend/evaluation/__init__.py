@@ -0,0 +1 @@
+# Evaluation modules
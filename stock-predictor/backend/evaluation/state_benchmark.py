@@ -0,0 +1,136 @@
+"""
+工作流状态开销基准
+
+对 StockPredictionPipeline 的单次预测测量：
+- 每次预测的内存峰值与结束后状态仍持有的内存（tracemalloc）；
+- 每个节点的框架开销：工作流总耗时减去节点函数自身耗时，按节点数平均。
+随机游走数据在进程内生成并预先放入状态，LLM 使用 MockLLM，测量结果不受网络影响。
+"""
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+from typing import Dict, Any, List
+
+import numpy as np
+import pandas as pd
+
+from backend.core.state import WorkflowState
+from backend.core.llm import MockLLM
+from backend.graph.pipeline import StockPredictionPipeline
+
+
+NODE_NAMES = ("fetch_data_node", "feature_engineer_node", "llm_analyze_node", "rule_analyze_node",
+              "make_advice_node", "report_node")
+
+
+class _TimedNode:
+    """记录节点函数自身耗时的包装器"""
+
+    def __init__(self, node, timings: List[float]):
+        self.node = node
+        self.timings = timings
+
+    def __call__(self, state):
+        start = time.perf_counter()
+        try:
+            return self.node(state)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+    async def acall(self, state):
+        return self(state)
+
+
+def _retained_size(obj, seen=None) -> int:
+    """对象图的近似内存占用（DataFrame / Series / ndarray 按数据缓冲区计）"""
+    import sys
+
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum()) if isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_retained_size(k, seen) + _retained_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_retained_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _retained_size(vars(obj), seen)
+    return size
+
+
+def _synthetic_frame(bars: int, seed: int = 0) -> pd.DataFrame:
+    """生成 bars 根日K线的随机游走 OHLCV 数据"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    spread = np.abs(rng.normal(0, 0.005, bars)) * close
+    return pd.DataFrame({
+        "date": pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=bars),
+        "open": close * (1 + rng.normal(0, 0.002, bars)),
+        "high": close + spread,
+        "low": close - spread,
+        "close": close,
+        "volume": rng.integers(1_000_000, 5_000_000, bars).astype(float),
+    })
+
+
+def run_benchmark(bars: int = 250, timeframe: str = "1w", runs: int = 50, mode: str = "llm") -> Dict[str, Any]:
+    """执行基准测试"""
+    pipeline = StockPredictionPipeline(llm=MockLLM())
+    timings: List[float] = []
+    for name in NODE_NAMES:
+        setattr(pipeline, name, _TimedNode(getattr(pipeline, name), timings))
+    workflow = pipeline._build_workflow()
+
+    frame = _synthetic_frame(bars)
+    # 预热（指标缓存命中后，测量只反映状态传递与节点开销）
+    workflow.invoke(WorkflowState(symbol="AAPL", timeframe=timeframe, analysis_mode=mode, raw_data=frame))
+
+    # 耗时与内存分开测量（tracemalloc 本身会拖慢执行）
+    totals, node_sums, peaks, retained = [], [], [], []
+    for _ in range(runs):
+        timings.clear()
+        start = time.perf_counter()
+        result = workflow.invoke(WorkflowState(symbol="AAPL", timeframe=timeframe, analysis_mode=mode, raw_data=frame))
+        totals.append(time.perf_counter() - start)
+        node_sums.append(sum(timings))
+        executed = len(timings)
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+
+    for _ in range(max(runs // 5, 1)):
+        gc.collect()
+        tracemalloc.start()
+        result = workflow.invoke(WorkflowState(symbol="AAPL", timeframe=timeframe, analysis_mode=mode, raw_data=frame))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        # 输入数据由调用方持有，不计入状态
+        retained.append(_retained_size({k: v for k, v in dict(result).items() if v is not frame}))
+
+    totals, node_sums = np.array(totals), np.array(node_sums)
+    return {
+        "bars": bars,
+        "runs": runs,
+        "mode": mode,
+        "total_ms": round(float(np.median(totals)) * 1e3, 3),
+        "node_ms": round(float(np.median(node_sums)) * 1e3, 3),
+        "overhead_per_node_ms": round(float(np.median(totals - node_sums)) * 1e3 / executed, 3),
+        "peak_kb": round(float(np.median(peaks)) / 1024, 1),
+        "retained_state_kb": round(float(np.median(retained)) / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="工作流状态开销基准")
+    parser.add_argument("--bars", type=int, default=250, help="模拟K线数量")
+    parser.add_argument("--timeframe", default="1w")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--mode", default="llm", choices=["auto", "llm", "rules"], help="分析方式")
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.bars, args.timeframe, args.runs, args.mode), indent=2, ensure_ascii=False))
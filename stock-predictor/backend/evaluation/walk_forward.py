@@ -0,0 +1,283 @@
+"""
+StockPredictionPipeline 滚动回放评估
+
+在一组历史时点上回放预测工作流：FetchDataNode 通过时点数据源只能看到 as_of 之前的K线，
+预测的方向和 price_range 与随后实际价格对比打分。LLM 响应按输入内容记录到磁盘，
+重复运行不会再次调用模型。多个时点在有限并发下并行执行。
+"""
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from backend.graph.pipeline import StockPredictionPipeline
+from backend.graph.nodes.fetch_data import slice_period
+
+
+# 各时间框架的评估持有期
+HORIZONS = {
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+    "1w": timedelta(days=7),
+}
+
+
+class PointInTimeDataFetcher:
+    """时点数据源：只返回 as_of 之前的历史数据"""
+
+    def __init__(self, history: Dict[str, pd.DataFrame]):
+        self.history = {symbol.upper(): _normalize_history(df) for symbol, df in history.items()}
+
+    def fetch_stock_data_sync(self, symbol: str, period: str = "1mo",
+                              as_of: Optional[datetime] = None) -> pd.DataFrame:
+        """获取 as_of 时点可见的最近 period 数据"""
+        df = self.history.get(symbol.upper())
+        if df is None or df.empty:
+            return pd.DataFrame()
+
+        if as_of is not None:
+            df = df[df['date'] <= pd.Timestamp(as_of)]
+        if df.empty:
+            return df
+
+        return slice_period(df, period).reset_index(drop=True)
+
+    async def fetch_stock_data(self, symbol: str, period: str = "1mo",
+                               as_of: Optional[datetime] = None) -> pd.DataFrame:
+        """异步接口（与 StockDataFetcher 保持一致）"""
+        return self.fetch_stock_data_sync(symbol, period, as_of=as_of)
+
+
+class RecordedLLM:
+    """带磁盘记录的 LLM 包装器：相同输入直接回放已记录的响应"""
+
+    def __init__(self, llm, record_dir: str = "data/llm_recordings"):
+        self.llm = llm
+        self.record_dir = Path(record_dir)
+        self.record_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # 其余属性（如 generate_top_stocks）透传给原始分析器；
+        # 批量分析不透传，回放时每只股票都经过 analyze_stock 的记录
+        if name in ("llm", "analyze_stocks", "aanalyze_stocks"):
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    async def aanalyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
+        """分析股票（异步版本：回放和记录都经过 analyze_stock，不透传给原始分析器）"""
+        return await asyncio.to_thread(self.analyze_stock, symbol, data, timeframe)
+
+    def _model_id(self) -> str:
+        model = getattr(self.llm, "model_name", None) or getattr(getattr(self.llm, "llm", None), "model_name", None)
+        return f"{type(self.llm).__name__}:{model or 'default'}"
+
+    def _record_key(self, symbol: str, data: Dict[str, Any], timeframe: str) -> str:
+        """以提示词实际使用的内容（各指标最新值、信号强度、特征）生成记录键"""
+        indicators = {}
+        for key, value in (data.get('indicators') or {}).items():
+            latest = value.iloc[-1] if hasattr(value, 'iloc') and len(value) > 0 else value
+            indicators[key] = None if latest is None or pd.isna(latest) else float(f"{float(latest):.6g}")
+
+        payload = {
+            "model": self._model_id(),
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "indicators": indicators,
+            "signal_strength": data.get('signal_strength'),
+            "features": data.get('features'),
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def analyze_stock(self, symbol: str, data: Dict[str, Any], timeframe: str) -> Dict[str, Any]:
+        """分析股票（命中记录时不调用模型）"""
+        path = self.record_dir / f"{self._record_key(symbol, data, timeframe)}.json"
+        if path.exists():
+            try:
+                self.hits += 1
+                return json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                self.hits -= 1
+
+        self.misses += 1
+        result = self.llm.analyze_stock(symbol=symbol, data=data, timeframe=timeframe)
+        # 出错的响应不记录，下次重试
+        if not result.get("error"):
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(result, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp_path, path)
+        return result
+
+
+class WalkForwardEvaluator:
+    """滚动回放评估器"""
+
+    def __init__(self, history: Dict[str, pd.DataFrame], llm=None,
+                 record_dir: str = "data/llm_recordings", max_concurrency: int = 4,
+                 neutral_band: float = 0.005):
+        from backend.core.llm_manager import get_llm_analyzer
+
+        self.data_fetcher = PointInTimeDataFetcher(history)
+        self.llm = RecordedLLM(llm or get_llm_analyzer(), record_dir)
+        self.pipeline = StockPredictionPipeline(data_fetcher=self.data_fetcher, llm=self.llm)
+        self.max_concurrency = max_concurrency
+        self.neutral_band = neutral_band
+
+    async def run(self, symbols: Sequence[str], dates: Sequence[datetime],
+                  timeframes: Sequence[str] = ("1d", "1w")) -> List[Dict[str, Any]]:
+        """回放所有 (股票, 时点, 时间框架) 组合"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _evaluate(symbol: str, as_of: datetime, timeframe: str) -> Dict[str, Any]:
+            async with semaphore:
+                prediction = await self.pipeline.predict(symbol, timeframe, as_of=as_of)
+            return self._score(symbol.upper(), pd.Timestamp(as_of), timeframe, prediction)
+
+        tasks = [
+            _evaluate(symbol, as_of, timeframe)
+            for symbol in symbols for as_of in dates for timeframe in timeframes
+        ]
+        return await asyncio.gather(*tasks)
+
+    def _score(self, symbol: str, as_of: pd.Timestamp, timeframe: str,
+               prediction: Dict[str, Any]) -> Dict[str, Any]:
+        """将预测与实际价格对比"""
+        record = {"symbol": symbol, "as_of": as_of.isoformat(), "timeframe": timeframe}
+        if prediction.get("error"):
+            record["error"] = prediction["error"]
+            return record
+
+        history = self.data_fetcher.history.get(symbol)
+        if history is None or history.empty:
+            record["error"] = "No history for symbol"
+            return record
+        dates = history['date']
+        start_idx = dates.searchsorted(as_of, side="right") - 1
+        end_idx = dates.searchsorted(as_of + HORIZONS.get(timeframe, HORIZONS["1d"]), side="left")
+        if start_idx < 0 or end_idx >= len(history):
+            record["error"] = "No realized price for horizon"
+            return record
+
+        start_price = float(history['close'].iloc[start_idx])
+        realized_price = float(history['close'].iloc[end_idx])
+        realized_change = realized_price / start_price - 1
+        if realized_change > self.neutral_band:
+            realized_direction = "up"
+        elif realized_change < -self.neutral_band:
+            realized_direction = "down"
+        else:
+            realized_direction = "neutral"
+
+        price_range = prediction.get("price_range") or {}
+        low, high = sorted([price_range.get("min", start_price), price_range.get("max", start_price)])
+        record.update({
+            "direction": prediction.get("direction"),
+            "probability": float(prediction.get("probability") or 0),
+            "confidence": prediction.get("confidence"),
+            "start_price": start_price,
+            "realized_price": realized_price,
+            "realized_change": realized_change,
+            "realized_direction": realized_direction,
+            "direction_hit": prediction.get("direction") == realized_direction,
+            "range_hit": low <= realized_price <= high,
+            "range_midpoint_error": abs((low + high) / 2 - realized_price) / start_price,
+        })
+        return record
+
+    @staticmethod
+    def report(results: List[Dict[str, Any]], n_buckets: int = 5) -> Dict[str, Any]:
+        """按时间框架汇总准确率与校准情况"""
+        df = pd.DataFrame(results)
+        if df.empty:
+            return {}
+
+        report = {}
+        for timeframe, group in df.groupby("timeframe"):
+            scored = group[group["error"].isna()] if "error" in group else group
+            entry = {
+                "total": int(len(group)),
+                "scored": int(len(scored)),
+                "errors": int(len(group) - len(scored)),
+            }
+            if not scored.empty:
+                hits = scored["direction_hit"].astype(float)
+                prob = scored["probability"].clip(0, 100) / 100
+                entry.update({
+                    "direction_accuracy": float(hits.mean()),
+                    "range_coverage": float(scored["range_hit"].astype(float).mean()),
+                    "mean_midpoint_error": float(scored["range_midpoint_error"].mean()),
+                    "brier_score": float(((prob - hits) ** 2).mean()),
+                    "by_direction": {
+                        direction: float(g["direction_hit"].astype(float).mean())
+                        for direction, g in scored.groupby("direction")
+                    },
+                    "calibration": _calibration(prob, hits, n_buckets),
+                })
+            report[timeframe] = entry
+        return report
+
+
+def _calibration(prob: pd.Series, hits: pd.Series, n_buckets: int) -> List[Dict[str, Any]]:
+    """按预测概率分桶：平均预测概率 vs 实际命中率"""
+    edges = np.linspace(0, 1, n_buckets + 1)
+    buckets = np.clip(np.digitize(prob, edges[1:-1]), 0, n_buckets - 1)
+    calibration = []
+    for b in range(n_buckets):
+        mask = buckets == b
+        if not mask.any():
+            continue
+        calibration.append({
+            "bucket": f"{edges[b]:.1f}-{edges[b + 1]:.1f}",
+            "count": int(mask.sum()),
+            "mean_probability": float(prob[mask].mean()),
+            "hit_rate": float(hits[mask].mean()),
+        })
+    return calibration
+
+
+def _normalize_history(df: pd.DataFrame) -> pd.DataFrame:
+    """统一为按日期排序、带 date 列的 OHLCV 数据"""
+    frame = df.reset_index() if 'date' not in df.columns else df.copy()
+    if 'date' not in frame.columns:
+        frame = frame.rename(columns={frame.columns[0]: 'date'})
+    frame['date'] = pd.to_datetime(frame['date'], utc=True).dt.tz_localize(None)
+    return frame.sort_values('date').reset_index(drop=True)
+
+
+async def _main(args):
+    from backend.core.utils import StockDataFetcher
+
+    fetcher = StockDataFetcher()
+    symbols = [s.upper() for s in args.symbols]
+    history = {symbol: await fetcher.fetch_stock_data(symbol, args.history) for symbol in symbols}
+
+    evaluator = WalkForwardEvaluator(history, record_dir=args.record_dir, max_concurrency=args.concurrency)
+    # 回放时点：历史数据的最后 steps 个交易日（留出最长持有期）
+    common = _normalize_history(history[symbols[0]])['date']
+    dates = list(common.iloc[-(args.steps + 6):-6:args.stride])
+
+    results = await evaluator.run(symbols, dates, args.timeframes)
+    report = evaluator.report(results)
+    report["llm_recordings"] = {"hits": evaluator.llm.hits, "misses": evaluator.llm.misses}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StockPredictionPipeline 滚动回放评估")
+    parser.add_argument("--symbols", nargs="+", default=["AAPL"])
+    parser.add_argument("--timeframes", nargs="+", default=["1d", "1w"])
+    parser.add_argument("--history", default="1y", help="历史数据周期")
+    parser.add_argument("--steps", type=int, default=60, help="回放的交易日数量")
+    parser.add_argument("--stride", type=int, default=1, help="回放时点间隔（交易日）")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--record-dir", default="data/llm_recordings")
+    asyncio.run(_main(parser.parse_args()))
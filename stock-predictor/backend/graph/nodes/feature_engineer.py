@@ -1,31 +1,96 @@
-from typing import Dict, Any
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, Tuple
 import pandas as pd
 import numpy as np
 from backend.core.state import WorkflowState
 from backend.core.indicators import TechnicalIndicators
+from backend.core.indicator_cache import indicator_cache, data_fingerprint
+from backend.core.parallel import parallel_executor
+from backend.core.precision import cast_frame
+
+
+# 特征计算线程池（CPU 密集的指标计算不在事件循环线程中执行）
+_feature_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FEATURE_WORKERS", "0")) or os.cpu_count() or 1,
+    thread_name_prefix="feature"
+)
+
+# 特征计算方式：process 在常驻进程池中计算（多核并行，不占用 GIL），thread 在线程池中计算；
+# 默认多核时使用进程池
+FEATURE_EXECUTOR = os.getenv("FEATURE_EXECUTOR", "").lower() or ("process" if parallel_executor.max_workers > 1 else "thread")
+
+PACKED_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def pack_frame(df: pd.DataFrame) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """将K线压缩为 (日期 int64 数组, OHLCV float64 二维数组)，跨进程传输时不序列化 DataFrame"""
+    if 'date' in df.columns:
+        dates = pd.to_datetime(df['date'])
+    elif 'Date' in df.columns:
+        dates = pd.to_datetime(df['Date'])
+    elif isinstance(df.index, pd.DatetimeIndex):
+        dates = df.index.to_series()
+    else:
+        dates = None
+    if dates is not None:
+        # 带时区的日期保留本地时间
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+        dates = dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    values = np.column_stack([
+        pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64) if col in df.columns
+        else np.full(len(df), np.nan)
+        for col in PACKED_COLUMNS
+    ])
+    return dates, values
+
+
+def unpack_frame(dates: Optional[np.ndarray], values: np.ndarray) -> pd.DataFrame:
+    """由 pack_frame 的结果还原K线"""
+    frame = pd.DataFrame(values, columns=list(PACKED_COLUMNS))
+    if dates is not None:
+        frame.insert(0, 'date', pd.to_datetime(dates))
+    return frame
+
+
+def _compute_features_worker(symbol: str, dates: Optional[np.ndarray], values: np.ndarray) -> Dict[str, Any]:
+    """子进程：由压缩后的K线计算特征（子进程内的指标缓存各自独立）"""
+    return FeatureEngineerNode().compute(symbol, unpack_frame(dates, values))
+
+
+def _feature_worker_ready(_: int = 0) -> int:
+    """预热：导入特征计算依赖"""
+    return os.getpid()
 
 
 class FeatureEngineerNode:
     """特征工程节点"""
     
-    def __init__(self):
+    def __init__(self, executor: Optional[str] = None):
         self.indicators_calculator = TechnicalIndicators()
+        self.executor = executor or FEATURE_EXECUTOR
     
     def __call__(self, state: WorkflowState) -> Dict[str, Any]:
         """处理数据并计算技术指标"""
+        return self.compute(state.symbol, state.raw_data)
+    
+    def compute(self, symbol: str, raw_data: Optional[pd.DataFrame]) -> Dict[str, Any]:
+        """由原始K线计算指标快照、信号强度、支撑阻力位和特征"""
         try:
-            if state.raw_data is None or state.raw_data.empty:
+            if raw_data is None or raw_data.empty:
                 return {
                     "error": "No raw data available for processing",
-                    "processed_data": None,
                     "indicators": None
                 }
             
             # 数据预处理
-            processed_data = self._preprocess_data(state.raw_data)
+            processed_data = self._preprocess_data(raw_data)
             
             # 计算技术指标
-            indicators = self.indicators_calculator.calculate_all_indicators(processed_data)
+            indicators = self.indicators_calculator.calculate_all_indicators_cached(processed_data, symbol)
             
             # 计算信号强度
             signal_strength = self.indicators_calculator.get_signal_strength(indicators)
@@ -36,9 +101,10 @@ class FeatureEngineerNode:
             # 提取特征
             features = self._extract_features(processed_data, indicators, signal_strength)
             
+            # 下游节点只需要最新值：释放原始K线，指标只保留最新值快照
             return {
-                "processed_data": processed_data,
-                "indicators": indicators,
+                "raw_data": None,
+                "indicators": self._snapshot_indicators(indicators),
                 "signal_strength": signal_strength,
                 "support_resistance": support_resistance,
                 "features": features,
@@ -48,10 +114,61 @@ class FeatureEngineerNode:
         except Exception as e:
             return {
                 "error": f"Feature engineering failed: {str(e)}",
-                "processed_data": None,
                 "indicators": None
             }
     
+    async def acall(self, state: WorkflowState) -> Dict[str, Any]:
+        """处理数据并计算技术指标（异步版本，计算在进程池或特征线程池中执行，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        if self.executor == "process" and state.raw_data is not None and not state.raw_data.empty:
+            pool = parallel_executor.get_pool()
+            try:
+                future = pool.submit(_compute_features_worker, state.symbol, *pack_frame(state.raw_data))
+                return await asyncio.wrap_future(future)
+            except BrokenProcessPool as e:
+                # 子进程异常退出：丢弃该进程池（下次使用时重建），本次改在线程池中计算
+                print(f"Feature process pool broken, falling back to threads: {str(e)}")
+                parallel_executor.discard(pool)
+        return await loop.run_in_executor(_feature_executor, self, state)
+    
+    def warm_up(self):
+        """预先启动进程池并导入特征计算依赖（线程模式下无需预热）"""
+        if self.executor == "process":
+            parallel_executor.warm_up(_feature_worker_ready)
+    
+    def warm_indicator_cache(self, frames: Dict[str, pd.DataFrame]) -> int:
+        """批量预测：在进程池中预先计算一批股票的指标并写入指标缓存，返回写入数量"""
+        processed = {
+            symbol: self._preprocess_data(df) for symbol, df in frames.items()
+            if df is not None and len(df) >= 20
+        }
+        # 已在缓存中的股票不再计算
+        pending = {
+            symbol: df for symbol, df in processed.items()
+            if indicator_cache.get(data_fingerprint(symbol, df)) is None
+        }
+        if not pending:
+            return 0
+
+        warmed = 0
+        for symbol, values in parallel_executor.compute_indicators(pending).items():
+            if "error" in values:
+                continue
+            df = pending[symbol]
+            indicators = {name: pd.Series(array, index=df.index, name=name) for name, array in values.items()}
+            indicator_cache.put(data_fingerprint(symbol, df), indicators)
+            warmed += 1
+        return warmed
+    
+    @staticmethod
+    def _snapshot_indicators(indicators: Dict[str, Any]) -> Dict[str, Optional[float]]:
+        """各指标最新值（尚未形成的指标为 None）"""
+        snapshot = {}
+        for key, value in indicators.items():
+            latest = value.iloc[-1] if hasattr(value, 'iloc') and len(value) > 0 else value
+            snapshot[key] = None if latest is None or pd.isna(latest) else float(latest)
+        return snapshot
+    
     def _preprocess_data(self, data: pd.DataFrame) -> pd.DataFrame:
         """数据预处理"""
         df = data.copy()
@@ -59,23 +176,28 @@ class FeatureEngineerNode:
         # 确保日期列存在且为datetime类型
         if 'date' in df.columns:
             df['date'] = pd.to_datetime(df['date'])
-        elif df.index.name == 'Date' or 'Date' in df.columns:
+        elif df.index.name in ('date', 'Date') or 'Date' in df.columns:
             if 'Date' in df.columns:
                 df['date'] = pd.to_datetime(df['Date'])
             else:
                 df['date'] = pd.to_datetime(df.index)
+                df = df.reset_index(drop=True)
         
-        # 确保数值列为float类型
+        # 确保数值列为float类型（精度由 PRECISION 配置决定）
         numeric_columns = ['open', 'high', 'low', 'close', 'volume']
         for col in numeric_columns:
-            if col in df.columns:
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
                 df[col] = pd.to_numeric(df[col], errors='coerce')
+        df = cast_frame(df)
         
-        # 处理缺失值
-        df = df.ffill().bfill()
+        # 处理缺失值（数据完整时跳过）
+        if df.isna().to_numpy().any():
+            df = df.ffill().bfill()
         
-        # 按日期排序
-        df = df.sort_values('date').reset_index(drop=True)
+        # 按日期排序（已有序时只重建索引）
+        if not df['date'].is_monotonic_increasing:
+            df = df.sort_values('date')
+        df = df.reset_index(drop=True)
         
         return df
     
@@ -85,21 +207,41 @@ class FeatureEngineerNode:
         if data.empty:
             return {}
         
-        latest_data = data.iloc[-1]
+        # 价格和成交量特征只依赖最近若干根K线，直接在 numpy 数组上计算
+        close = data['close'].to_numpy(dtype=np.float64)
+        volume = data['volume'].to_numpy(dtype=np.float64)
+        volume_mean = volume.mean()
+        
+        def change(values: np.ndarray, periods: int) -> float:
+            if len(values) <= periods:
+                return 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return float(values[-1] / values[-1 - periods] - 1)
+        
+        def return_volatility(values: np.ndarray, periods: int) -> float:
+            if len(values) <= periods:
+                return 0
+            window = values[-1 - periods:]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = float(np.std(window[1:] / window[:-1] - 1, ddof=1))
+            return value if np.isfinite(value) else 0
+        
+        latest_date = data['date'].iloc[-1] if 'date' in data.columns else None
         
         features = {
             # 价格特征
-            "current_price": float(latest_data.get('close', 0)),
-            "price_change_1d": float(data['close'].pct_change().iloc[-1]) if len(data) > 1 else 0,
-            "price_change_5d": float(data['close'].pct_change(periods=5).iloc[-1]) if len(data) > 5 else 0,
-            "price_change_20d": float(data['close'].pct_change(periods=20).iloc[-1]) if len(data) > 20 else 0,
+            "current_price": float(close[-1]),
+            "price_change_1d": change(close, 1),
+            "price_change_5d": change(close, 5),
+            "price_change_20d": change(close, 20),
             
             # 成交量特征
-            "volume_ratio": float(latest_data.get('volume', 0) / data['volume'].mean()) if data['volume'].mean() > 0 else 1,
-            "volume_trend": float(data['volume'].pct_change().iloc[-1]) if len(data) > 1 else 0,
+            "volume_ratio": float(volume[-1] / volume_mean) if volume_mean > 0 else 1,
+            "volume_trend": change(volume, 1),
             
             # 波动率特征
-            "volatility_20d": float(data['close'].rolling(20).std().iloc[-1]) if len(data) > 20 else 0,
+            "volatility_20d": float(close[-20:].std(ddof=1)) if len(close) > 20 else 0,
+            "return_volatility_20d": return_volatility(close, 20),
             "atr": float(indicators.get('atr', pd.Series([0])).iloc[-1]) if 'atr' in indicators and len(indicators['atr']) > 0 else 0,
             
             # 技术指标特征
@@ -108,15 +250,15 @@ class FeatureEngineerNode:
             
             # 移动平均线特征
             "sma_5_20_ratio": float(indicators.get('sma_5', pd.Series([0])).iloc[-1] / indicators.get('sma_20', pd.Series([1])).iloc[-1]) if 'sma_5' in indicators and 'sma_20' in indicators else 1,
-            "price_sma_20_ratio": float(latest_data.get('close', 0) / indicators.get('sma_20', pd.Series([1])).iloc[-1]) if 'sma_20' in indicators else 1,
+            "price_sma_20_ratio": float(close[-1] / indicators.get('sma_20', pd.Series([1])).iloc[-1]) if 'sma_20' in indicators else 1,
             
             # 信号强度
             "signal_score": float(signal_strength.get('score', 0)),
             "signal_strength": signal_strength.get('strength', 'neutral'),
             
             # 时间特征
-            "day_of_week": latest_data['date'].dayofweek if 'date' in latest_data else 0,
-            "hour": latest_data['date'].hour if 'date' in latest_data else 12,
+            "day_of_week": latest_date.dayofweek if latest_date is not None else 0,
+            "hour": latest_date.hour if latest_date is not None else 12,
         }
         
         return features
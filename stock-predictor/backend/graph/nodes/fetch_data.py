@@ -1,47 +1,103 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
 import pandas as pd
 from backend.core.state import WorkflowState
 from backend.core.utils import StockDataFetcher
 
 
+# 根据时间框架确定数据周期
+PERIOD_MAP = {
+    "1h": "5d",  # 1小时预测需要5天数据
+    "1d": "1mo", # 1天预测需要1个月数据
+    "1w": "3mo"  # 1周预测需要3个月数据
+}
+
+# 各数据周期的回看长度（按从短到长排列）
+PERIOD_LOOKBACK = {
+    "5d": pd.DateOffset(days=5),
+    "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3),
+}
+
+
+def longest_timeframe(timeframes: List[str]) -> str:
+    """数据周期最长的时间框架（多时间框架预测只获取一次该周期的数据）"""
+    order = list(PERIOD_LOOKBACK)
+    return max(timeframes, key=lambda tf: order.index(PERIOD_MAP.get(tf, "1mo")))
+
+
+def slice_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    """从更长的历史数据中截取最近 period 的数据"""
+    if df is None or df.empty:
+        return df
+    dates = pd.to_datetime(df['date'] if 'date' in df.columns else df.index.to_series())
+    start = dates.iloc[-1] - PERIOD_LOOKBACK.get(period, PERIOD_LOOKBACK["1mo"])
+    return df[(dates >= start).to_numpy()]
+
+
 class FetchDataNode:
     """数据获取节点"""
     
-    def __init__(self):
-        self.data_fetcher = StockDataFetcher()
+    def __init__(self, data_fetcher=None):
+        # 可注入数据源（如历史回放时的时点数据源）
+        self.data_fetcher = data_fetcher or StockDataFetcher()
     
     def __call__(self, state: WorkflowState) -> Dict[str, Any]:
         """获取股票数据"""
         try:
             # 根据时间框架确定数据周期
-            period_map = {
-                "1h": "5d",  # 1小时预测需要5天数据
-                "1d": "1mo", # 1天预测需要1个月数据
-                "1w": "3mo"  # 1周预测需要3个月数据
-            }
-            
-            period = period_map.get(state.timeframe, "1mo")
-            
-            # 获取股票数据（使用同步方法）
-            raw_data = self.data_fetcher.fetch_stock_data_sync(state.symbol, period)
-            
-            if raw_data.empty:
-                return {
-                    "error": f"No data found for symbol: {state.symbol}",
-                    "raw_data": None
-                }
+            period = PERIOD_MAP.get(state.timeframe, "1mo")
             
-            # 生成缓存键
-            cache_key = f"{state.symbol}_{state.timeframe}_{period}"
+            # 获取股票数据（批量预测时数据已预先获取；回放时只读取 as_of 之前的数据）
+            if state.raw_data is not None and not state.raw_data.empty:
+                raw_data = state.raw_data
+            elif state.as_of is not None:
+                raw_data = self.data_fetcher.fetch_stock_data_sync(state.symbol, period, as_of=state.as_of)
+            else:
+                raw_data = self.data_fetcher.fetch_stock_data_sync(state.symbol, period)
             
+            return self._build_result(state, period, raw_data)
+        
+        except Exception as e:
             return {
-                "raw_data": raw_data,
-                "cache_key": cache_key,
-                "error": None
+                "error": f"Failed to fetch data: {str(e)}",
+                "raw_data": None
             }
+    
+    async def acall(self, state: WorkflowState) -> Dict[str, Any]:
+        """获取股票数据（异步版本，直接 await 数据源，不占用线程）"""
+        try:
+            period = PERIOD_MAP.get(state.timeframe, "1mo")
             
+            if state.raw_data is not None and not state.raw_data.empty:
+                raw_data = state.raw_data
+            elif state.as_of is not None:
+                raw_data = await self.data_fetcher.fetch_stock_data(state.symbol, period, as_of=state.as_of)
+            else:
+                raw_data = await self.data_fetcher.fetch_stock_data(state.symbol, period)
+            
+            return self._build_result(state, period, raw_data)
+        
         except Exception as e:
             return {
                 "error": f"Failed to fetch data: {str(e)}",
                 "raw_data": None
             }
+    
+    def _build_result(self, state: WorkflowState, period: str, raw_data: pd.DataFrame) -> Dict[str, Any]:
+        """生成节点输出"""
+        if raw_data.empty:
+            return {
+                "error": f"No data found for symbol: {state.symbol}",
+                "raw_data": None
+            }
+        
+        # 生成缓存键
+        cache_key = f"{state.symbol}_{state.timeframe}_{period}"
+        if state.as_of is not None:
+            cache_key += f"_{state.as_of.isoformat()}"
+        
+        return {
+            "raw_data": raw_data,
+            "cache_key": cache_key,
+            "error": None
+        }
@@ -1,53 +1,172 @@
-from typing import Dict, Any
+import os
+import time
+import inspect
+import asyncio
+from typing import Dict, Any, Callable, Optional
+from langchain_core.runnables import RunnableConfig
 from backend.core.state import WorkflowState
 from backend.core.llm_manager import get_llm_analyzer
+from backend.core.llm_batch import LLMBatcher, batch_llm_calls
+from backend.core.llm_scheduler import LLMScheduler, LLMOverloaded, llm_scheduler
 
 
 class LLMAnalyzeNode:
     """LLM 分析节点"""
     
-    def __init__(self):
-        self.llm = get_llm_analyzer()
+    def __init__(self, llm=None, max_concurrency: Optional[int] = None, scheduler: Optional[LLMScheduler] = None):
+        self.llm = llm or get_llm_analyzer()
+        # LLM 调用准入控制：默认与其他 LLM 调用共用全局调度器（指定 max_concurrency 时使用独立的调度器）
+        self.scheduler = scheduler or (LLMScheduler(max_concurrency) if max_concurrency else llm_scheduler)
+        # 批量预测时并发的分析请求合并为一次批量调用
+        self._batcher = LLMBatcher(self.llm)
+        # 健康状态：连续失败达到阈值后在冷却期内视为不可用（工作流改走规则分析）
+        self.failure_threshold = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))
+        self.failure_cooldown = float(os.getenv("LLM_FAILURE_COOLDOWN", "60"))
+        self._consecutive_failures = 0
+        self._unhealthy_until = 0.0
     
-    def __call__(self, state: WorkflowState) -> Dict[str, Any]:
-        """使用 LLM 分析股票"""
+    def is_available(self) -> bool:
+        """LLM 是否可用：模型已初始化且不在失败冷却期内"""
+        if getattr(self.llm, "llm", True) is None:
+            return False
+        return time.monotonic() >= self._unhealthy_until
+    
+    def __call__(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """使用 LLM 分析股票（config["configurable"]["on_token"] 可接收模型输出的文本片段）"""
         try:
-            if state.processed_data is None or state.indicators is None:
+            analysis_data = self._prepare_analysis_data(state)
+            if analysis_data is None:
                 return {
-                    "error": "No processed data or indicators available for analysis",
+                    "error": "No features or indicators available for analysis",
                     "llm_analysis": None
                 }
             
-            # 准备分析数据
-            analysis_data = {
-                "indicators": state.indicators,
-                "signal_strength": state.signal_strength,
-                "features": state.features,
-                "support_resistance": state.support_resistance,
-                "current_price": state.processed_data['close'].iloc[-1] if not state.processed_data.empty else 0
-            }
-            
-            # 使用 LLM 进行分析
-            llm_result = self.llm.analyze_stock(
-                symbol=state.symbol,
-                data=analysis_data,
-                timeframe=state.timeframe
-            )
+            # 使用 LLM 进行分析（排队等待调用名额）
+            with self.scheduler.slot():
+                llm_result = self.llm.analyze_stock(
+                    symbol=state.symbol,
+                    data=analysis_data,
+                    timeframe=state.timeframe,
+                    **self._stream_kwargs(config)
+                )
             
-            # 检查LLM结果是否包含错误
-            if llm_result.get("error"):
+            return self._build_result(llm_result)
+        
+        except LLMOverloaded as e:
+            return self._overloaded(e)
+        except Exception as e:
+            self._record_outcome(False)
+            return {
+                "error": f"LLM analysis failed: {str(e)}",
+                "llm_analysis": None
+            }
+    
+    async def acall(self, state: WorkflowState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """使用 LLM 分析股票（异步版本，分析器提供 aanalyze_stock 时直接异步调用，否则在线程中执行）"""
+        try:
+            analysis_data = self._prepare_analysis_data(state)
+            if analysis_data is None:
                 return {
-                    "llm_analysis": None,
-                    "error": llm_result["error"]
+                    "error": "No features or indicators available for analysis",
+                    "llm_analysis": None
                 }
             
-            return {
-                "llm_analysis": llm_result,
-                "error": None
-            }
+            if batch_llm_calls.get() and self._batcher.enabled and not self._stream_kwargs(config):
+                # 批量调用整体占用一个调用名额
+                llm_result = await self._batcher.analyze(
+                    state.symbol, analysis_data, state.timeframe, limiter=self.scheduler.aslot
+                )
+                return self._build_result(llm_result)
+            
+            # 在事件循环中排队等待，避免等待中的请求占用线程
+            async with self.scheduler.aslot():
+                aanalyze_stock = getattr(self.llm, "aanalyze_stock", None)
+                if aanalyze_stock is not None:
+                    llm_result = await aanalyze_stock(
+                        symbol=state.symbol,
+                        data=analysis_data,
+                        timeframe=state.timeframe,
+                        **self._stream_kwargs(config, aanalyze_stock)
+                    )
+                else:
+                    llm_result = await asyncio.to_thread(
+                        self.llm.analyze_stock,
+                        symbol=state.symbol,
+                        data=analysis_data,
+                        timeframe=state.timeframe,
+                        **self._stream_kwargs(config)
+                    )
             
+            return self._build_result(llm_result)
+        
+        except LLMOverloaded as e:
+            return self._overloaded(e)
         except Exception as e:
+            self._record_outcome(False)
             return {
                 "error": f"LLM analysis failed: {str(e)}",
                 "llm_analysis": None
             }
+    
+    def _stream_kwargs(self, config: Optional[RunnableConfig],
+                       method: Optional[Callable[..., Any]] = None) -> Dict[str, Callable[..., None]]:
+        """流式输出回调（调用方提供且分析方法支持时才传入）：on_token 接收输出片段，on_field 接收生成完毕的结果字段"""
+        configurable = (config or {}).get("configurable") or {}
+        callbacks = {name: configurable[name] for name in ("on_token", "on_field") if configurable.get(name) is not None}
+        if not callbacks:
+            return {}
+        parameters = inspect.signature(method or self.llm.analyze_stock).parameters
+        return {name: callback for name, callback in callbacks.items() if name in parameters}
+    
+    @staticmethod
+    def _overloaded(error: LLMOverloaded) -> Dict[str, Any]:
+        """调度器拒绝或排队超时：不计入健康状态，auto 模式随后降级为规则分析"""
+        return {
+            "error": f"LLM overloaded: {str(error)}",
+            "retry_after": error.retry_after,
+            "llm_analysis": None
+        }
+    
+    def _prepare_analysis_data(self, state: WorkflowState) -> Optional[Dict[str, Any]]:
+        """准备分析数据（缺少数据或指标时返回 None）"""
+        if state.features is None or state.indicators is None:
+            return None
+        
+        return {
+            "indicators": state.indicators,
+            "signal_strength": state.signal_strength,
+            "features": state.features,
+            "support_resistance": state.support_resistance,
+            "current_price": state.features.get("current_price", 0)
+        }
+    
+    def _record_outcome(self, success: bool):
+        """记录调用结果，更新健康状态"""
+        if success:
+            self._consecutive_failures = 0
+            return
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            self._unhealthy_until = time.monotonic() + self.failure_cooldown
+            self._consecutive_failures = 0
+    
+    def _build_result(self, llm_result: Dict[str, Any]) -> Dict[str, Any]:
+        """检查LLM结果是否包含错误"""
+        if llm_result.get("retry_after") is not None:
+            # 批量调用未获得调用名额
+            return {
+                "llm_analysis": None,
+                "error": llm_result["error"],
+                "retry_after": llm_result["retry_after"]
+            }
+        self._record_outcome(not llm_result.get("error"))
+        if llm_result.get("error"):
+            return {
+                "llm_analysis": None,
+                "error": llm_result["error"]
+            }
+        
+        return {
+            "llm_analysis": llm_result,
+            "error": None
+        }
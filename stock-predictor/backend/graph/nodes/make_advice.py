@@ -25,7 +25,7 @@ class MakeAdviceNode:
             confidence = analysis.get("confidence", "medium")
             
             # 计算价格区间
-            current_price = state.processed_data['close'].iloc[-1] if not state.processed_data.empty else 100
+            current_price = (state.features or {}).get("current_price") or 100
             price_change_decimal = price_change / 100
             
             if direction == "up":
@@ -66,6 +66,10 @@ class MakeAdviceNode:
                 "advice": None
             }
     
+    async def acall(self, state: WorkflowState) -> Dict[str, Any]:
+        """生成投资建议（异步版本，纯内存计算直接执行）"""
+        return self(state)
+    
     def _generate_risk_warning(self, direction: str, probability: float, risk_factors: list) -> str:
         """生成风险提示"""
         base_warning = "本预测仅用于学习研究目的，不构成投资建议。投资有风险，入市需谨慎。"
@@ -43,6 +43,10 @@ class ReportNode:
                 "prediction": None
             }
     
+    async def acall(self, state: WorkflowState) -> Dict[str, Any]:
+        """生成报告（异步版本，纯内存计算直接执行）"""
+        return self(state)
+    
     def _generate_analysis_summary(self, state: WorkflowState) -> str:
         """生成分析摘要"""
         summary_parts = []
@@ -63,7 +67,7 @@ class ReportNode:
         if state.support_resistance:
             support = state.support_resistance.get("support", 0)
             resistance = state.support_resistance.get("resistance", 0)
-            current_price = state.processed_data['close'].iloc[-1] if not state.processed_data.empty else 0
+            current_price = (state.features or {}).get("current_price", 0)
             
             if support > 0 and resistance > 0:
                 if current_price < support * 1.02:
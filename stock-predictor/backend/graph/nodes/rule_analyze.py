@@ -0,0 +1,48 @@
+from typing import Dict, Any
+from backend.core.state import WorkflowState
+from backend.core.rule_analyzer import rule_analyzer
+
+
+class RuleAnalyzeNode:
+    """规则分析节点（不调用 LLM，输出格式与 LLMAnalyzeNode 一致）"""
+    
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or rule_analyzer
+    
+    def __call__(self, state: WorkflowState) -> Dict[str, Any]:
+        """依据特征和信号强度生成分析结果"""
+        try:
+            if state.features is None:
+                return {
+                    "error": "No features available for rule analysis",
+                    "llm_analysis": None
+                }
+            
+            analysis_data = {
+                "indicators": state.indicators,
+                "signal_strength": state.signal_strength,
+                "features": state.features,
+                "support_resistance": state.support_resistance,
+                "current_price": state.features.get("current_price", 0)
+            }
+            
+            # LLM 分析失败后降级到此节点时，清除之前的错误并标记为降级结果
+            return {
+                "llm_analysis": self.analyzer.analyze_stock(
+                    symbol=state.symbol,
+                    data=analysis_data,
+                    timeframe=state.timeframe
+                ),
+                "llm_fallback": state.error is not None,
+                "error": None
+            }
+        
+        except Exception as e:
+            return {
+                "error": f"Rule analysis failed: {str(e)}",
+                "llm_analysis": None
+            }
+    
+    async def acall(self, state: WorkflowState) -> Dict[str, Any]:
+        """规则分析（异步版本，纯内存计算直接执行）"""
+        return self(state)
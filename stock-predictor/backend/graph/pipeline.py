@@ -1,113 +1,427 @@
-from typing import Dict, Any
+import os
+import asyncio
+from typing import Dict, Any, AsyncIterator, Iterable, List, Optional, Tuple
+from datetime import datetime
+import pandas as pd
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from backend.core.state import WorkflowState
-from backend.graph.nodes.fetch_data import FetchDataNode
+from langgraph.types import Send
+from backend.core.state import WorkflowState, MultiTimeframeState
+from backend.core.parallel import parallel_executor
+from backend.core.indicator_cache import data_fingerprint
+from backend.core.prediction_cache import prediction_cache, model_id
+from backend.core.llm_batch import batch_llm_calls
+from backend.core.llm_scheduler import llm_priority
+from backend.graph.nodes.fetch_data import FetchDataNode, PERIOD_MAP, longest_timeframe, slice_period
 from backend.graph.nodes.feature_engineer import FeatureEngineerNode
 from backend.graph.nodes.llm_analyze import LLMAnalyzeNode
+from backend.graph.nodes.rule_analyze import RuleAnalyzeNode
 from backend.graph.nodes.make_advice import MakeAdviceNode
 from backend.graph.nodes.report import ReportNode
 
 
+# 分析方式：auto 按 LLM 健康状态和信号明确程度自动选择，llm / rules 强制指定
+ANALYSIS_MODES = ("auto", "llm", "rules")
+
+
 class StockPredictionPipeline:
     """股票预测 LangGraph 工作流"""
     
-    def __init__(self):
-        # 初始化节点
-        self.fetch_data_node = FetchDataNode()
+    def __init__(self, data_fetcher=None, llm=None):
+        # 信号得分绝对值达到该阈值时，auto 模式直接使用规则分析
+        self.fast_path_score = float(os.getenv("RULE_FAST_PATH_SCORE", "3"))
+        
+        # 初始化节点（data_fetcher / llm 可注入，用于历史回放和评估）
+        self.fetch_data_node = FetchDataNode(data_fetcher)
         self.feature_engineer_node = FeatureEngineerNode()
-        self.llm_analyze_node = LLMAnalyzeNode()
+        self.llm_analyze_node = LLMAnalyzeNode(llm)
+        self.rule_analyze_node = RuleAnalyzeNode()
         self.make_advice_node = MakeAdviceNode()
         self.report_node = ReportNode()
         
         # 构建工作流图
         self.workflow = self._build_workflow()
+        self.multi_workflow = self._build_multi_workflow()
     
     def _build_workflow(self) -> StateGraph:
         """构建 LangGraph 工作流"""
         workflow = StateGraph(WorkflowState)
         
-        # 添加节点
-        workflow.add_node("fetch_data", self.fetch_data_node)
-        workflow.add_node("feature_engineer", self.feature_engineer_node)
-        workflow.add_node("llm_analyze", self.llm_analyze_node)
-        workflow.add_node("make_advice", self.make_advice_node)
-        workflow.add_node("report", self.report_node)
+        # 添加节点（invoke 使用同步实现，ainvoke 使用异步实现）
+        workflow.add_node("fetch_data", self._node(self.fetch_data_node))
+        workflow.add_node("feature_engineer", self._node(self.feature_engineer_node))
+        workflow.add_node("llm_analyze", self._node(self.llm_analyze_node))
+        workflow.add_node("rule_analyze", self._node(self.rule_analyze_node))
+        workflow.add_node("make_advice", self._node(self.make_advice_node))
+        workflow.add_node("report", self._node(self.report_node))
         
         # 设置入口点
         workflow.set_entry_point("fetch_data")
         
         # 添加边
         workflow.add_edge("fetch_data", "feature_engineer")
-        workflow.add_edge("feature_engineer", "llm_analyze")
-        workflow.add_edge("llm_analyze", "make_advice")
+        workflow.add_conditional_edges("feature_engineer", self._route_analysis,
+                                       ["llm_analyze", "rule_analyze"])
+        workflow.add_conditional_edges("llm_analyze", self._route_after_llm,
+                                       ["rule_analyze", "make_advice", END])
+        workflow.add_edge("rule_analyze", "make_advice")
         workflow.add_edge("make_advice", "report")
         workflow.add_edge("report", END)
         
         # 编译工作流
         return workflow.compile()
     
-    async def predict(self, symbol: str, timeframe: str) -> Dict[str, Any]:
-        """执行预测工作流"""
+    def _build_multi_workflow(self) -> StateGraph:
+        """构建多时间框架工作流：获取一次数据后，每个时间框架一个并行分支"""
+        workflow = StateGraph(MultiTimeframeState)
+        
+        workflow.add_node("fetch_data", RunnableLambda(self._fetch_multi, afunc=self._afetch_multi, name="FetchDataNode"))
+        workflow.add_node("timeframe_branch", RunnableLambda(self._run_branch, afunc=self._arun_branch, name="TimeframeBranch"))
+        
+        workflow.set_entry_point("fetch_data")
+        workflow.add_conditional_edges("fetch_data", self._fan_out_timeframes, ["timeframe_branch", END])
+        workflow.add_edge("timeframe_branch", END)
+        
+        return workflow.compile()
+    
+    def _longest_state(self, state: MultiTimeframeState) -> WorkflowState:
+        """以数据周期最长的时间框架获取数据"""
+        return WorkflowState(
+            symbol=state.symbol,
+            timeframe=longest_timeframe(state.timeframes),
+            as_of=state.as_of,
+            raw_data=state.raw_data
+        )
+    
+    def _fetch_multi(self, state: MultiTimeframeState) -> Dict[str, Any]:
+        """获取最长周期的数据"""
+        return self._keep_fetch_fields(self.fetch_data_node(self._longest_state(state)))
+    
+    async def _afetch_multi(self, state: MultiTimeframeState) -> Dict[str, Any]:
+        """获取最长周期的数据（异步版本）"""
+        return self._keep_fetch_fields(await self.fetch_data_node.acall(self._longest_state(state)))
+    
+    @staticmethod
+    def _keep_fetch_fields(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {"raw_data": result.get("raw_data"), "error": result.get("error")}
+    
+    @staticmethod
+    def _fan_out_timeframes(state: MultiTimeframeState) -> List[Any]:
+        """每个时间框架截取各自周期的数据，发送到独立分支并行执行"""
+        if state.error or state.raw_data is None:
+            return [END]
+        return [
+            Send("timeframe_branch", WorkflowState(
+                symbol=state.symbol,
+                timeframe=timeframe,
+                as_of=state.as_of,
+                analysis_mode=state.analysis_mode,
+                raw_data=slice_period(state.raw_data, PERIOD_MAP.get(timeframe, "1mo"))
+            ))
+            for timeframe in state.timeframes
+        ]
+    
+    def _run_branch(self, state: WorkflowState) -> Dict[str, Any]:
+        """单个时间框架分支：数据已就绪，从特征工程开始执行单时间框架工作流"""
+        try:
+            result = self._format_result(self.workflow.invoke(state))
+        except Exception as e:
+            result = {"error": f"Workflow execution failed: {str(e)}"}
+        return {"predictions": {state.timeframe: result}}
+    
+    async def _arun_branch(self, state: WorkflowState) -> Dict[str, Any]:
+        """单个时间框架分支（异步版本）"""
+        try:
+            result = self._format_result(await self.workflow.ainvoke(state))
+        except Exception as e:
+            result = {"error": f"Workflow execution failed: {str(e)}"}
+        return {"predictions": {state.timeframe: result}}
+    
+    def _route_analysis(self, state: WorkflowState) -> str:
+        """选择分析节点：指定 rules、LLM 不可用或信号足够明确时走规则分析"""
+        if state.analysis_mode == "rules":
+            return "rule_analyze"
+        if state.analysis_mode == "auto":
+            score = abs(float((state.signal_strength or {}).get("score", 0) or 0))
+            if score >= self.fast_path_score or not self.llm_analyze_node.is_available():
+                return "rule_analyze"
+        return "llm_analyze"
+    
+    @staticmethod
+    def _route_after_llm(state: WorkflowState) -> str:
+        """auto 模式下 LLM 分析失败（含排队已满、排队超时）时降级为规则分析；
+        指定 llm 模式时排队失败直接结束，保留错误和重试间隔"""
+        if state.llm_analysis is None and state.analysis_mode == "auto" and state.features is not None:
+            return "rule_analyze"
+        if state.llm_analysis is None and state.retry_after is not None:
+            return END
+        return "make_advice"
+    
+    @staticmethod
+    def _node(node) -> RunnableLambda:
+        """将节点包装为同时支持同步和异步调用的 Runnable"""
+        return RunnableLambda(node.__call__, afunc=node.acall, name=type(node).__name__)
+    
+    async def predict(self, symbol: str, timeframe: str, as_of: Optional[datetime] = None,
+                      raw_data: Optional[pd.DataFrame] = None, use_cache: bool = True,
+                      mode: str = "auto") -> Dict[str, Any]:
+        """执行预测工作流（as_of 用于历史时点回放；raw_data 为预先获取的数据，批量预测时使用；
+        mode 为分析方式，见 ANALYSIS_MODES）
+
+        实时预测按 (股票, 时间框架, 数据指纹, 模型, 分析方式) 缓存结果，相同请求并发时共享同一次工作流执行。
+        """
+        symbol = symbol.upper()
+        if not use_cache or as_of is not None:
+            return await self._run_workflow(symbol, timeframe, as_of, raw_data, mode)
+        
+        period = PERIOD_MAP.get(timeframe, "1mo")
+        model = f"{model_id(self.llm_analyze_node.llm)}:{mode}"
+        flight_key = prediction_cache.make_key(symbol, timeframe, period, model)
+        if raw_data is not None and not raw_data.empty:
+            flight_key = prediction_cache.make_key(symbol, timeframe, period, model, data_fingerprint(symbol, raw_data))
+        return await prediction_cache.single_flight(
+            flight_key, lambda: self._predict_cached(symbol, timeframe, period, model, raw_data, mode)
+        )
+    
+    async def _predict_cached(self, symbol: str, timeframe: str, period: str, model: str,
+                              raw_data: Optional[pd.DataFrame], mode: str = "auto") -> Dict[str, Any]:
+        """获取数据后按数据指纹查缓存，未命中时执行工作流并缓存结果（错误结果不缓存，降级为规则分析的结果短期缓存）"""
+        try:
+            if raw_data is None or raw_data.empty:
+                raw_data = await self.fetch_data_node.data_fetcher.fetch_stock_data(symbol, period)
+        except Exception as e:
+            print(f"Prediction cache prefetch failed for {symbol}: {str(e)}")
+            raw_data = None
+        if raw_data is None or raw_data.empty:
+            # 无法确定数据指纹时不缓存，由 FetchDataNode 报告错误
+            return await self._run_workflow(symbol, timeframe, None, None, mode)
+        
+        key = prediction_cache.make_key(symbol, timeframe, period, model, data_fingerprint(symbol, raw_data))
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        result = await self._run_workflow(symbol, timeframe, None, raw_data, mode)
+        if not result.get("error"):
+            # LLM 失败或排队已满时降级得到的规则分析结果（按设计走规则分析的结果正常缓存）
+            prediction_cache.put(key, timeframe, result, fallback=result.get("fallback", False))
+        return result
+    
+    async def _run_workflow(self, symbol: str, timeframe: str, as_of: Optional[datetime],
+                            raw_data: Optional[pd.DataFrame], mode: str = "auto") -> Dict[str, Any]:
+        """执行一次完整工作流"""
         try:
             # 创建初始状态
             initial_state = WorkflowState(
                 symbol=symbol.upper(),
-                timeframe=timeframe
+                timeframe=timeframe,
+                as_of=as_of,
+                analysis_mode=mode,
+                raw_data=raw_data
             )
             
             # 执行工作流
             result = await self.workflow.ainvoke(initial_state)
             
-            # 检查是否有错误
-            if result.get("error"):
-                return {"error": result["error"]}
-            
-            # 返回预测结果
-            prediction = result.get("prediction")
-            if prediction:
-                return {
-                    "direction": prediction["direction"],
-                    "probability": prediction["probability"],
-                    "price_range": prediction["price_range"],
-                    "confidence": prediction["confidence"],
-                    "reasoning": prediction["reasoning"],
-                    "risk_warning": prediction["risk_warning"]
-                }
-            else:
-                return {"error": "No prediction generated"}
+            return self._format_result(result)
                 
         except Exception as e:
             return {"error": f"Workflow execution failed: {str(e)}"}
     
-    def predict_sync(self, symbol: str, timeframe: str) -> Dict[str, Any]:
+    @staticmethod
+    def _format_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """从工作流最终状态中提取预测结果"""
+        # 检查是否有错误（LLM 排队失败时附带建议的重试间隔）
+        if result.get("error"):
+            if result.get("retry_after") is not None:
+                return {"error": result["error"], "retry_after": result["retry_after"]}
+            return {"error": result["error"]}
+        
+        # 返回预测结果
+        prediction = result.get("prediction")
+        if prediction:
+            return {
+                "direction": prediction["direction"],
+                "probability": prediction["probability"],
+                "price_range": prediction["price_range"],
+                "confidence": prediction["confidence"],
+                "reasoning": prediction["reasoning"],
+                "risk_warning": prediction["risk_warning"],
+                "analyzer": (result.get("llm_analysis") or {}).get("analyzer", "llm"),
+                "fallback": result.get("llm_fallback", False)
+            }
+        else:
+            return {"error": "No prediction generated"}
+    
+    async def predict_stream(self, symbol: str, timeframe: str, mode: str = "auto") -> AsyncIterator[Dict[str, Any]]:
+        """流式预测：立即产出 start 事件，每个节点完成时产出 node 事件，LLM 输出逐段产出 token 事件，
+        LLM 结果的每个字段（direction、probability 等）生成完毕时产出 field 事件，最后产出 result（或 error）事件
+
+        事件格式为 {"event": 类型, "node": 节点名（仅 node 事件）, "data": 内容}。
+        """
+        symbol = symbol.upper()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        
+        def on_token(text: str):
+            # LLM 在工作线程中回调，切回事件循环线程入队
+            loop.call_soon_threadsafe(queue.put_nowait, {"event": "token", "data": text})
+        
+        def on_field(name: str, value: Any):
+            loop.call_soon_threadsafe(queue.put_nowait, {"event": "field", "data": {name: value}})
+        
+        async def _run():
+            final: Dict[str, Any] = {}
+            try:
+                initial_state = WorkflowState(symbol=symbol, timeframe=timeframe, analysis_mode=mode)
+                async for update in self.workflow.astream(initial_state, stream_mode="updates",
+                                                          config={"configurable": {"on_token": on_token, "on_field": on_field}}):
+                    for node, values in update.items():
+                        final.update(values or {})
+                        await queue.put({"event": "node", "node": node, "data": self._summarize_update(values or {})})
+                result = self._format_result(final)
+            except Exception as e:
+                result = {"error": f"Workflow execution failed: {str(e)}"}
+            await queue.put({"event": "error" if result.get("error") else "result", "data": result})
+            await queue.put(done)
+        
+        yield {"event": "start", "data": {"symbol": symbol, "timeframe": timeframe, "mode": mode}}
+        task = asyncio.create_task(_run())
+        try:
+            while (event := await queue.get()) is not done:
+                yield event
+        finally:
+            # 调用方提前结束（如客户端断开）时取消工作流
+            task.cancel()
+    
+    @staticmethod
+    def _summarize_update(update: Dict[str, Any]) -> Dict[str, Any]:
+        """节点输出摘要：原始K线只保留行数、起止日期和最新收盘价，空字段省略"""
+        summary = {}
+        for key, value in update.items():
+            if isinstance(value, pd.DataFrame):
+                dates = pd.Index(value['date'] if 'date' in value.columns else value.index)
+                summary[key] = {
+                    "rows": len(value),
+                    "start": str(dates[0]) if len(value) else None,
+                    "end": str(dates[-1]) if len(value) else None,
+                    "last_close": float(value['close'].iloc[-1]) if len(value) and 'close' in value.columns else None
+                }
+            elif value is not None:
+                summary[key] = value
+        return summary
+    
+    async def predict_multi(self, symbol: str, timeframes: Iterable[str] = ("1h", "1d", "1w"),
+                            as_of: Optional[datetime] = None, raw_data: Optional[pd.DataFrame] = None,
+                            mode: str = "auto") -> Dict[str, Any]:
+        """同一股票的多个时间框架一次预测：数据只获取一次，各时间框架在并行分支中分析
+
+        返回 {"symbol", "predictions": {时间框架: 预测结果或 {"error"}}}，数据获取失败时返回 {"error"}。
+        """
+        timeframes = list(dict.fromkeys(timeframes))
+        if not timeframes:
+            return {"error": "No timeframes requested"}
+        
+        try:
+            result = await self.multi_workflow.ainvoke(MultiTimeframeState(
+                symbol=symbol.upper(),
+                timeframes=timeframes,
+                as_of=as_of,
+                analysis_mode=mode,
+                raw_data=raw_data
+            ))
+        except Exception as e:
+            return {"error": f"Workflow execution failed: {str(e)}"}
+        
+        if result.get("error"):
+            return {"error": result["error"]}
+        predictions = result.get("predictions") or {}
+        return {
+            "symbol": symbol.upper(),
+            "predictions": {timeframe: predictions.get(timeframe, {"error": "No prediction generated"})
+                            for timeframe in timeframes}
+        }
+    
+    async def predict_many(self, requests: Iterable[Tuple[str, str]],
+                           max_concurrency: Optional[int] = None,
+                           mode: str = "auto") -> AsyncIterator[Dict[str, Any]]:
+        """批量预测多个 (股票, 时间框架)，每完成一个立即产出结果
+
+        同一数据周期的股票合并为一次批量数据请求，指标在进程池中预先计算，
+        工作流并发数受 max_concurrency 限制，LLM 调用按 batch 优先级在全局 LLM 调度器中排队
+        （交互式单次预测优先），同时等待 LLM 的分析合并为多股票的批量调用。
+        """
+        pairs = list(dict.fromkeys((symbol.upper(), timeframe) for symbol, timeframe in requests))
+        if not pairs:
+            return
+
+        semaphore = asyncio.Semaphore(max_concurrency or int(os.getenv("BATCH_MAX_CONCURRENCY", "16")))
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: List[asyncio.Task] = []
+
+        async def _run(symbol: str, timeframe: str, raw_data: Optional[pd.DataFrame]):
+            # 各任务的 LLM 分析合并为批量调用，按 batch 优先级排队（只影响本任务的上下文）
+            batch_llm_calls.set(True)
+            llm_priority.set("batch")
+            try:
+                async with semaphore:
+                    result = await self.predict(symbol, timeframe, raw_data=raw_data, mode=mode)
+            except Exception as e:
+                result = {"error": f"Workflow execution failed: {str(e)}"}
+            await queue.put({"symbol": symbol, "timeframe": timeframe, **result})
+
+        async def _prepare(period: str, group: List[Tuple[str, str]]):
+            # 预取失败时不带数据运行，由 FetchDataNode 自行获取
+            try:
+                frames = await self._prefetch([symbol for symbol, _ in group], period)
+            except Exception as e:
+                print(f"Batch prefetch failed for period {period}: {str(e)}")
+                frames = {}
+            for symbol, timeframe in group:
+                tasks.append(asyncio.create_task(_run(symbol, timeframe, frames.get(symbol))))
+
+        # 按数据周期分组，各组预取完成后立即开始预测
+        groups: Dict[str, List[Tuple[str, str]]] = {}
+        for symbol, timeframe in pairs:
+            groups.setdefault(PERIOD_MAP.get(timeframe, "1mo"), []).append((symbol, timeframe))
+        prepare_tasks = [asyncio.create_task(_prepare(period, group)) for period, group in groups.items()]
+
+        try:
+            for _ in range(len(pairs)):
+                yield await queue.get()
+        finally:
+            # 调用方提前结束（如客户端断开）时取消剩余任务
+            for task in prepare_tasks + tasks:
+                task.cancel()
+
+    async def _prefetch(self, symbols: List[str], period: str) -> Dict[str, pd.DataFrame]:
+        """批量获取数据，并在进程池中预先计算指标"""
+        fetch_many = getattr(self.fetch_data_node.data_fetcher, "fetch_many", None)
+        if fetch_many is None:
+            return {}
+
+        frames = await fetch_many(symbols, period)
+        # 特征计算本身在进程池中执行时，各预测已按进程并行，无需预先批量计算
+        if len(frames) > 1 and parallel_executor.max_workers > 1 and self.feature_engineer_node.executor != "process":
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.feature_engineer_node.warm_indicator_cache, frames)
+        return frames
+    
+    def predict_sync(self, symbol: str, timeframe: str, mode: str = "auto") -> Dict[str, Any]:
         """同步执行预测工作流"""
         try:
             # 创建初始状态
             initial_state = WorkflowState(
                 symbol=symbol.upper(),
-                timeframe=timeframe
+                timeframe=timeframe,
+                analysis_mode=mode
             )
             
             # 执行工作流
             result = self.workflow.invoke(initial_state)
             
-            # 检查是否有错误
-            if result.get("error"):
-                return {"error": result["error"]}
-            
-            # 返回预测结果
-            prediction = result.get("prediction")
-            if prediction:
-                return {
-                    "direction": prediction["direction"],
-                    "probability": prediction["probability"],
-                    "price_range": prediction["price_range"],
-                    "confidence": prediction["confidence"],
-                    "reasoning": prediction["reasoning"],
-                    "risk_warning": prediction["risk_warning"]
-                }
-            else:
-                return {"error": "No prediction generated"}
+            return self._format_result(result)
                 
         except Exception as e:
             return {"error": f"Workflow execution failed: {str(e)}"}